@@ -0,0 +1,162 @@
+"""
+admission.py — Rate limiting and overload shedding for incoming work.
+
+RateLimiter: one token bucket per key (user id, room id). A bucket holds up
+to `burst` tokens and refills at `rate` tokens per second; each message
+costs one token. `acquire()` either admits now, admits after a short delay
+(the caller sleeps, which also stops it reading from that client) or
+rejects with the time until enough tokens are back. A request costing more
+than `burst` (a bulk upload) is admitted with a full bucket and leaves it
+in debt, so bulk senders are paced to `rate` messages per second overall.
+`acquire_all()` charges several keys for one request (a bulk upload for
+many users) all-or-nothing: if any key would be rejected, none is charged.
+Buckets are created on first use and idle ones (back to full) are dropped
+by `prune()`.
+
+LoadShedder: takes event-loop lag samples (how late a timer fires) plus the
+number of frames queued for clients, and flags the process as overloaded
+while either is above its limit. It only clears once both are back under
+half the limit, so it does not flap. Samples come from whoever already
+measures lag (`observe()`, fed by the server's LoopMonitor), or from the
+shedder's own timer every `interval` seconds after `start()`.
+
+Everything runs on the event loop and nothing awaits in between, so the
+hot path is plain arithmetic on a dict entry and an attribute read: no
+locks.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class RateLimiter:
+    __slots__ = ("rate", "burst", "_buckets")
+
+    def __init__(self, rate: float, burst: float) -> None:
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate must be positive and burst at least 1")
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[str, List[float]] = {}  # key -> [tokens, last refill]
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def acquire(self, key: str, cost: float = 1, max_delay: float = 0.0) -> Tuple[bool, float]:
+        """
+        (True, delay): admitted, the tokens are taken; go ahead after `delay`
+        seconds (0 = now, at most `max_delay`). (False, retry_after):
+        rejected, nothing taken.
+        """
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+        else:
+            tokens = bucket[0] + (now - bucket[1]) * self.rate
+            bucket[0] = tokens if tokens < self.burst else self.burst
+            bucket[1] = now
+        delay = self._delay(bucket, cost)
+        if delay > max_delay:
+            return False, delay
+        bucket[0] -= cost
+        return True, delay
+
+    def acquire_all(self, costs: Dict[str, float], max_delay: float = 0.0) -> Tuple[bool, float, Optional[str]]:
+        """
+        acquire() for several keys at once: (True, delay, key) with every
+        key charged, or (False, retry_after, key) with none charged. The
+        delay is the longest any key needs and `key` the one needing it
+        (None if no key has to wait).
+        """
+        now = time.monotonic()
+        buckets = []
+        delay = 0.0
+        slowest = None
+        for key, cost in costs.items():
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+            else:
+                tokens = bucket[0] + (now - bucket[1]) * self.rate
+                bucket[0] = tokens if tokens < self.burst else self.burst
+                bucket[1] = now
+            buckets.append((bucket, cost))
+            wait = self._delay(bucket, cost)
+            if wait > delay:
+                delay, slowest = wait, key
+        if delay > max_delay:
+            return False, delay, slowest
+        for bucket, cost in buckets:
+            bucket[0] -= cost
+        return True, delay, slowest
+
+    def _delay(self, bucket: List[float], cost: float) -> float:
+        # Seconds until the (refilled) bucket can cover cost, capped at burst
+        needed = cost if cost < self.burst else self.burst
+        return (needed - bucket[0]) / self.rate if bucket[0] < needed else 0.0
+
+    def prune(self) -> int:
+        # Forget buckets that have refilled completely (same as a new one)
+        now = time.monotonic()
+        full = [
+            key for key, (tokens, last) in self._buckets.items()
+            if tokens + (now - last) * self.rate >= self.burst
+        ]
+        for key in full:
+            del self._buckets[key]
+        return len(full)
+
+
+class LoadShedder:
+    def __init__(self, max_lag: float, max_queued: int, queued: Callable[[], int], interval: float = 0.05) -> None:
+        self.max_lag = max_lag        # seconds; 0 disables the lag check
+        self.max_queued = max_queued  # frames; 0 disables the queue check
+        self.interval = interval
+        self._queued = queued
+        self.lag = 0.0                # smoothed lag of the last samples
+        self.overloaded = False
+        self.episodes = 0             # times the shedder switched on
+        self._due = 0.0
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_lag or self.max_queued)
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._due = self._loop.time() + self.interval
+        self._handle = self._loop.call_at(self._due, self._sample)
+
+    def close(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self.overloaded = False
+
+    def _sample(self) -> None:
+        now = self._loop.time()
+        self.observe(max(0.0, now - self._due))
+        self._due = now + self.interval
+        self._handle = self._loop.call_at(self._due, self._sample)
+
+    def observe(self, lag: float) -> None:
+        """Take one lag sample and re-evaluate (also checks the queue)."""
+        if not self.enabled:
+            return
+        # Smooth over a few samples: one slow callback is not an overload,
+        # a loop that is late on every sample is
+        self.lag = self.lag * 0.7 + lag * 0.3
+        queued = self._queued()
+        if self.overloaded:
+            if (not self.max_lag or self.lag < self.max_lag / 2) and (not self.max_queued or queued < self.max_queued / 2):
+                self.overloaded = False
+        elif (self.max_lag and self.lag > self.max_lag) or (self.max_queued and queued > self.max_queued):
+            self.overloaded = True
+            self.episodes += 1
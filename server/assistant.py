@@ -0,0 +1,70 @@
+"""
+assistant.py — Pluggable generator backends for streamed assistant replies.
+
+A backend turns a conversation into a reply streamed in pieces:
+`stream(messages)` is an async iterator of text deltas, where `messages`
+is the context in chronological order as {"role", "text"} dicts. The
+server forwards every delta to the user's connections as soon as it
+arrives and stores the concatenated reply once, when the stream ends.
+Cancelling the consuming task (client gone, explicit cancel, timeout)
+closes the iterator, so a backend holding a network stream should
+release it in a `finally`.
+
+Backends are selected with ASSISTANT_BACKEND:
+  stub                 StubBackend, a local echo for tests and load runs
+  package.module:name  `name` is called with no arguments and must return
+                       a Backend (or anything with the same methods)
+"""
+from __future__ import annotations
+
+import asyncio
+import importlib
+import re
+from typing import AsyncIterator, Dict, List
+
+LOREM = (
+    "This is a streamed reply from the local stub backend. It arrives a few "
+    "words at a time so clients can render the answer while it is still "
+    "being generated, the same way a real model would send its tokens."
+)
+
+
+class Backend:
+    name = "base"
+
+    def stream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class StubBackend(Backend):
+    """Echoes the last user message, then some filler, word by word."""
+
+    name = "stub"
+
+    def __init__(self, first_token_delay: float = 0.2, token_delay: float = 0.02) -> None:
+        self.first_token_delay = first_token_delay  # simulated time to first token
+        self.token_delay = token_delay              # simulated time between tokens
+
+    async def stream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        prompt = next((m.get("text", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        reply = f'You said: "{prompt}". {LOREM}' if prompt else LOREM
+        await asyncio.sleep(self.first_token_delay)
+        for i, word in enumerate(re.findall(r"\S+\s*", reply)):
+            if i and self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield word
+
+
+def load_backend(spec: str) -> Backend:
+    """Instantiate the backend named by "package.module:factory"."""
+    module_name, _, attr = spec.partition(":")
+    if not module_name or not attr:
+        raise ValueError(f"assistant backend must be 'stub' or 'package.module:factory', got {spec!r}")
+    factory = getattr(importlib.import_module(module_name), attr)
+    backend = factory()
+    if not callable(getattr(backend, "stream", None)):
+        raise ValueError(f"{spec} did not return an assistant backend (no stream() method)")
+    return backend
@@ -0,0 +1,224 @@
+"""
+backplane.py — Cross-worker pub/sub for the realtime Hub.
+
+The Hub always delivers to its own connections directly; a backplane only
+forwards events to the *other* workers, which deliver them to theirs.
+
+  - Backplane            : single process, publishing is a no-op (default)
+  - UnixSocketBackplane  : local IPC for `uvicorn --workers N`, no outside
+                           service. Every worker listens on its own Unix
+                           socket in a shared directory and keeps one stream
+                           to every peer (full mesh), so an event costs one
+                           buffered write per peer and ordering per sender is
+                           preserved.
+
+`publish()` is synchronous on purpose: it only appends to socket buffers,
+so callers can publish right after a store append without yielding to the
+event loop in between. `send()` is the same for one peer only (history
+catch-up of a worker that starts next to running ones).
+
+Wire format (per event): header `!BHHI` = topic, len(key), len(extra),
+len(body), followed by key, extra and body as UTF-8.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import struct
+from typing import Callable, Dict, List, Optional, Set
+
+Handler = Callable[[str, str, Optional[str], str], None]  # (topic, key, extra, body)
+
+log = logging.getLogger("realtime.backplane")
+
+_HEADER = struct.Struct("!BHHI")
+_HELLO = struct.Struct("!H")
+
+
+class Backplane:
+    """In-process backplane: nothing to forward, there is only one worker."""
+
+    name = "inproc"
+    ident = ""
+
+    async def start(self, handler: Handler) -> None:
+        self._handler = handler
+
+    def publish(self, topic: str, key: str, body: str, extra: Optional[str] = None) -> None:
+        pass
+
+    def send(self, peer: str, topic: str, key: str, body: str, extra: Optional[str] = None) -> bool:
+        return False
+
+    def peers(self) -> int:
+        return 0
+
+    def peer_ids(self) -> List[str]:
+        return []
+
+    async def close(self) -> None:
+        pass
+
+
+def encode_event(topic: str, key: str, body: str, extra: Optional[str] = None) -> bytes:
+    k = key.encode("utf-8")
+    e = extra.encode("utf-8") if extra is not None else b""
+    b = body.encode("utf-8")
+    # Empty extra and "no extra" are the same on the wire; callers never use ""
+    return _HEADER.pack(ord(topic), len(k), len(e), len(b)) + k + e + b
+
+
+class UnixSocketBackplane(Backplane):
+    """Full-mesh backplane over Unix domain sockets in `directory`."""
+
+    name = "unix"
+
+    def __init__(self, directory: str, scan_interval: float = 1.0, max_buffer: int = 16 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.scan_interval = scan_interval
+        self.max_buffer = max_buffer  # a peer further behind than this is disconnected
+        self.ident = f"{os.getpid()}"
+        self.path = os.path.join(directory, f"{self.ident}.sock")
+
+        self._peers: Dict[str, asyncio.StreamWriter] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._handler: Optional[Handler] = None
+
+    # ---------------------- lifecycle ----------------------
+
+    async def start(self, handler: Handler) -> None:
+        self._handler = handler
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._on_accept, path=self.path)
+        await self._scan()
+        self._spawn(self._scan_loop())
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        for writer in self._peers.values():
+            writer.close()
+        self._peers.clear()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    # ---------------------- discovery ----------------------
+
+    async def _scan_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.scan_interval)
+            await self._scan()
+
+    async def _scan(self) -> None:
+        # Dial every peer socket we are not yet connected to. Sockets nobody
+        # listens on any more belong to dead workers and are removed.
+        for name in os.listdir(self.directory):
+            if not name.endswith(".sock"):
+                continue
+            ident = name[:-5]
+            if ident == self.ident or ident in self._peers:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                reader, writer = await asyncio.open_unix_connection(path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            except OSError:
+                continue
+            if ident in self._peers:  # the peer dialed us meanwhile
+                writer.close()
+                continue
+            me = self.ident.encode("utf-8")
+            writer.write(_HELLO.pack(len(me)) + me)
+            self._register(ident, reader, writer)
+
+    async def _on_accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # A dialing peer introduces itself first; the stream is then used in
+        # both directions, so a freshly started worker is reachable at once.
+        try:
+            (n,) = _HELLO.unpack(await reader.readexactly(_HELLO.size))
+            ident = (await reader.readexactly(n)).decode("utf-8")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        if ident in self._peers:
+            # Both sides dialed at once: keep reading, but write on one stream
+            self._spawn(self._read_loop(ident, reader, writer, owned=False))
+            return
+        self._register(ident, reader, writer)
+
+    def _register(self, ident: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._peers[ident] = writer
+        self._spawn(self._read_loop(ident, reader, writer, owned=True))
+
+    def peers(self) -> int:
+        return len(self._peers)
+
+    def peer_ids(self) -> List[str]:
+        return list(self._peers)
+
+    # ---------------------- data path ----------------------
+
+    def publish(self, topic: str, key: str, body: str, extra: Optional[str] = None) -> None:
+        if not self._peers:
+            return
+        frame = encode_event(topic, key, body, extra)
+        for ident, writer in list(self._peers.items()):
+            if writer.is_closing() or writer.transport.get_write_buffer_size() > self.max_buffer:
+                self._drop(ident, writer)
+                continue
+            writer.write(frame)
+
+    def send(self, peer: str, topic: str, key: str, body: str, extra: Optional[str] = None) -> bool:
+        writer = self._peers.get(peer)
+        if writer is None or writer.is_closing():
+            return False
+        writer.write(encode_event(topic, key, body, extra))
+        return True
+
+    def _drop(self, ident: str, writer: asyncio.StreamWriter) -> None:
+        if self._peers.get(ident) is writer:
+            del self._peers[ident]
+        writer.close()
+
+    async def _read_loop(self, ident: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, owned: bool) -> None:
+        try:
+            while True:
+                header = await reader.readexactly(_HEADER.size)
+                topic, klen, elen, blen = _HEADER.unpack(header)
+                data = await reader.readexactly(klen + elen + blen)
+                key = data[:klen].decode("utf-8")
+                extra = data[klen:klen + elen].decode("utf-8") if elen else None
+                body = data[klen + elen:].decode("utf-8")
+                try:
+                    self._handler(chr(topic), key, extra, body)
+                except Exception:
+                    # Handlers should not raise; a bad event must not kill
+                    # the peer link either way
+                    log.exception("backplane handler failed for %r event from worker %s", chr(topic), ident)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if owned:
+                self._drop(ident, writer)
+            else:
+                writer.close()
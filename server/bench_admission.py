@@ -0,0 +1,126 @@
+"""
+bench_admission.py — Latency of well-behaved users while one user floods.
+
+Runs the post_message handler in-process (no HTTP stack). `--polite` users
+each post one message every `--interval` seconds and record the latency
+from the moment the message was due until it was stored and broadcast
+(event-loop queuing included). Meanwhile one spammer runs `--spam-tasks`
+concurrent loops posting as fast as the loop lets it. Every user has
+`--subscribers` SSE connections, so each accepted message costs a fan-out.
+
+Modes:
+  1) no limits : admission control off (the old behaviour)
+  2) rate limit: per-user token bucket only
+  3) shedder   : load shedder only (lag / queue limits)
+  4) both      : what the server runs by default
+
+Reports polite p50 / p99 latency and rejections, spam messages accepted
+per second and the worst smoothed loop lag the shedder saw.
+
+Usage:
+  python bench_admission.py --seconds 5 --spam-tasks 500
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Dict, List
+
+from fastapi import HTTPException
+
+import server
+from admission import LoadShedder, RateLimiter
+from outbound import Outbox
+
+
+async def run(mode: str, args) -> Dict[str, float]:
+    server.MESSAGES.clear()
+    server.USER_LIMITER = RateLimiter(args.rate, args.burst) if mode in ("rate limit", "both") else None
+    server.SHEDDER = LoadShedder(
+        args.max_lag_ms / 1000 if mode in ("shedder", "both") else 0,
+        args.max_queued if mode in ("shedder", "both") else 0,
+        lambda: Outbox.queued,
+    )
+    sampler = LoadShedder(1e9, 0, lambda: 0)  # lag probe only, never sheds
+    sampler.start()
+    server.SHEDDER.start()
+
+    users = ["spammer"] + [f"polite{i}" for i in range(args.polite)]
+    conns = [server.hub.add_sse(u) for u in users for _ in range(args.subscribers)]
+    stop = time.perf_counter() + args.seconds
+    latencies: List[float] = []
+    polite_rejected = spam_ok = 0
+    worst_lag = 0.0
+
+    async def polite(user_id: str) -> None:
+        nonlocal polite_rejected
+        due = time.perf_counter()
+        while due < stop:
+            due += args.interval
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            try:
+                await server.post_message({"user_id": user_id, "text": "hello there"})
+            except HTTPException:
+                polite_rejected += 1
+                continue
+            latencies.append(time.perf_counter() - due)
+
+    async def spam() -> None:
+        nonlocal spam_ok
+        while time.perf_counter() < stop:
+            try:
+                await server.post_message({"user_id": "spammer", "text": "buy now " * 8})
+                spam_ok += 1
+            except HTTPException:
+                pass
+            await asyncio.sleep(0)  # each request is its own callback in a real server
+
+    async def watch_lag() -> None:
+        nonlocal worst_lag
+        while time.perf_counter() < stop:
+            worst_lag = max(worst_lag, sampler.lag)
+            await asyncio.sleep(0.05)
+
+    await asyncio.gather(
+        *(polite(u) for u in users[1:]),
+        *(spam() for _ in range(args.spam_tasks)),
+        watch_lag(),
+    )
+    sampler.close()
+    server.SHEDDER.close()
+    for conn in conns:
+        server.hub.remove_sse(conn.key, conn)
+
+    qs = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0.0] * 99
+    return {
+        "p50": qs[49], "p99": qs[98], "polite_ok": len(latencies), "polite_rejected": polite_rejected,
+        "spam_per_s": spam_ok / args.seconds, "lag": worst_lag,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Admission control benchmark")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Duration per mode (default: 5)")
+    parser.add_argument("--polite", type=int, default=20, help="Well-behaved users (default: 20)")
+    parser.add_argument("--interval", type=float, default=0.1, help="Seconds between a polite user's messages (default: 0.1)")
+    parser.add_argument("--spam-tasks", type=int, default=500, help="Concurrent spammer loops (default: 500)")
+    parser.add_argument("--subscribers", type=int, default=20, help="SSE connections per user (default: 20)")
+    parser.add_argument("--rate", type=float, default=20, help="Per-user messages/second (default: 20)")
+    parser.add_argument("--burst", type=float, default=40, help="Per-user burst (default: 40)")
+    parser.add_argument("--max-lag-ms", type=float, default=250, help="Shedder lag limit (default: 250)")
+    parser.add_argument("--max-queued", type=int, default=200_000, help="Shedder queued-frames limit (default: 200000)")
+    args = parser.parse_args()
+
+    print(f"{'mode':<11} {'p50 ms':>8} {'p99 ms':>8} {'polite ok':>10} {'rejected':>9} {'spam/s':>9} {'max lag ms':>11}")
+    for mode in ("no limits", "rate limit", "shedder", "both"):
+        r = asyncio.run(run(mode, args))
+        print(
+            f"{mode:<11} {r['p50'] * 1e3:>8.1f} {r['p99'] * 1e3:>8.1f} {r['polite_ok']:>10} "
+            f"{r['polite_rejected']:>9} {r['spam_per_s']:>9,.0f} {r['lag'] * 1e3:>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+bench_assistant.py — Time to first token of streamed assistant replies.
+
+Starts `--replies` concurrent replies in-process with the stub backend
+(`--first-token-ms` before the first word, `--token-ms` between words).
+Each reply belongs to its own user, who has `--subscribers` SSE
+connections, so every delta is encoded and fanned out like in the server.
+For each level of concurrency it reports, per reply:
+  - TTFT: prompt to the first delta reaching the subscribers (what a
+    streaming client waits before text appears) and its overhead over the
+    backend's own first-token delay
+  - whole reply: prompt to the stored final message (what a client that
+    waits for the complete answer sees)
+plus the delta frames delivered per second.
+
+Usage:
+  python bench_assistant.py --replies 1,100,1000 --subscribers 2
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Dict, List
+
+import server
+from assistant import StubBackend
+
+
+def pct(samples: List[float], q: int) -> float:
+    return statistics.quantiles(samples, n=100)[q - 1] if len(samples) > 1 else samples[0]
+
+
+async def run(n: int, args) -> Dict[str, float]:
+    server.MESSAGES.clear()
+    server.ASSISTANT = StubBackend(args.first_token_ms / 1000, args.token_ms / 1000)
+    users = [f"user{i}" for i in range(n)]
+    conns = [server.hub.add_sse(u) for u in users for _ in range(args.subscribers)]
+    ttft: List[float] = []
+    whole: List[float] = []
+    deltas = 0
+
+    async def one(user_id: str) -> None:
+        started = time.perf_counter()
+        first = None
+
+        def sink(frame) -> None:
+            nonlocal first, deltas
+            if frame["type"] == "delta":
+                deltas += len(server.hub.sse_by_user.get(user_id))
+                if first is None:
+                    first = time.perf_counter()
+
+        msg = await server.stream_reply(user_id, [{"role": "user", "text": "hello"}], sink=sink, started=started)
+        assert msg is not None
+        ttft.append(first - started)
+        whole.append(time.perf_counter() - started)
+
+    async def drain() -> None:
+        while True:
+            for conn in conns:
+                while len(conn.outbox):
+                    conn.outbox._pop()
+            await asyncio.sleep(0.005)
+
+    drainer = asyncio.create_task(drain())
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(u) for u in users))
+    elapsed = time.perf_counter() - t0
+    drainer.cancel()
+    for conn in conns:
+        server.hub.remove_sse(conn.key, conn)
+    base = args.first_token_ms / 1000
+    return {
+        "ttft50": pct(ttft, 50), "ttft99": pct(ttft, 99),
+        "over50": pct(ttft, 50) - base, "over99": pct(ttft, 99) - base,
+        "whole50": pct(whole, 50), "deltas_per_s": deltas / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streamed assistant reply benchmark")
+    parser.add_argument("--replies", default="1,100,1000", help="Comma-separated concurrent replies (default: 1,100,1000)")
+    parser.add_argument("--subscribers", type=int, default=2, help="SSE connections per user (default: 2)")
+    parser.add_argument("--first-token-ms", type=float, default=200, help="Stub delay before the first word (default: 200)")
+    parser.add_argument("--token-ms", type=float, default=20, help="Stub delay between words (default: 20)")
+    args = parser.parse_args()
+
+    print(f"{'replies':>7} {'ttft p50':>9} {'ttft p99':>9} {'overhead p50':>13} {'overhead p99':>13} {'whole p50':>10} {'deltas/s':>10}")
+    for n in (int(x) for x in args.replies.split(",")):
+        r = asyncio.run(run(n, args))
+        print(
+            f"{n:>7} {r['ttft50'] * 1e3:>7.1f}ms {r['ttft99'] * 1e3:>7.1f}ms {r['over50'] * 1e3:>11.2f}ms "
+            f"{r['over99'] * 1e3:>11.2f}ms {r['whole50'] * 1e3:>8.0f}ms {r['deltas_per_s']:>10,.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
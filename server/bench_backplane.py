@@ -0,0 +1,127 @@
+"""
+bench_backplane.py — Fan-out throughput of the Unix socket backplane, 1..N workers.
+
+Simulates `uvicorn --workers N`: every worker process owns an equal slice of
+the connections (plain Outbox objects, CONNS_PER_USER per user, spread
+round-robin over the workers) and publishes an equal slice of the
+messages. Each message is delivered to the publisher's local connections
+and forwarded through the backplane to every other worker, which delivers
+to theirs — exactly what Hub.broadcast_to_user does.
+
+Reported throughput is frames delivered to connection outboxes per second
+across all workers; with fan-out dominating, it should grow close to
+linearly with the number of workers (up to the number of cores).
+
+Usage:
+  python bench_backplane.py --max-workers 4 --messages 100000 --users 200 --conns-per-user 40
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from backplane import UnixSocketBackplane
+from outbound import Outbox
+
+
+def worker(index: int, n: int, args, directory: str, barrier, results) -> None:
+    asyncio.run(_worker(index, n, args, directory, barrier, results))
+
+
+async def _worker(index: int, n: int, args, directory: str, barrier, results) -> None:
+    # Local connections: global connection c belongs to user c % users and
+    # lives on worker c % n
+    conns: Dict[str, List[Outbox]] = defaultdict(list)
+    for c in range(index, args.users * args.conns_per_user, n):
+        conns[f"user{c % args.users}"].append(Outbox(64, "drop-oldest"))
+
+    delivered = 0
+    received = 0
+    done = asyncio.Event()
+    mine = len(range(index, args.messages, n))
+    expected_remote = args.messages - mine
+
+    def deliver(user_id: str, text: str) -> None:
+        nonlocal delivered
+        for box in conns.get(user_id, ()):
+            box.put(text)
+        delivered += len(conns.get(user_id, ()))
+
+    def on_event(topic: str, key: str, extra, body: str) -> None:
+        nonlocal received
+        deliver(key, body)
+        received += 1
+        if received >= expected_remote:
+            done.set()
+
+    bp = UnixSocketBackplane(directory, scan_interval=0.05, max_buffer=1 << 30)
+    await bp.start(on_event)
+    while bp.peers() < n - 1:
+        await asyncio.sleep(0.01)
+    await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+
+    rnd = random.Random(index)
+    t0 = time.perf_counter()
+    for i in range(mine):
+        user_id = f"user{rnd.randrange(args.users)}"
+        text = json.dumps({"type": "message", "data": {"user_id": user_id, "text": f"message {i} from worker {index}"}})
+        deliver(user_id, text)
+        bp.publish("u", user_id, text)
+        if i % 64 == 0:
+            await asyncio.sleep(0)
+    if expected_remote:
+        await done.wait()
+    elapsed = time.perf_counter() - t0
+
+    results.put((index, elapsed, delivered))
+    # Keep serving peers until everyone has finished
+    await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+    await bp.close()
+
+
+def run(n: int, args) -> float:
+    directory = tempfile.mkdtemp(prefix="bench_backplane_")
+    ctx = mp.get_context("spawn")
+    barrier = ctx.Barrier(n)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(i, n, args, directory, barrier, results)) for i in range(n)]
+    try:
+        for p in procs:
+            p.start()
+        rows = [results.get() for _ in range(n)]
+        for p in procs:
+            p.join()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    wall = max(r[1] for r in rows)
+    total = sum(r[2] for r in rows)
+    return total / wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backplane fan-out scaling benchmark")
+    parser.add_argument("--max-workers", type=int, default=min(4, os.cpu_count() or 1), help="Largest worker count (default: min(4, cores))")
+    parser.add_argument("--messages", type=int, default=50_000, help="Messages published in total (default: 50000)")
+    parser.add_argument("--users", type=int, default=200, help="Distinct users (default: 200)")
+    parser.add_argument("--conns-per-user", type=int, default=40, help="Connections per user across all workers (default: 40)")
+    args = parser.parse_args()
+
+    base = None
+    print(f"{'workers':>7} {'frames/s':>14} {'speedup':>8}")
+    for n in range(1, args.max_workers + 1):
+        rate = run(n, args)
+        base = base or rate
+        print(f"{n:>7} {rate:>14,.0f} {rate / base:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+bench_channels.py — Announcing one payload to many users.
+
+Registers `--users` WebSocket connections (one per user, a `--msgpack`
+share of them on the msgpack codec) in the Hub without real sockets, then
+sends the same announcement to all of them in two ways:
+  1) per user : one broadcast_to_user call per user (the only way before
+     channels), encoding the payload once per call
+  2) channel  : every connection subscribed to one channel, one
+     publish_channel call, encoded once per codec in total
+
+Also times subscribe + unsubscribe for one more connection against the
+full channel, which should not depend on its size.
+
+Usage:
+  python bench_channels.py --users 10000 --rounds 20
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import server
+from codec import CODECS
+
+
+async def main_async(args) -> None:
+    msgpack = CODECS.get("msgpack")
+    conns = []
+    for i in range(args.users):
+        codec = msgpack if msgpack is not None and i < args.users * args.msgpack else server.JSON
+        conn = server.Connection("ws", f"user{i}", codec=codec)
+        server.hub.ws_by_user.add(conn.key, conn)
+        server.hub.channels.subscribe("announcements", conn)
+        conns.append(conn)
+    payload = {"type": "announcement", "data": {"title": "Maintenance tonight", "text": "The service restarts at 02:00 UTC. " * 4}}
+
+    def drain() -> None:
+        for conn in conns:
+            while len(conn.outbox):
+                conn.outbox._pop()
+
+    per_user, channel = [], []
+    for _ in range(args.rounds):
+        t0 = time.perf_counter()
+        for conn in conns:
+            await server.hub.broadcast_to_user(conn.key, payload)
+        per_user.append(time.perf_counter() - t0)
+        drain()
+        t0 = time.perf_counter()
+        await server.hub.publish_channel("announcements", payload)
+        channel.append(time.perf_counter() - t0)
+        drain()
+
+    extra = server.Connection("ws", "extra")
+    t0 = time.perf_counter()
+    for _ in range(10_000):
+        server.hub.channels.subscribe("announcements", extra)
+        server.hub.channels.unsubscribe("announcements", extra)
+    sub = (time.perf_counter() - t0) / 10_000
+
+    a, b = statistics.median(per_user), statistics.median(channel)
+    print(f"{args.users:,} connections ({args.msgpack:.0%} msgpack), median of {args.rounds} rounds")
+    print(f"per user   {a * 1e3:8.2f} ms  ({a / args.users * 1e6:.2f} us/connection)")
+    print(f"channel    {b * 1e3:8.2f} ms  ({b / args.users * 1e6:.2f} us/connection, {a / b:.1f}x faster)")
+    print(f"subscribe + unsubscribe at {args.users:,} subscribers: {sub * 1e6:.2f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Channel fan-out benchmark")
+    parser.add_argument("--users", type=int, default=10_000, help="Connections, one per user (default: 10000)")
+    parser.add_argument("--msgpack", type=float, default=0.1, help="Share of msgpack connections (default: 0.1)")
+    parser.add_argument("--rounds", type=int, default=20, help="Announcements per mode (default: 20)")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
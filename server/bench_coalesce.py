@@ -0,0 +1,92 @@
+"""
+bench_coalesce.py — Outbound micro-batching: writes per event vs added latency.
+
+One Outbox is drained by a writer that mimics Hub._ws_writer (get(), then
+collect() when a window is set) into a fake socket whose send costs
+`--send-us` microseconds, like a write syscall. A producer puts events
+in bursts of `--burst` every `--gap` ms; `--burst 1` is a trickle of
+lone messages, which must not be delayed.
+
+For each window it reports writes per event and the queue-to-write
+latency (p50 / p99).
+
+Usage:
+  python bench_coalesce.py --events 20000 --burst 50 --gap 5 --windows 0,2,5,10
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Dict, List
+
+from codec import JSON, dumps
+from outbound import Outbox
+
+
+async def run(window_ms: float, args) -> Dict[str, float]:
+    outbox = Outbox(maxsize=args.events + 1)
+    window = window_ms / 1000
+    sent_at: Dict[int, float] = {}
+    latencies: List[float] = []
+    writes = 0
+    frame = dumps({"type": "message", "data": {"id": "x" * 36, "text": "t" * args.size}})
+
+    async def send(data: str) -> None:
+        nonlocal writes
+        writes += 1
+        end = time.perf_counter() + args.send_us / 1e6
+        while time.perf_counter() < end:
+            pass
+        await asyncio.sleep(0)
+
+    async def writer() -> None:
+        n = 0
+        while True:
+            data = await outbox.get()
+            if data is None:
+                return
+            frames = await outbox.collect(data, window, 65536) if window else [data]
+            await send(JSON.bundle(frames) if len(frames) > 1 else frames[0])
+            now = time.perf_counter()
+            for _ in frames:
+                latencies.append(now - sent_at.pop(n))
+                n += 1
+
+    task = asyncio.create_task(writer())
+    i = 0
+    while i < args.events:
+        for _ in range(min(args.burst, args.events - i)):
+            sent_at[i] = time.perf_counter()
+            outbox.put(frame)
+            i += 1
+        await asyncio.sleep(args.gap / 1000)
+    while sent_at:
+        await asyncio.sleep(0.01)
+    outbox.close()
+    await task
+
+    q = statistics.quantiles(latencies, n=100)
+    return {"writes_per_event": writes / args.events, "p50_ms": q[49] * 1e3, "p99_ms": q[98] * 1e3}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Outbound micro-batching benchmark")
+    parser.add_argument("--events", type=int, default=20_000, help="Events to deliver (default: 20000)")
+    parser.add_argument("--burst", type=int, default=50, help="Events per burst; 1 = lone messages (default: 50)")
+    parser.add_argument("--gap", type=float, default=5, help="Milliseconds between bursts (default: 5)")
+    parser.add_argument("--size", type=int, default=100, help="Message text length (default: 100)")
+    parser.add_argument("--send-us", type=float, default=20, help="Simulated cost of one socket write in microseconds (default: 20)")
+    parser.add_argument("--windows", default="0,2,5,10", help="Coalescing windows in ms, 0 = off (default: 0,2,5,10)")
+    args = parser.parse_args()
+
+    print(f"bursts of {args.burst} every {args.gap} ms, {args.send_us} us per write")
+    for w in (float(x) for x in args.windows.split(",")):
+        r = asyncio.run(run(w, args))
+        label = "off" if w == 0 else f"{w:g} ms"
+        print(f"window {label:<7} {r['writes_per_event']:.3f} writes/event  latency p50 {r['p50_ms']:.2f} ms  p99 {r['p99_ms']:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+bench_codec.py — Encode/decode cost and wire size of the realtime frame encodings.
+
+Compares, on payloads shaped like the server's real traffic (a chat message
+broadcast, a WebRTC SDP offer, an ICE candidate):
+  - stdlib json (json.dumps(..., ensure_ascii=False) / json.loads)
+  - orjson (what codec.dumps/loads use when it is installed)
+  - msgpack (the binary WS subprotocol)
+
+Implementations that are not installed are skipped.
+
+Usage:
+  python bench_codec.py --number 200000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import timeit
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+SDP = "\r\n".join(
+    ["v=0", "o=- 4611731400430051336 2 IN IP4 127.0.0.1", "s=-", "t=0 0", "a=group:BUNDLE 0 1"]
+    + [f"a=rtpmap:{pt} opus/48000/2" for pt in range(96, 128)]
+    + [f"a=candidate:{i} 1 udp 2122260223 192.168.1.{i} 5{i:04d} typ host" for i in range(8)]
+)
+
+PAYLOADS = {
+    "chat message": {
+        "type": "message",
+        "data": {
+            "id": "8c1f0c9e-5a0b-4d37-9d0e-2a1f3c4b5d6e",
+            "ts": "2024-01-01T12:00:00.000000Z",
+            "user_id": "user-42",
+            "role": "user",
+            "text": "Привет! Can you summarise the last meeting notes for me?",
+            "echoed": True,
+        },
+    },
+    "sdp offer": {"type": "offer", "data": {"type": "offer", "sdp": SDP}},
+    "ice candidate": {
+        "type": "candidate",
+        "data": {"candidate": "candidate:1 1 udp 2122260223 192.168.1.7 50007 typ host", "sdpMid": "0", "sdpMLineIndex": 0},
+    },
+}
+
+
+def implementations():
+    impls = [("stdlib json", lambda o: json.dumps(o, ensure_ascii=False), json.loads, lambda d: len(d.encode("utf-8")))]
+    if orjson is not None:
+        impls.append(("orjson", orjson.dumps, orjson.loads, len))
+    if msgpack is not None:
+        impls.append(("msgpack", lambda o: msgpack.packb(o, use_bin_type=True), lambda d: msgpack.unpackb(d, raw=False), len))
+    return impls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Frame codec benchmark")
+    parser.add_argument("--number", type=int, default=200_000, help="Iterations per measurement (default: 200000)")
+    args = parser.parse_args()
+
+    impls = implementations()
+    for name, payload in PAYLOADS.items():
+        print(f"\n{name}")
+        print(f"{'codec':<12} {'encode ns':>10} {'decode ns':>10} {'bytes':>7}")
+        for label, enc, dec, size in impls:
+            data = enc(payload)
+            assert dec(data) == payload
+            t_enc = timeit.timeit(lambda: enc(payload), number=args.number) / args.number
+            t_dec = timeit.timeit(lambda: dec(data), number=args.number) / args.number
+            print(f"{label:<12} {t_enc * 1e9:>10.0f} {t_dec * 1e9:>10.0f} {size(data):>7}")
+
+
+if __name__ == "__main__":
+    main()
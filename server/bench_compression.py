@@ -0,0 +1,158 @@
+"""
+bench_compression.py — Bandwidth against CPU for history and WebSocket
+compression.
+
+History: one `--messages` page of /api/history as the server serializes it,
+compressed with gzip at several levels (and brotli when it is installed):
+bytes on the wire and milliseconds per compression. The server caches the
+compressed page, so this cost is paid once per page version, not per request.
+
+WebSocket: a stream of `--frames` broadcast frames (chat messages, short
+assistant deltas, long assistant replies and SDP offers relayed by /signal)
+sent to one socket through the permessage-deflate extension the server
+negotiates, for several settings:
+  - off                  : no compression
+  - lvl1 ctx (default)   : level 1, 12-bit window, context takeover, frames under 128 B sent as is
+  - lvl1 ctx min=0       : the same but every frame compressed
+  - lvl1 no-ctx          : fresh compressor per message (no per-socket memory)
+  - lvl6 ctx w15         : zlib's default level and window
+It reports bytes per frame, microseconds of CPU per frame and socket (a
+fan-out to N sockets pays it N times) and the compressor memory each socket
+keeps between messages.
+
+Usage:
+  python bench_compression.py --messages 200 --frames 2000
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from typing import Any, Dict, List
+
+from websockets.frames import Frame, Opcode
+
+from codec import dumps
+from compression import ThresholdDeflateFactory, brotli, compress
+
+WORDS = (
+    "the meeting is moved to tomorrow please send the report before noon thanks "
+    "I will call you after the deploy we found a bug in the parser fix is on review"
+).split()
+
+
+def text(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choices(WORDS, k=n))
+
+
+def message(rng: random.Random, i: int, n: int) -> Dict[str, Any]:
+    return {
+        "id": f"{rng.getrandbits(128):032x}",
+        "user_id": f"user{rng.randrange(1000)}",
+        "role": rng.choice(("user", "assistant")),
+        "text": text(rng, n),
+        "timestamp": f"2026-10-16T12:{i // 60 % 60:02d}:{i % 60:02d}.{rng.randrange(10**6):06d}+00:00",
+    }
+
+
+def sdp(rng: random.Random) -> str:
+    lines = ["v=0", f"o=- {rng.getrandbits(63)} 2 IN IP4 127.0.0.1", "s=-", "t=0 0", "a=group:BUNDLE 0 1"]
+    for mid, kind in enumerate(("audio", "video")):
+        lines += [
+            f"m={kind} 9 UDP/TLS/RTP/SAVPF 111 96 97 98 99 100 101",
+            "c=IN IP4 0.0.0.0", f"a=mid:{mid}", "a=sendrecv", "a=rtcp-mux",
+            f"a=ice-ufrag:{rng.getrandbits(32):08x}", f"a=ice-pwd:{rng.getrandbits(96):024x}",
+            "a=fingerprint:sha-256 " + ":".join(f"{rng.randrange(256):02X}" for _ in range(32)),
+        ]
+        lines += [f"a=rtpmap:{pt} {codec}" for pt, codec in zip((111, 96, 97, 98), ("opus/48000/2", "VP8/90000", "rtx/90000", "H264/90000"))]
+        lines += [f"a=candidate:{rng.getrandbits(32)} 1 udp {rng.getrandbits(31)} 10.0.{rng.randrange(256)}.{rng.randrange(256)} {rng.randrange(1024, 65535)} typ host" for _ in range(4)]
+    return "\r\n".join(lines) + "\r\n"
+
+
+def ws_frames(rng: random.Random, n: int) -> List[bytes]:
+    frames = []
+    for i in range(n):
+        kind = rng.random()
+        if kind < 0.5:
+            obj = {"type": "message", "data": message(rng, i, rng.randint(3, 40))}
+        elif kind < 0.85:
+            obj = {"type": "delta", "data": {"reply_id": f"{rng.getrandbits(64):016x}", "text": " " + rng.choice(WORDS)}}
+        elif kind < 0.95:
+            obj = {"type": "message", "data": message(rng, i, rng.randint(300, 800))}
+        else:
+            obj = {"type": "signal", "from": f"user{rng.randrange(1000)}", "data": {"type": "offer", "sdp": sdp(rng)}}
+        frames.append(dumps(obj).encode("utf-8"))
+    return frames
+
+
+def bench_history(args) -> None:
+    rng = random.Random(1)
+    body = dumps({
+        "user_id": "user42",
+        "messages": [message(rng, i, rng.randint(3, 60)) for i in range(args.messages)],
+        "has_more": True,
+        "next": None,
+    }).encode("utf-8")
+    print(f"History page: {args.messages} messages, {len(body):,} bytes")
+    print(f"{'encoding':<10} {'bytes':>9} {'ratio':>6} {'ms/page':>8}")
+    variants = [("gzip", level) for level in (1, 3, 5, 6, 9)]
+    if brotli is not None:
+        variants += [("br", quality) for quality in (1, 4, 6, 9)]
+    for encoding, level in variants:
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            out = compress(body, encoding, level)
+        ms = (time.perf_counter() - t0) / args.repeat * 1e3
+        print(f"{encoding + ' ' + str(level):<10} {len(out):>9,} {len(out) / len(body):>6.1%} {ms:>8.2f}")
+    if brotli is None:
+        print("(brotli is not installed: gzip only)")
+
+
+def bench_ws(args) -> None:
+    frames = ws_frames(random.Random(2), args.frames)
+    raw = sum(len(f) for f in frames)
+    print(f"\nWebSocket: {len(frames):,} frames, {raw / len(frames):,.0f} bytes on average")
+    print(f"{'settings':<20} {'bytes/frame':>11} {'ratio':>6} {'us/frame':>9} {'memory/socket':>14}")
+    settings = [
+        ("off", None),
+        ("lvl1 ctx (default)", dict(level=1, mem_level=5, window_bits=12, context_takeover=True, min_bytes=128)),
+        ("lvl1 ctx min=0", dict(level=1, mem_level=5, window_bits=12, context_takeover=True, min_bytes=0)),
+        ("lvl1 no-ctx", dict(level=1, mem_level=5, window_bits=12, context_takeover=False, min_bytes=128)),
+        ("lvl6 ctx w15", dict(level=6, mem_level=8, window_bits=15, context_takeover=True, min_bytes=0)),
+    ]
+    for label, s in settings:
+        if s is None:
+            print(f"{label:<20} {raw / len(frames):>11,.0f} {1:>6.1%} {0:>9.2f} {0:>14,}")
+            continue
+        factory = ThresholdDeflateFactory(
+            min_bytes=s["min_bytes"],
+            server_no_context_takeover=not s["context_takeover"],
+            server_max_window_bits=s["window_bits"],
+            client_max_window_bits=s["window_bits"],
+            compress_settings={"level": s["level"], "memLevel": s["mem_level"]},
+        )
+        best = None
+        for _ in range(args.repeat):
+            _, ext = factory.process_request_params([], [])  # a client offering plain permessage-deflate
+            sent = 0
+            t0 = time.perf_counter()
+            for data in frames:
+                sent += len(ext.encode(Frame(Opcode.TEXT, data)).data)
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        memory = (1 << (s["window_bits"] + 2)) + (1 << (s["mem_level"] + 9)) if s["context_takeover"] else 0
+        print(f"{label:<20} {sent / len(frames):>11,.0f} {sent / raw:>6.1%} {best / len(frames) * 1e6:>9.2f} {memory:>14,}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compression bandwidth/CPU benchmark")
+    parser.add_argument("--messages", type=int, default=200, help="Messages in the history page (default: 200)")
+    parser.add_argument("--frames", type=int, default=2000, help="WebSocket frames per setting (default: 2000)")
+    parser.add_argument("--repeat", type=int, default=20, help="Repetitions (history: mean, WebSocket: best) (default: 20)")
+    args = parser.parse_args()
+    bench_history(args)
+    bench_ws(args)
+
+
+if __name__ == "__main__":
+    main()
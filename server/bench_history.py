@@ -0,0 +1,73 @@
+"""
+bench_history.py — Cost of polling an unchanged /api/history page.
+
+Fills one user's history with `--messages` messages and calls the
+get_history handler directly (no HTTP stack) `--calls` times for a
+`--limit` page in three ways:
+  1) rebuild: response cache disabled, page serialized on every call
+  2) cache hit: serialized page served from the response cache
+  3) 304: the client sends the ETag it already has (If-None-Match)
+
+Usage:
+  python bench_history.py --messages 1000 --limit 200 --calls 20000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+
+from starlette.requests import Request
+
+import server
+
+
+def make_request(user_id: str, etag: str | None = None) -> Request:
+    headers = [(b"if-none-match", etag.encode())] if etag else []
+    return Request({"type": "http", "method": "GET", "path": f"/api/history/{user_id}", "headers": headers, "query_string": b""})
+
+
+async def per_call(user_id: str, args, etag: str | None = None) -> float:
+    request = make_request(user_id, etag)
+    t0 = time.perf_counter()
+    for _ in range(args.calls):
+        await server.get_history(user_id, request, before=None, after=None, limit=args.limit)
+    return (time.perf_counter() - t0) / args.calls
+
+
+async def main_async(args) -> None:
+    user_id = "bench"
+    server.MESSAGES.clear()
+    for i in range(args.messages):
+        server.MESSAGES.append(user_id, {
+            "id": f"m{i:08d}-0000-4000-8000-000000000000", "ts": server.utc_iso(),
+            "user_id": user_id, "role": "user", "text": f"message number {i} " + "x" * 60,
+        })
+
+    first = await server.get_history(user_id, make_request(user_id), before=None, after=None, limit=args.limit)
+    etag = first.headers["etag"]
+    print(f"page of {args.limit} messages, {len(first.body):,} bytes")
+
+    cap = server.HISTORY_CACHE.max_bytes
+    server.HISTORY_CACHE.max_bytes = 0
+    server.HISTORY_CACHE.clear()
+    rebuild = await per_call(user_id, args)
+    server.HISTORY_CACHE.max_bytes = cap
+    hit = await per_call(user_id, args)
+    not_modified = await per_call(user_id, args, etag)
+
+    for label, t in (("rebuild", rebuild), ("cache hit", hit), ("304", not_modified)):
+        print(f"{label:<10} {t * 1e6:>9.1f} us/call  ({rebuild / t:.0f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="History polling benchmark")
+    parser.add_argument("--messages", type=int, default=1000, help="Messages in the user's history (default: 1000)")
+    parser.add_argument("--limit", type=int, default=200, help="Page size (default: 200)")
+    parser.add_argument("--calls", type=int, default=20_000, help="Calls per mode (default: 20000)")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
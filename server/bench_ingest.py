@@ -0,0 +1,108 @@
+"""
+bench_ingest.py — Per-message vs bulk ingestion through the server's own code path.
+
+Ingests `--messages` REST-style messages for `--users` users, each user
+having `--conns` SSE subscribers, twice:
+  1) single: what POST /api/message does per message (uuid4, timestamp,
+     store_message, broadcast_to_user)
+  2) bulk: what POST /api/messages does (ingest_batch per `--batch` messages)
+
+With --log, messages also go to a durable MessageLog (fsync on) in a
+temporary directory, sequentially as one importer would send them.
+
+Reports messages/s, frames queued per delivered message and log writes.
+
+Usage:
+  python bench_ingest.py --messages 50000 --users 10 --conns 2 --batch 1000 --log
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import shutil
+import tempfile
+import time
+import uuid
+from typing import Dict
+
+from persist import MessageLog
+import server
+
+
+async def run(mode: str, args, log_dir: str | None) -> Dict[str, float]:
+    server.MESSAGES.clear()
+    log = None
+    writes = 0
+    if log_dir is not None:
+        log = MessageLog(tempfile.mkdtemp(dir=log_dir), fsync=True)
+        write = log._write
+
+        def counted(data: bytes) -> None:
+            nonlocal writes
+            writes += 1
+            write(data)
+
+        log._write = counted
+        await log.start()
+    server.MESSAGE_LOG = log
+
+    users = [f"user{u}" for u in range(args.users)]
+    subs = [(u, server.hub.add_sse(u)) for u in users for _ in range(args.conns)]
+    frames = 0
+
+    async def drain() -> None:
+        nonlocal frames
+        for _, conn in subs:
+            while len(conn.outbox):
+                await conn.outbox.get()
+                frames += 1
+
+    items = [{"user_id": users[i % args.users], "role": "user", "text": f"message number {i}"} for i in range(args.messages)]
+    t0 = time.perf_counter()
+    if mode == "single":
+        for i, item in enumerate(items):
+            msg = {"id": str(uuid.uuid4()), "ts": server.utc_iso(), **item}
+            await server.store_message(item["user_id"], msg)
+            await server.hub.broadcast_to_user(item["user_id"], {"type": "message", "data": msg})
+            if i % 64 == 0:
+                await drain()
+    else:
+        for i in range(0, len(items), args.batch):
+            await server.ingest_batch(items[i:i + args.batch])
+            await drain()
+    dt = time.perf_counter() - t0
+    await drain()
+
+    for user_id, conn in subs:
+        server.hub.remove_sse(user_id, conn)
+    if log is not None:
+        await log.close()
+    server.MESSAGE_LOG = None
+    return {"rate": args.messages / dt, "frames_per_msg": frames / (args.messages * args.conns), "writes": writes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single vs bulk ingestion benchmark")
+    parser.add_argument("--messages", type=int, default=50_000, help="Messages to ingest (default: 50000)")
+    parser.add_argument("--users", type=int, default=10, help="Distinct users (default: 10)")
+    parser.add_argument("--conns", type=int, default=2, help="SSE subscribers per user (default: 2)")
+    parser.add_argument("--batch", type=int, default=1000, help="Messages per bulk batch (default: 1000)")
+    parser.add_argument("--log", action="store_true", help="Also write a durable message log (fsync on)")
+    args = parser.parse_args()
+
+    log_dir = tempfile.mkdtemp(prefix="bench-ingest-") if args.log else None
+    try:
+        for mode in ("single", "bulk"):
+            r = asyncio.run(run(mode, args, log_dir))
+            print(
+                f"{mode:<7} {r['rate']:>12,.0f} msg/s  "
+                f"{r['frames_per_msg']:.4f} frames per delivered msg  "
+                f"{r['writes']} log writes"
+            )
+    finally:
+        if log_dir is not None:
+            shutil.rmtree(log_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+bench_persist.py — Ingest and replay benchmark for the message store backends.
+
+Compares, for the same synthetic messages:
+  1) in-memory MessageStore only
+  2) MessageStore + durable MessageLog (group commit, fsync on)
+  3) MessageStore + MessageLog with fsync off (page cache only)
+and then times a cold replay of the log back into a fresh store.
+
+Messages are produced by `--concurrency` coroutines that each await their
+own write, which is how request handlers use the log.
+
+Usage:
+  python bench_persist.py --messages 200000 --users 1000 --concurrency 256
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+from persist import MessageLog
+from store import MessageStore
+
+
+def make_messages(n: int, users: int) -> List[Dict[str, Any]]:
+    ts = datetime.now(timezone.utc).isoformat()
+    return [
+        {"id": str(uuid.uuid4()), "ts": ts, "user_id": f"user{i % users}", "role": "user", "text": f"message number {i}"}
+        for i in range(n)
+    ]
+
+
+async def ingest(msgs: List[Dict[str, Any]], store: MessageStore, log: MessageLog | None, concurrency: int) -> float:
+    async def worker(part: List[Dict[str, Any]]):
+        for m in part:
+            store.append(m["user_id"], m)
+            if log is not None:
+                await log.append(m["user_id"], m)
+
+    parts = [msgs[i::concurrency] for i in range(concurrency)]
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(p) for p in parts))
+    return time.perf_counter() - t0
+
+
+async def run_log(msgs, args, fsync: bool, directory: str) -> float:
+    log = MessageLog(directory, fsync=fsync)
+    await log.start()
+    dt = await ingest(msgs, MessageStore(args.retention), log, args.concurrency)
+    await log.close()
+    return dt
+
+
+def report(label: str, n: int, dt: float) -> None:
+    print(f"{label:<28} {n / dt:>12,.0f} msg/s  ({dt:.2f}s)")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Message store ingest/replay benchmark")
+    parser.add_argument("--messages", type=int, default=200_000, help="Messages to ingest (default: 200000)")
+    parser.add_argument("--users", type=int, default=1000, help="Distinct users (default: 1000)")
+    parser.add_argument("--retention", type=int, default=1000, help="Per-user retention (default: 1000)")
+    parser.add_argument("--concurrency", type=int, default=256, help="Concurrent writers (default: 256)")
+    parser.add_argument("--dir", default=None, help="Log directory (default: a temp dir, removed afterwards)")
+    args = parser.parse_args()
+
+    msgs = make_messages(args.messages, args.users)
+    base = args.dir or tempfile.mkdtemp(prefix="bench_persist_")
+    try:
+        dt = await ingest(msgs, MessageStore(args.retention), None, args.concurrency)
+        report("in-memory", len(msgs), dt)
+
+        nosync_dir = os.path.join(base, "nosync")
+        dt = await run_log(msgs, args, False, nosync_dir)
+        report("log (fsync off)", len(msgs), dt)
+
+        sync_dir = os.path.join(base, "sync")
+        dt = await run_log(msgs, args, True, sync_dir)
+        report("log (group commit fsync)", len(msgs), dt)
+
+        size = sum(os.path.getsize(os.path.join(sync_dir, f)) for f in os.listdir(sync_dir))
+        store = MessageStore(args.retention)
+        t0 = time.perf_counter()
+        for user_id, msg in MessageLog(sync_dir).replay():
+            store.append(user_id, msg)
+        dt = time.perf_counter() - t0
+        report("replay", len(msgs), dt)
+        print(f"log size: {size / 1e6:.1f} MB")
+    finally:
+        if args.dir is None:
+            shutil.rmtree(base, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
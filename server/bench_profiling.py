@@ -0,0 +1,92 @@
+"""
+bench_profiling.py — Overhead of the loop monitor and the sampling profiler.
+
+Runs a broadcast-heavy workload in-process for `--seconds` (`--tasks`
+loops calling broadcast_to_user for users with `--subscribers` SSE
+connections each) and reports the median broadcasts per second over
+`--rounds` rounds (modes interleaved, so drift hits them all alike):
+  1) off          : no monitor, no profiler
+  2) monitor      : LoopMonitor heartbeat + watchdog (always on in the server)
+  3) profile 5ms  : monitor + sample_stacks every 5 ms (/__dev__/profile default)
+  4) profile 1ms  : monitor + sample_stacks every 1 ms
+
+Usage:
+  python bench_profiling.py --seconds 2 --rounds 5
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+from typing import Dict, Optional
+
+import server
+from profiling import LoopMonitor, sample_stacks
+
+
+async def run(monitor: bool, profile_interval: Optional[float], args) -> Dict[str, float]:
+    users = [f"user{i}" for i in range(args.users)]
+    conns = [server.hub.add_sse(u) for u in users for _ in range(args.subscribers)]
+    mon = LoopMonitor(0.025, 0.1) if monitor else None
+    if mon is not None:
+        mon.start()
+    stop = time.perf_counter() + args.seconds
+    done = 0
+
+    async def work(i: int) -> None:
+        nonlocal done
+        payload = {"type": "message", "data": {"text": "hello world " * 4, "n": i}}
+        while time.perf_counter() < stop:
+            await server.hub.broadcast_to_user(users[i % len(users)], payload)
+            done += 1
+            await asyncio.sleep(0)
+
+    async def drain() -> None:
+        while time.perf_counter() < stop:
+            for conn in conns:
+                while len(conn.outbox):
+                    conn.outbox._pop()
+            await asyncio.sleep(0.01)
+
+    jobs = [work(i) for i in range(args.tasks)] + [drain()]
+    samples = 0
+    if profile_interval is not None:
+        loop_thread = threading.get_ident()
+        counts, *_ = await asyncio.gather(
+            asyncio.to_thread(sample_stacks, loop_thread, args.seconds, profile_interval), *jobs,
+        )
+        samples = sum(counts.values())
+    else:
+        await asyncio.gather(*jobs)
+    if mon is not None:
+        mon.close()
+    for conn in conns:
+        server.hub.remove_sse(conn.key, conn)
+    return {"per_s": done / args.seconds, "samples": samples}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profiler overhead benchmark")
+    parser.add_argument("--seconds", type=float, default=2.0, help="Duration per mode and round (default: 2)")
+    parser.add_argument("--rounds", type=int, default=5, help="Rounds of all modes (default: 5)")
+    parser.add_argument("--tasks", type=int, default=100, help="Concurrent broadcasting loops (default: 100)")
+    parser.add_argument("--users", type=int, default=100, help="Users broadcast to (default: 100)")
+    parser.add_argument("--subscribers", type=int, default=10, help="SSE connections per user (default: 10)")
+    args = parser.parse_args()
+
+    modes = (("off", False, None), ("monitor", True, None), ("profile 5ms", True, 0.005), ("profile 1ms", True, 0.001))
+    results: Dict[str, list] = {label: [] for label, _, _ in modes}
+    for _ in range(args.rounds):
+        for label, monitor, interval in modes:
+            results[label].append(asyncio.run(run(monitor, interval, args)))
+    base = statistics.median(r["per_s"] for r in results["off"])
+    for label, runs in results.items():
+        per_s = statistics.median(r["per_s"] for r in runs)
+        samples = statistics.median(r["samples"] for r in runs) / args.seconds
+        print(f"{label:<12} {per_s:>10,.0f} broadcasts/s  ({per_s / base - 1:+.1%})  {samples:,.0f} samples/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+bench_registry.py — Connect/disconnect storm against the Hub connection registry.
+
+Runs the same storm twice:
+  1) legacy: the previous Hub registry (one asyncio.Lock around every
+     add/remove, dead sockets removed under that lock from the broadcast loop)
+  2) current: server.Registry (lock-free O(1) add/discard) with dead
+     connections collected by Hub.sweep()
+
+Storm: `--clients` tasks connect at once, stay for a random short time and
+disconnect, while a broadcaster keeps fanning out to random users and a
+fraction of the connections fail their sends (dead sockets).
+
+Reports wall time for the storm and register/unregister latency percentiles.
+
+Usage:
+  python bench_registry.py --clients 20000 --users 2000 --dead 0.05
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import defaultdict
+from typing import Dict, List, Set
+
+import server
+
+
+class FakeConn:
+    __slots__ = ("dead",)
+
+    def __init__(self, dead: bool) -> None:
+        self.dead = dead
+
+
+class LegacyHub:
+    # The registry as it was before: global lock, cleanup on broadcast path
+    def __init__(self) -> None:
+        self.ws_by_user: Dict[str, Set[FakeConn]] = defaultdict(set)
+        self._lock = asyncio.Lock()
+
+    async def add(self, user_id: str, conn) -> None:
+        async with self._lock:
+            self.ws_by_user[user_id].add(conn)
+
+    async def remove(self, user_id: str, conn) -> None:
+        async with self._lock:
+            self.ws_by_user[user_id].discard(conn)
+            if not self.ws_by_user[user_id]:
+                self.ws_by_user.pop(user_id, None)
+
+    async def broadcast(self, user_id: str) -> None:
+        for conn in list(self.ws_by_user.get(user_id, [])):
+            await asyncio.sleep(0)  # the send
+            if conn.dead:
+                await self.remove(user_id, conn)
+
+
+class CurrentHub:
+    def __init__(self) -> None:
+        self.registry = server.Registry()
+        self.dead: List = []
+
+    async def add(self, user_id: str, conn) -> None:
+        self.registry.add(user_id, conn)
+
+    async def remove(self, user_id: str, conn) -> None:
+        self.registry.discard(user_id, conn)
+
+    async def broadcast(self, user_id: str) -> None:
+        for conn in self.registry.get(user_id):
+            if conn.dead:
+                self.dead.append((user_id, conn))
+        await asyncio.sleep(0)  # the writers run on their own
+
+    def sweep(self) -> None:
+        dead, self.dead = self.dead, []
+        for user_id, conn in dead:
+            self.registry.discard(user_id, conn)
+
+
+async def storm(hub, args) -> Dict[str, float]:
+    rnd = random.Random(1)
+    add_lat: List[float] = []
+    rm_lat: List[float] = []
+    stop = asyncio.Event()
+
+    async def client(i: int) -> None:
+        user_id = f"user{i % args.users}"
+        conn = FakeConn(rnd.random() < args.dead)
+        t0 = time.perf_counter()
+        await hub.add(user_id, conn)
+        add_lat.append(time.perf_counter() - t0)
+        for _ in range(rnd.randrange(1, 5)):
+            await asyncio.sleep(0)
+        t0 = time.perf_counter()
+        await hub.remove(user_id, conn)
+        rm_lat.append(time.perf_counter() - t0)
+
+    async def broadcaster() -> None:
+        while not stop.is_set():
+            await hub.broadcast(f"user{rnd.randrange(args.users)}")
+            await asyncio.sleep(0)
+            if isinstance(hub, CurrentHub) and rnd.random() < 0.01:
+                hub.sweep()
+
+    bcasts = [asyncio.create_task(broadcaster()) for _ in range(args.broadcasters)]
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(args.clients)))
+    wall = time.perf_counter() - t0
+    stop.set()
+    await asyncio.gather(*bcasts)
+
+    def pct(xs: List[float], p: float) -> float:
+        return statistics.quantiles(xs, n=100)[p - 1] * 1e6
+
+    return {
+        "wall_s": wall,
+        "add_p50_us": pct(add_lat, 50),
+        "add_p99_us": pct(add_lat, 99),
+        "remove_p50_us": pct(rm_lat, 50),
+        "remove_p99_us": pct(rm_lat, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Connect/disconnect storm benchmark")
+    parser.add_argument("--clients", type=int, default=20_000, help="Clients in the storm (default: 20000)")
+    parser.add_argument("--users", type=int, default=2000, help="Distinct users (default: 2000)")
+    parser.add_argument("--dead", type=float, default=0.05, help="Fraction of connections whose sends fail (default: 0.05)")
+    parser.add_argument("--broadcasters", type=int, default=4, help="Concurrent broadcast loops (default: 4)")
+    args = parser.parse_args()
+
+    for label, hub in (("legacy (global lock)", LegacyHub()), ("current (lock-free)", CurrentHub())):
+        r = asyncio.run(storm(hub, args))
+        print(
+            f"{label:<22} wall {r['wall_s']:.3f}s  "
+            f"add p50/p99 {r['add_p50_us']:.1f}/{r['add_p99_us']:.1f}us  "
+            f"remove p50/p99 {r['remove_p50_us']:.1f}/{r['remove_p99_us']:.1f}us"
+        )
+
+
+if __name__ == "__main__":
+    main()
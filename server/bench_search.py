@@ -0,0 +1,84 @@
+"""
+bench_search.py — Query latency of the full-text index at scale.
+
+Indexes `--messages` synthetic chat messages (Zipf-distributed words from a
+`--vocab`-word vocabulary) spread over `--users` users, through a
+MessageStore so retention pruning runs exactly as in the server (retention
+is set so everything indexed stays retained). Then times a mix of queries
+against one user's index: rare / common words, two-word AND, prefix and
+phrase, and reports p50 / p99 latency and the number of matches.
+
+Usage:
+  python bench_search.py --messages 1000000 --users 1 --queries 200
+"""
+from __future__ import annotations
+
+import argparse
+import bisect
+import itertools
+import random
+import statistics
+import time
+from typing import Dict, List
+
+from search import SearchIndex
+from store import MessageStore
+
+
+def make_vocab(n: int, rnd: random.Random) -> List[str]:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < n:
+        words.add("".join(rnd.choice(letters) for _ in range(rnd.randint(3, 10))))
+    return sorted(words, key=lambda w: rnd.random())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-text search benchmark")
+    parser.add_argument("--messages", type=int, default=1_000_000, help="Messages indexed (default: 1000000)")
+    parser.add_argument("--users", type=int, default=1, help="Users the messages are spread over (default: 1)")
+    parser.add_argument("--vocab", type=int, default=50_000, help="Distinct words (default: 50000)")
+    parser.add_argument("--words", type=int, default=12, help="Average words per message (default: 12)")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per kind (default: 200)")
+    args = parser.parse_args()
+
+    rnd = random.Random(7)
+    vocab = make_vocab(args.vocab, rnd)
+    cum = list(itertools.accumulate(1 / (r + 1) for r in range(len(vocab))))  # Zipf weights
+
+    def sentence() -> str:
+        n = max(1, int(rnd.gauss(args.words, args.words / 3)))
+        return " ".join(vocab[bisect.bisect_left(cum, rnd.random() * cum[-1])] for _ in range(n))
+
+    index = SearchIndex()
+    store = MessageStore(retention=args.messages // args.users + 1, index=index)
+    t0 = time.perf_counter()
+    for i in range(args.messages):
+        store.append(f"user{i % args.users}", {"id": str(i), "text": sentence()})
+    dt = time.perf_counter() - t0
+    print(f"indexed {args.messages:,} messages in {dt:.1f}s ({args.messages / dt:,.0f}/s)")
+
+    common, mid, rare = vocab[:20], vocab[200:2000], vocab[10_000:]
+    kinds: Dict[str, callable] = {
+        "rare word": lambda: rnd.choice(rare),
+        "mid word": lambda: rnd.choice(mid),
+        "common word": lambda: rnd.choice(common),
+        "two words": lambda: f"{rnd.choice(mid)} {rnd.choice(common)}",
+        "prefix": lambda: rnd.choice(mid)[:3] + "*",
+        "phrase": lambda: '"' + " ".join(sentence().split()[:2]) + '"',
+    }
+    print(f"{'query':<12} {'p50 ms':>8} {'p99 ms':>8} {'avg matches':>12}")
+    for label, make in kinds.items():
+        lat, totals = [], []
+        for _ in range(args.queries):
+            q = make()
+            t0 = time.perf_counter()
+            _, total, _ = index.search("user0", q, limit=20)
+            lat.append(time.perf_counter() - t0)
+            totals.append(total)
+        qs = statistics.quantiles(lat, n=100)
+        print(f"{label:<12} {qs[49] * 1e3:>8.2f} {qs[98] * 1e3:>8.2f} {statistics.mean(totals):>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+bench_signal.py — Signaling load for full-mesh rooms: room broadcast vs peer-addressed routing.
+
+For each room size, every pair of peers negotiates once, the way a mesh
+call does: an offer, an answer and `--candidates` ICE candidates in each
+direction. The same messages are sent through the server's Hub twice:
+  1) broadcast: every message relayed to the whole room (the old
+     behaviour; receivers discard what is not for them)
+  2) addressed: messages carry "to" and go to their target only
+
+Peers are fake WebSockets attached to server.hub, so the numbers cover the
+server's routing, encoding and outbox/writer work. Reports server time
+(until every frame is written, including a 5 ms settle), frames written
+and frames each peer has to parse.
+
+Usage:
+  python bench_signal.py --sizes 2,5,10,20,50 --candidates 5
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from typing import Dict, List
+
+import server
+
+
+class FakeWS:
+    __slots__ = ("frames", "bytes")
+
+    def __init__(self) -> None:
+        self.frames = 0
+        self.bytes = 0
+
+    async def send_text(self, data: str) -> None:
+        self.frames += 1
+        self.bytes += len(data)
+
+    async def send_bytes(self, data: bytes) -> None:
+        await self.send_text(data)
+
+    async def close(self, code: int = 1000) -> None:
+        pass
+
+
+def negotiation(a: str, b: str, candidates: int) -> List[Dict]:
+    # Messages exchanged by one pair of peers (sender, payload)
+    sdp = "v=0\r\n" + "a=rtpmap:111 opus/48000/2\r\n" * 20
+    msgs = [(a, {"type": "offer", "to": b, "data": {"type": "offer", "sdp": sdp}}),
+            (b, {"type": "answer", "to": a, "data": {"type": "answer", "sdp": sdp}})]
+    for i in range(candidates):
+        for src, dst in ((a, b), (b, a)):
+            cand = f"candidate:{i} 1 udp 2122260223 192.168.1.{i} 5{i:04d} typ host"
+            msgs.append((src, {"type": "candidate", "to": dst, "data": {"candidate": cand, "sdpMid": "0"}}))
+    return msgs
+
+
+async def drain(conns) -> None:
+    # Until every writer has sent everything queued (a send is a few loop turns)
+    while any(len(c.outbox) for c in conns):
+        await asyncio.sleep(0)
+    await asyncio.sleep(0.005)
+
+
+async def run(size: int, candidates: int, addressed: bool) -> Dict[str, float]:
+    room_id = f"bench-{size}-{addressed}"
+    conns = {}
+    for _ in range(size):
+        conn = server.hub.add_ws_room(room_id, FakeWS())
+        conns[conn.peer] = conn
+    await drain(conns.values())
+    for conn in conns.values():  # start from zero after the join announcements
+        conn.ws.frames = conn.ws.bytes = 0
+
+    peers = list(conns)
+    msgs = [m for i, a in enumerate(peers) for b in peers[i + 1:] for m in negotiation(a, b, candidates)]
+    t0 = time.perf_counter()
+    for src, payload in msgs:
+        payload = {**payload, "from": src}
+        if addressed:
+            server.hub.send_to_peer(room_id, payload["to"], payload)
+        else:
+            await server.hub.broadcast_room(room_id, payload, sender=conns[src])
+        await asyncio.sleep(0)
+    await drain(conns.values())
+    dt = time.perf_counter() - t0
+
+    frames = sum(c.ws.frames for c in conns.values())
+    data = sum(c.ws.bytes for c in conns.values())
+    for conn in conns.values():
+        server.hub.remove_ws_room(room_id, conn)
+    await asyncio.sleep(0)
+    return {"ms": dt * 1e3, "sent": len(msgs), "frames": frames, "per_peer": frames / size, "kb": data / 1024}
+
+
+async def main_async(args) -> None:
+    print(f"{'peers':>5} {'mode':<10} {'messages':>8} {'frames':>8} {'per peer':>9} {'KiB':>9} {'server ms':>10}")
+    for size in (int(x) for x in args.sizes.split(",")):
+        for addressed in (False, True):
+            r = await run(size, args.candidates, addressed)
+            print(
+                f"{size:>5} {'addressed' if addressed else 'broadcast':<10} {r['sent']:>8} {r['frames']:>8} "
+                f"{r['per_peer']:>9.0f} {r['kb']:>9.0f} {r['ms']:>10.1f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Signaling routing benchmark")
+    parser.add_argument("--sizes", default="2,5,10,20,50", help="Room sizes (default: 2,5,10,20,50)")
+    parser.add_argument("--candidates", type=int, default=5, help="ICE candidates per direction per pair (default: 5)")
+    args = parser.parse_args()
+    server.OUTBOX_SIZE = 1_000_000  # measure routing, not overflow drops
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
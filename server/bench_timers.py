@@ -0,0 +1,106 @@
+"""
+bench_timers.py — Keepalive scheduling for many idle connections.
+
+Keeps `--conns` idle connections alive for `--seconds`, each needing a
+keepalive every `--interval` seconds, in two ways:
+  1) per-connection: one task per connection looping on
+     asyncio.wait_for(outbox.get(), timeout=interval) (the old SSE loop)
+  2) wheel: the tasks just await outbox.get(); one TimerWheel queues the
+     keepalives (what Hub does now)
+
+Reports setup time, timer handles on the event loop, and for the idle
+period: wall and CPU time (an overloaded loop overruns `--seconds`),
+keepalives delivered and CPU per keepalive.
+
+Usage:
+  python bench_timers.py --conns 100000 --interval 1 --seconds 5
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from typing import Dict
+
+from outbound import Outbox
+from timers import TimerWheel
+
+
+async def run(mode: str, args) -> Dict[str, float]:
+    loop = asyncio.get_running_loop()
+    outboxes = [Outbox(16) for _ in range(args.conns)]
+    delivered = 0
+
+    async def per_connection(outbox: Outbox) -> None:
+        nonlocal delivered
+        while True:
+            try:
+                frame = await asyncio.wait_for(outbox.get(), timeout=args.interval)
+            except asyncio.TimeoutError:
+                delivered += 1  # the keepalive
+            else:
+                if frame is None:
+                    return
+
+    async def wheel_driven(outbox: Outbox) -> None:
+        nonlocal delivered
+        while True:
+            frame = await outbox.get()
+            if frame is None:
+                return
+            delivered += 1
+
+    wheel = TimerWheel(args.tick)
+
+    def keepalive(outbox: Outbox) -> None:
+        outbox.put(": keepalive\n\n")
+        wheel.schedule(args.interval, keepalive, outbox)
+
+    t0 = time.perf_counter()
+    if mode == "wheel":
+        wheel.start()
+        for outbox in outboxes:
+            wheel.schedule(args.interval, keepalive, outbox)
+        tasks = [asyncio.create_task(wheel_driven(o)) for o in outboxes]
+    else:
+        tasks = [asyncio.create_task(per_connection(o)) for o in outboxes]
+    await asyncio.sleep(0)
+    setup = time.perf_counter() - t0
+    handles = 0
+
+    def count_handles() -> None:
+        nonlocal handles  # timers the loop keeps in its heap, mid-run
+        handles = len(loop._scheduled)
+
+    loop.call_later(args.seconds / 2, count_handles)
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    await asyncio.sleep(args.seconds)
+    cpu, wall = time.process_time() - cpu0, time.perf_counter() - wall0
+    keepalives = delivered
+
+    wheel.close()
+    for outbox in outboxes:
+        outbox.close()
+    await asyncio.gather(*tasks)
+    return {"setup_s": setup, "handles": handles, "cpu_s": cpu, "wall_s": wall, "keepalives": keepalives}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keepalive timer benchmark")
+    parser.add_argument("--conns", type=int, default=100_000, help="Idle connections (default: 100000)")
+    parser.add_argument("--interval", type=float, default=1.0, help="Keepalive interval in seconds (default: 1)")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Idle time measured (default: 5)")
+    parser.add_argument("--tick", type=float, default=0.5, help="Timer wheel tick in seconds (default: 0.5)")
+    args = parser.parse_args()
+
+    for mode in ("per-connection", "wheel"):
+        r = asyncio.run(run(mode, args))
+        print(
+            f"{mode:<15} setup {r['setup_s']:.2f}s  loop timers {r['handles']:>7}  "
+            f"idle wall {r['wall_s']:.2f}s cpu {r['cpu_s']:.2f}s  keepalives {r['keepalives']:>8}  "
+            f"{r['cpu_s'] / max(r['keepalives'], 1) * 1e6:.1f} us/keepalive"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+cache.py — Size-capped LRU cache of serialized responses.
+
+Entries are (tag, body bytes) under a hashable key. A lookup only hits if
+the caller's current tag matches the stored one, so invalidation is free:
+when the underlying data changes its tag changes, and the stale entry is
+simply replaced on the next miss (or aged out by LRU).
+
+`max_bytes` bounds the total size of the cached bodies plus a fixed
+per-entry overhead; least recently used entries are evicted to stay under
+it. A body larger than the whole cap is never cached.
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+ENTRY_OVERHEAD = 200  # rough bytes per entry for the key, tag and bookkeeping
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[str, bytes]]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, tag: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != tag:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Hashable, tag: str, body: bytes) -> None:
+        size = len(body) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old[1]) + ENTRY_OVERHEAD
+        self._entries[key] = (tag, body)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.bytes -= len(evicted) + ENTRY_OVERHEAD
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
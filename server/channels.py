@@ -0,0 +1,160 @@
+"""
+channels.py — Named pub/sub channels: subscription index and replay buffers.
+
+Any realtime connection (chat WS, signaling WS, SSE) can subscribe to any
+number of named channels. The index keeps both directions:
+  - channel name -> Channel (its subscriber set, sequence number and
+    optional replay buffer)
+  - connection -> names it is subscribed to, so a closing connection
+    leaves all its channels in O(its subscriptions)
+Subscribe and unsubscribe are O(1) set/dict updates. Like the Registry in
+server.py it is only touched from the event loop and never across an
+await, so it needs no locks.
+
+Every published frame gets the channel's next sequence number. With a
+replay buffer (`replay_size` > 0) the last `replay_size` frames are kept
+as encoded JSON, so a subscriber can resume from the last seq it saw.
+Sequence numbers are per process: each worker numbers the frames it
+delivers (the backplane gives every worker the same order for one
+publisher, not across publishers).
+
+A channel is forgotten once it has no subscribers and nothing to replay,
+or (with a replay buffer) once it has also seen no publish for the idle
+TTL given to `prune()`.
+"""
+from __future__ import annotations
+
+import re
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+NAME_RE = re.compile(r"^[\w.\-]{1,128}$")
+
+
+def valid_name(name: Any) -> bool:
+    return isinstance(name, str) and NAME_RE.match(name) is not None
+
+
+class Channel:
+    __slots__ = ("name", "subscribers", "seq", "replay", "last_publish")
+
+    def __init__(self, name: str, replay_size: int = 0) -> None:
+        self.name = name
+        self.subscribers: Set[Any] = set()
+        self.seq = 0  # seq of the last frame published
+        self.replay: Optional[Deque[Tuple[int, str]]] = deque(maxlen=replay_size) if replay_size > 0 else None
+        self.last_publish = time.monotonic()
+
+    def advance(self) -> int:
+        # Sequence number for the next frame (pass it and the frame to record())
+        self.seq += 1
+        self.last_publish = time.monotonic()
+        return self.seq
+
+    def record(self, seq: int, text: str) -> None:
+        if self.replay is not None:
+            self.replay.append((seq, text))
+
+    def since(self, seq: int) -> Tuple[List[str], bool]:
+        """Buffered frames after `seq`, and whether any were lost."""
+        if seq > self.seq:
+            return [], True  # numbered by another worker or before a restart
+        if self.replay is None or seq == self.seq:
+            return [], seq < self.seq
+        frames = [text for s, text in self.replay if s > seq]
+        oldest = self.replay[0][0] if self.replay else self.seq + 1
+        return frames, oldest > seq + 1
+
+
+class ChannelIndex:
+    def __init__(self, replay_size: int = 0, replay_sizes: Optional[Dict[str, int]] = None) -> None:
+        self.replay_size = replay_size           # default replay buffer per channel
+        self.replay_sizes = replay_sizes or {}   # per-channel overrides
+        self._channels: Dict[str, Channel] = {}
+        self._by_conn: Dict[Any, Set[str]] = {}
+        self.subscriptions = 0
+
+    def __len__(self) -> int:
+        return len(self._channels)
+
+    def get(self, name: str) -> Optional[Channel]:
+        return self._channels.get(name)
+
+    def channel(self, name: str) -> Channel:
+        channel = self._channels.get(name)
+        if channel is None:
+            channel = self._channels[name] = Channel(name, self.replay_sizes.get(name, self.replay_size))
+        return channel
+
+    def for_publish(self, name: str) -> Optional[Channel]:
+        # The channel to deliver to, or None when a frame would reach nobody
+        # and could not be replayed either
+        channel = self._channels.get(name)
+        if channel is None and self.replay_sizes.get(name, self.replay_size) > 0:
+            channel = self.channel(name)
+        return channel
+
+    def channels_of(self, conn: Any) -> Set[str]:
+        return self._by_conn.get(conn, set())
+
+    def subscribe(self, name: str, conn: Any) -> Channel:
+        channel = self.channel(name)
+        if conn not in channel.subscribers:
+            channel.subscribers.add(conn)
+            names = self._by_conn.get(conn)
+            if names is None:
+                names = self._by_conn[conn] = set()
+            names.add(name)
+            self.subscriptions += 1
+        return channel
+
+    def unsubscribe(self, name: str, conn: Any) -> bool:
+        channel = self._channels.get(name)
+        if channel is None or conn not in channel.subscribers:
+            return False
+        channel.subscribers.remove(conn)
+        self.subscriptions -= 1
+        names = self._by_conn[conn]
+        names.discard(name)
+        if not names:
+            del self._by_conn[conn]
+        if not channel.subscribers and not channel.replay:
+            del self._channels[name]
+        return True
+
+    def drop(self, conn: Any) -> int:
+        # Unsubscribe a closing connection from everything
+        names = list(self._by_conn.get(conn, ()))
+        for name in names:
+            self.unsubscribe(name, conn)
+        return len(names)
+
+    def prune(self, idle_ttl: float) -> int:
+        # Forget unsubscribed channels whose replay buffer went stale
+        cutoff = time.monotonic() - idle_ttl
+        idle = [
+            name for name, ch in self._channels.items()
+            if not ch.subscribers and (not ch.replay or ch.last_publish < cutoff)
+        ]
+        for name in idle:
+            del self._channels[name]
+        return len(idle)
+
+    def clear_replay(self) -> None:
+        for name, channel in list(self._channels.items()):
+            if channel.replay is not None:
+                channel.replay.clear()
+            if not channel.subscribers:
+                del self._channels[name]
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "channel": name,
+                "subscribers": len(ch.subscribers),
+                "seq": ch.seq,
+                "replay": len(ch.replay) if ch.replay is not None else None,
+            }
+            for name, ch in self._channels.items()
+        ]
@@ -0,0 +1,149 @@
+"""
+codec.py — Wire encodings for realtime frames.
+
+  - dumps()/loads(): compact UTF-8 JSON text, using orjson when it is
+    installed (several times faster) and the stdlib otherwise; both produce
+    the same output. FAST_JSON=0 forces the stdlib.
+  - Codec objects describe one WebSocket encoding: "json" (text frames,
+    the default) and, when msgpack is installed, "msgpack" (binary frames).
+    Clients pick one through the WebSocket subprotocol header.
+  - Frame: one payload being fanned out, encoded lazily at most once per
+    codec no matter how many connections receive it.
+  - Codec.bundle(): several already-encoded frames as one
+    {"type": "bundle", "data": [...]} frame, spliced without re-encoding.
+"""
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Dict, Optional, Sequence, Union
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional binary protocol
+    msgpack = None
+
+if os.environ.get("FAST_JSON", "1") == "0":
+    orjson = None
+
+JSON_IMPL = "orjson" if orjson is not None else "stdlib"
+
+if orjson is not None:
+    def dumps(obj: Any) -> str:
+        try:
+            return orjson.dumps(obj).decode("utf-8")
+        except TypeError:  # e.g. non-str dict keys, which the stdlib coerces
+            return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    def loads(data: Union[str, bytes]) -> Any:
+        return orjson.loads(data)
+else:
+    def dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    def loads(data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+# Raised by loads() on malformed input (orjson's error subclasses it too)
+DecodeError = ValueError
+
+
+class Codec:
+    name = ""
+    binary = False
+
+    def encode(self, obj: Any) -> Union[str, bytes]:
+        raise NotImplementedError
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        raise NotImplementedError
+
+    def bundle(self, frames: Sequence[Union[str, bytes]]) -> Union[str, bytes]:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    name = "json"
+    binary = False
+
+    def encode(self, obj: Any) -> str:
+        return dumps(obj)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        return loads(data)
+
+    def bundle(self, frames: Sequence[str]) -> str:
+        return '{"type":"bundle","data":[' + ",".join(frames) + "]}"
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+    binary = True
+
+    def encode(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        if isinstance(data, str):  # a text frame on a msgpack socket is JSON
+            return loads(data)
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except Exception as e:
+            raise DecodeError(str(e)) from e
+
+    def bundle(self, frames: Sequence[bytes]) -> bytes:
+        # fixmap of 2 {"type": "bundle", "data": <array header + frames>}
+        head = b"\x82" + msgpack.packb("type") + msgpack.packb("bundle") + msgpack.packb("data")
+        return head + msgpack.Packer().pack_array_header(len(frames)) + b"".join(frames)
+
+
+JSON = JsonCodec()
+CODECS: Dict[str, Codec] = {"json": JSON}
+if msgpack is not None:
+    CODECS["msgpack"] = MsgpackCodec()
+
+
+def negotiate(requested: Sequence[str]) -> Optional[Codec]:
+    """First requested subprotocol we support, or None (plain JSON, no header)."""
+    for proto in requested:
+        codec = CODECS.get(proto.strip().lower())
+        if codec is not None:
+            return codec
+    return None
+
+
+class Frame:
+    """A payload plus its encodings, computed on first use per codec."""
+
+    __slots__ = ("payload", "_json", "_other")
+
+    def __init__(self, payload: Any = None, json_text: Optional[str] = None) -> None:
+        if payload is None and json_text is None:
+            raise ValueError("Frame needs a payload or its JSON text")
+        self.payload = payload
+        self._json = json_text
+        self._other: Optional[Dict[str, Union[str, bytes]]] = None
+
+    @property
+    def json(self) -> str:
+        if self._json is None:
+            self._json = dumps(self.payload)
+        return self._json
+
+    def encoded(self, codec: Codec) -> Union[str, bytes]:
+        if codec is JSON:
+            return self.json
+        if self._other is None:
+            self._other = {}
+        data = self._other.get(codec.name)
+        if data is None:
+            if self.payload is None:
+                self.payload = loads(self._json)
+            data = self._other[codec.name] = codec.encode(self.payload)
+        return data
+
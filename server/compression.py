@@ -0,0 +1,208 @@
+"""
+compression.py — permessage-deflate for WebSockets and Content-Encoding for
+HTTP bodies.
+
+WebSockets: uvicorn negotiates permessage-deflate (RFC 7692) with fixed
+settings and compresses every message, however small. DeflateWebSocketProtocol
+runs uvicorn's sansio WebSocket protocol (uvicorn >= 0.35, `--ws
+websockets-sansio`) with the settings given to configure_ws_deflate() instead:
+  - level / mem_level / window_bits: zlib settings. Each connection keeps its
+    own compressor, so a fan-out to N sockets compresses N times; low levels
+    get most of the gain on JSON for a fraction of the CPU.
+  - context_takeover: keep the compressor between messages, so keys and
+    values repeated across frames ("type", "user_id", ...) shrink to
+    back-references. Costs about 2**(window_bits+2) + 2**(mem_level+9) bytes
+    per connection; without it that memory is only held while a message is
+    being compressed.
+  - min_bytes: smaller messages are sent uncompressed (RFC 7692 allows that
+    per message), where deflate saves a few bytes at the price of a
+    compressor call.
+Run the server with
+
+    uvicorn server:app --ws compression:DeflateWebSocketProtocol --ws-ping-interval 0
+
+The server's timer wheel keeps WebSockets alive, so uvicorn's per-connection
+ping tasks are turned off (an interval of 0 is read as "none").
+
+uvicorn imports the protocol before the app has called configure_ws_deflate(),
+so the class behind it is picked on the first connection, and uvicorn's sansio
+module and the websockets internals are only imported then. With deflate
+disabled, or if they cannot be imported (older uvicorn or websockets), it is
+uvicorn's stock protocol (`--ws auto`) instead: no compression when disabled,
+uvicorn's fixed settings otherwise (logged as a warning).
+
+HTTP: negotiate_encoding() picks "br" (when the optional brotli package is
+installed) or "gzip" from an Accept-Encoding header, and compress() encodes
+a body with the configured level. Callers cache the result next to the
+uncompressed body, so a page is compressed once and not per request.
+"""
+from __future__ import annotations
+
+import logging
+import zlib
+from typing import Any, Dict, Optional, Sequence
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)  # in order of preference
+
+log = logging.getLogger("realtime.compression")
+
+
+# -----------------------------------------------------------------------------
+# WebSocket permessage-deflate
+# -----------------------------------------------------------------------------
+
+class DeflateStats:
+    # Totals over all connections (for metrics)
+    bytes_in = 0       # payload bytes of compressed messages, before
+    bytes_out = 0      # and after compression
+    skipped = 0        # messages sent uncompressed for being under min_bytes
+
+
+WS_DEFLATE: Dict[str, Any] = {
+    "enabled": True,
+    "level": 1,
+    "mem_level": 5,
+    "window_bits": 12,
+    "context_takeover": True,
+    "min_bytes": 128,
+}
+
+
+def configure_ws_deflate(**settings: Any) -> None:
+    unknown = set(settings) - set(WS_DEFLATE)
+    if unknown:
+        raise ValueError(f"unknown permessage-deflate settings: {', '.join(sorted(unknown))}")
+    WS_DEFLATE.update(settings)
+
+
+def _sansio_protocol() -> type:
+    # Imported here, not at the top: only a server with deflate enabled needs
+    # uvicorn's sansio module and the websockets extension internals
+    from uvicorn.protocols.websockets.websockets_sansio_impl import WebSocketsSansIOProtocol
+    from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+    from websockets.frames import Opcode
+
+    class ThresholdDeflate(PerMessageDeflate):
+        def __init__(self, *args: Any, min_bytes: int = 0, **kwargs: Any) -> None:
+            super().__init__(*args, **kwargs)
+            self.min_bytes = min_bytes
+
+        def encode(self, frame):
+            # Only unfragmented messages are skipped: a fragmented one is
+            # compressed as a whole or not at all
+            if frame.fin and frame.opcode in (Opcode.TEXT, Opcode.BINARY) and len(frame.data) < self.min_bytes:
+                DeflateStats.skipped += 1
+                return frame
+            encoded = super().encode(frame)
+            if encoded is not frame:
+                DeflateStats.bytes_in += len(frame.data)
+                DeflateStats.bytes_out += len(encoded.data)
+            return encoded
+
+    class ThresholdDeflateFactory(ServerPerMessageDeflateFactory):
+        def __init__(self, min_bytes: int = 0, **kwargs: Any) -> None:
+            super().__init__(**kwargs)
+            self.min_bytes = min_bytes
+
+        def process_request_params(self, params, accepted_extensions):
+            response, ext = super().process_request_params(params, accepted_extensions)
+            return response, ThresholdDeflate(
+                ext.remote_no_context_takeover,
+                ext.local_no_context_takeover,
+                ext.remote_max_window_bits,
+                ext.local_max_window_bits,
+                self.compress_settings,
+                min_bytes=self.min_bytes,
+            )
+
+    s = WS_DEFLATE
+    factory = ThresholdDeflateFactory(
+        min_bytes=s["min_bytes"],
+        server_no_context_takeover=not s["context_takeover"],
+        server_max_window_bits=s["window_bits"],
+        client_max_window_bits=s["window_bits"],
+        compress_settings={"level": s["level"], "memLevel": s["mem_level"]},
+    )
+
+    class ThresholdDeflateProtocol(WebSocketsSansIOProtocol):
+        def __init__(self, *args: Any, **kwargs: Any) -> None:
+            super().__init__(*args, **kwargs)
+            if self.config.ws_per_message_deflate:  # --ws-per-message-deflate false still wins
+                self.conn.available_extensions = [factory]
+
+    return ThresholdDeflateProtocol
+
+
+_ws_protocol: Optional[type] = None
+
+
+def ws_protocol(config: Any) -> type:
+    """The protocol class behind DeflateWebSocketProtocol, picked once."""
+    global _ws_protocol
+    if _ws_protocol is not None:
+        return _ws_protocol
+    if config.ws_ping_interval == 0:
+        # The sansio and wsproto protocols read 0 as "no pings", the legacy
+        # websockets one (what `auto` picks on older uvicorn) would ping in
+        # a tight loop
+        config.ws_ping_interval = None
+    if WS_DEFLATE["enabled"]:
+        try:
+            _ws_protocol = _sansio_protocol()
+            return _ws_protocol
+        except ImportError as exc:
+            log.warning("permessage-deflate settings not applied, using uvicorn's stock WebSocket protocol: %s", exc)
+    else:
+        config.ws_per_message_deflate = False
+    from uvicorn.protocols.websockets.auto import AutoWebSocketsProtocol
+
+    _ws_protocol = AutoWebSocketsProtocol
+    return _ws_protocol
+
+
+class DeflateWebSocketProtocol:
+    # What `--ws compression:DeflateWebSocketProtocol` names: uvicorn only
+    # calls it, and gets an instance of the protocol ws_protocol() picked
+    def __new__(cls, *args: Any, **kwargs: Any) -> Any:
+        return ws_protocol(kwargs["config"])(*args, **kwargs)
+
+
+# -----------------------------------------------------------------------------
+# HTTP Content-Encoding
+# -----------------------------------------------------------------------------
+
+def negotiate_encoding(accept_encoding: Optional[str], available: Sequence[str] = ENCODINGS) -> Optional[str]:
+    # The first of `available` the client accepts (q > 0), or None for identity
+    if not accept_encoding:
+        return None
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    wildcard = accepted.get("*", 0.0)
+    for encoding in available:
+        if accepted.get(encoding, wildcard) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str, level: int) -> bytes:
+    # `level` on the encoding's own scale: gzip 1-9, brotli quality 0-11
+    if encoding == "gzip":
+        c = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+        return c.compress(body) + c.flush()
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(body, quality=level)
+    raise ValueError(f"unsupported content encoding: {encoding}")
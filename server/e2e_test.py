@@ -6,6 +6,12 @@ What it verifies (all at once):
   2) WebSocket chat echo + broadcast across two WS clients of the same user
   3) SSE stream receives the same message as WS clients
   4) WebRTC signaling relay forwards messages between two peers in the same room
+  5) Signaling peers: ids and presence, addressed ("to") delivery to one peer
+     only with a server-set "from", errors for unknown peers
+  6) SSE resume: Last-Event-ID replays missed messages, unknown ids resync
+  7) History: cursor pagination and 304 revalidation via ETag
+  8) Bulk rate limit: a 429 for one user of a mixed-user POST /api/messages
+     charges none of them (needs the default RATE_LIMIT_BULK* settings)
 
 Usage:
   python e2e_test.py --base http://localhost:8000 --user alice --room room42
@@ -69,7 +75,7 @@ async def sse_listener(session: aiohttp.ClientSession, url: str, queue: asyncio.
 
 
 async def ws_reader(ws: aiohttp.ClientWebSocketResponse, queue: asyncio.Queue):
-    """Read messages from a connected WebSocket and push ('msg', obj) into queue."""
+    """Read messages from a connected WebSocket and push ('msg', obj) into queue (bundles are unpacked)."""
     try:
         async for msg in ws:
             if msg.type == aiohttp.WSMsgType.TEXT:
@@ -77,6 +83,11 @@ async def ws_reader(ws: aiohttp.ClientWebSocketResponse, queue: asyncio.Queue):
                     data = json.loads(msg.data)
                 except Exception:
                     data = {"raw": msg.data}
+                if isinstance(data, dict) and data.get("type") == "bundle":
+                    # Micro-batched frames (COALESCE_WINDOW_MS): unpack in order
+                    for item in data.get("data") or []:
+                        await queue.put(("msg", item))
+                    continue
                 await queue.put(("msg", data))
             elif msg.type == aiohttp.WSMsgType.ERROR:
                 await queue.put(("error", {"error": str(ws.exception())}))
@@ -87,6 +98,38 @@ async def ws_reader(ws: aiohttp.ClientWebSocketResponse, queue: asyncio.Queue):
         await queue.put(("error", {"exception": repr(e)}))
 
 
+async def read_sse(session: aiohttp.ClientSession, url: str, count: int, timeout: float, headers=None):
+    """Open an SSE stream, return its first `count` events as (id, obj), then disconnect."""
+    events = []
+    event_id = None
+    async with session.get(url, headers={"Accept": "text/event-stream", **(headers or {})}) as resp:
+        if resp.status != 200:
+            raise AssertionError(f"SSE {url} returned {resp.status}")
+
+        async def collect():
+            nonlocal event_id
+            async for raw in resp.content:
+                line = raw.decode("utf-8", errors="ignore").rstrip("\n")
+                if line.startswith("id:"):
+                    event_id = int(line[3:].strip())
+                elif line.startswith("data:"):
+                    events.append((event_id, json.loads(line[5:].strip())))
+                    if len(events) >= count:
+                        return
+
+        try:
+            await asyncio.wait_for(collect(), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError(f"Timeout while reading {count} SSE events from {url} (got {len(events)})")
+    return events
+
+
+def expect(cond: bool, label: str, detail: Any = None) -> None:
+    """Fail the run with a readable message unless cond holds."""
+    if not cond:
+        raise AssertionError(f"{label}: {j(detail)}" if detail is not None else label)
+
+
 async def wait_for_queue_match(
     queue: asyncio.Queue,
     predicate: Callable[[Tuple[str, Any]], bool],
@@ -165,6 +208,15 @@ async def main():
         sigB_ready.set()
         sigB_task = asyncio.create_task(ws_reader(sigB, sigB_q))
 
+        def is_type(item, mtype: str) -> bool:
+            return item[0] == "msg" and isinstance(item[1], dict) and item[1].get("type") == mtype
+
+        # Each signaling peer learns its id from the hello
+        _, helloA = await wait_for_queue_match(sigA_q, lambda it: is_type(it, "signal_hello"), T, "Sig A hello")
+        _, helloB = await wait_for_queue_match(sigB_q, lambda it: is_type(it, "signal_hello"), T, "Sig B hello")
+        peerA, peerB = helloA["peer_id"], helloB["peer_id"]
+        expect(peerA in helloB.get("peers", []), "Sig B hello lists peer A", helloB)
+
         # Wait readiness
         await asyncio.wait_for(sse_ready.wait(), timeout=T)
         await asyncio.wait_for(ws1_ready.wait(), timeout=T)
@@ -266,6 +318,109 @@ async def main():
 
         print("[PASS] Signaling relay OK")
 
+        # ---------- Check 4: Peer-addressed signaling ----------
+        print("[STEP] Signaling: C joins; A -> B addressed offer, C must not see it; unknown peer; C leaves")
+        sigC_q: asyncio.Queue = asyncio.Queue()
+        sigC = await session.ws_connect(f"{ws_base}/signal/{room_id}")
+        sigC_task = asyncio.create_task(ws_reader(sigC, sigC_q))
+        _, helloC = await wait_for_queue_match(sigC_q, lambda it: is_type(it, "signal_hello"), T, "Sig C hello")
+        peerC = helloC["peer_id"]
+        expect({peerA, peerB} <= set(helloC.get("peers", [])), "Sig C hello lists A and B", helloC)
+        await wait_for_queue_match(
+            sigA_q, lambda it: is_type(it, "peer_joined") and it[1].get("peer_id") == peerC, T, "Sig A sees C join",
+        )
+
+        direct_nonce = str(uuid.uuid4())[:8]
+        await sigA.send_json({"type": "offer", "sdp": "dummy-sdp", "nonce": direct_nonce, "to": peerB, "from": "spoofed"})
+        _, direct = await wait_for_queue_match(
+            sigB_q, lambda it: is_type(it, "offer") and it[1].get("nonce") == direct_nonce, T, "Sig B receive addressed offer",
+        )
+        expect(direct.get("from") == peerA, "addressed offer carries the sender's peer id in 'from'", direct)
+
+        # A room-wide marker sent after the addressed offer reaches C in
+        # order, so C must not have seen the offer by then
+        marker_nonce = str(uuid.uuid4())[:8]
+        await sigA.send_json({"type": "note", "nonce": marker_nonce})
+        leaked = []
+
+        def marker_or_leak(item) -> bool:
+            if is_type(item, "offer") and item[1].get("nonce") == direct_nonce:
+                leaked.append(item[1])
+            return is_type(item, "note") and item[1].get("nonce") == marker_nonce
+
+        await wait_for_queue_match(sigC_q, marker_or_leak, T, "Sig C receive room-wide marker")
+        expect(not leaked, "addressed offer was delivered to a third peer", leaked)
+
+        await sigA.send_json({"type": "candidate", "candidate": "dummy", "to": "no-such-peer"})
+        _, err = await wait_for_queue_match(sigA_q, lambda it: is_type(it, "error"), T, "Sig A unknown-peer error")
+        expect(err.get("data", {}).get("reason") == "unknown peer" and err["data"].get("to") == "no-such-peer", "unknown-peer error", err)
+
+        await sigC.close()
+        sigC_task.cancel()
+        await wait_for_queue_match(
+            sigA_q, lambda it: is_type(it, "peer_left") and it[1].get("peer_id") == peerC, T, "Sig A sees C leave",
+        )
+        print("[PASS] Addressed delivery, unknown-peer error and presence OK")
+
+        # ---------- Check 5: SSE resume with Last-Event-ID ----------
+        print("[STEP] SSE: reconnect with Last-Event-ID -> missed messages replayed in order")
+        sse_url = f"{base}/sse/{user_id}"
+        (cursor, hello), = await read_sse(session, sse_url, 1, T)
+        expect(hello.get("type") == "sse_hello" and cursor is not None, "SSE hello carries an event id", hello)
+        missed = [f"missed {i} {uuid.uuid4().hex[:8]}" for i in range(2)]
+        for text in missed:
+            async with session.post(f"{base}/api/message", json={"user_id": user_id, "role": "user", "text": text}) as r:
+                expect(r.status == 200, "POST /api/message", await r.json())
+
+        events = await read_sse(session, sse_url, 3, T, headers={"Last-Event-ID": str(cursor)})
+        replayed = [(eid, obj.get("data", {}).get("text")) for eid, obj in events[1:]]
+        expect(events[0][1].get("type") == "sse_hello", "resumed stream starts with hello", events[0])
+        expect(replayed == [(cursor + 1, missed[0]), (cursor + 2, missed[1])], "replayed messages and ids", replayed)
+
+        events = await read_sse(session, sse_url, 2, T, headers={"Last-Event-ID": "999999999"})
+        expect(events[1][1].get("type") == "resync_required", "unknown Last-Event-ID asks for a resync", events)
+        print("[PASS] SSE resume OK")
+
+        # ---------- Check 6: History pagination ----------
+        print("[STEP] History: newest page, then the older page via its cursor")
+        history_url = f"{base}/api/history/{user_id}"
+        async with session.get(history_url, params={"limit": "2"}) as r:
+            page1 = await r.json()
+            etag = r.headers.get("ETag")
+        expect([m["text"] for m in page1["messages"]] == missed, "newest page holds the latest messages", page1)
+        expect(page1["has_more"] and page1["next"] == page1["messages"][0]["id"], "newest page points at older ones", page1)
+
+        async with session.get(history_url, params={"limit": "2", "before": page1["next"]}) as r:
+            page2 = await r.json()
+        ids1 = {m["id"] for m in page1["messages"]}
+        expect(page2["messages"] and not ids1 & {m["id"] for m in page2["messages"]}, "older page does not overlap", page2)
+        expect(page2["messages"][-1]["ts"] <= page1["messages"][0]["ts"], "older page is older", page2)
+        print("[PASS] History pagination OK")
+
+        # ---------- Check 7: History revalidation ----------
+        print("[STEP] History: unchanged page revalidates with 304 on If-None-Match")
+        expect(etag is not None, "history response carries an ETag")
+        async with session.get(history_url, params={"limit": "2"}, headers={"If-None-Match": etag}) as r:
+            expect(r.status == 304, "unchanged history revalidates with 304", r.status)
+        print("[PASS] History 304 OK")
+
+        # ---------- Check 8: Bulk admission is all-or-nothing ----------
+        print("[STEP] Bulk: drain user Y's bulk budget, then a mixed X+Y upload -> 429 that leaves X's budget intact")
+        bulk_x, bulk_y = f"bulk-x-{uuid.uuid4().hex[:8]}", f"bulk-y-{uuid.uuid4().hex[:8]}"
+
+        def bulk(user: str, n: int):
+            return [{"user_id": user, "text": f"bulk {i}"} for i in range(n)]
+
+        async with session.post(f"{base}/api/messages", json={"messages": bulk(bulk_y, 10000)}) as r:
+            expect(r.status == 200, "first bulk upload for Y", r.status)
+        async with session.post(f"{base}/api/messages", json={"messages": bulk(bulk_x, 5000) + bulk(bulk_y, 5000)}) as r:
+            detail = await r.json()
+            expect(r.status == 429 and r.headers.get("Retry-After"), "mixed upload is rate limited", detail)
+            expect(bulk_y in detail.get("detail", ""), "the 429 names the user over budget", detail)
+        async with session.post(f"{base}/api/messages", json={"messages": bulk(bulk_x, 10000)}) as r:
+            expect(r.status == 200, "X's full bulk budget is still there after the rejected upload", await r.json())
+        print("[PASS] Bulk rate limit charges nobody on a 429")
+
         # ---------- Done ----------
         print("\n✅ ALL CHECKS PASSED")
         rc = 0
@@ -0,0 +1,414 @@
+"""
+load_test.py — Load generator and latency benchmark for the FastAPI realtime server.
+
+Built on the e2e_test.py client helpers (sse_listener, ws_reader,
+wait_for_queue_match). It:
+  1) ramps up many concurrent chat WebSocket, SSE and signaling clients
+     across many users and rooms, timing each connection setup
+  2) drives chat messages at a fixed rate (via POST /api/message and/or
+     WS "message" frames) and signaling offers at a fixed rate
+  3) measures end-to-end delivery latency for every frame received by every
+     client (send time -> receive time, same clock), plus throughput and loss
+  4) writes all results to a JSON file, optionally comparing them with a
+     previous run
+
+Usage:
+  python load_test.py --base http://localhost:8000 --users 500 --ws-per-user 2 --sse-per-user 1 \\
+      --rooms 100 --peers-per-room 4 --rate 2000 --signal-rate 200 --duration 30 --out run.json
+  python load_test.py ... --compare baseline.json
+
+Exit codes:
+  0 on success, 1 if connections failed or the loss exceeds --max-loss.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+from e2e_test import sse_listener, wait_for_queue_match, ws_reader
+
+NONCE_PREFIX = "lt:"
+
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p95/p99/max in milliseconds (None when there are no samples)."""
+    if not samples:
+        return {"count": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    xs = sorted(samples)
+
+    def at(q: float) -> float:
+        return round(xs[min(len(xs) - 1, int(q * len(xs)))] * 1000, 3)
+
+    return {"count": len(xs), "p50_ms": at(0.50), "p95_ms": at(0.95), "p99_ms": at(0.99), "max_ms": round(xs[-1] * 1000, 3)}
+
+
+class Stats:
+    """Shared bookkeeping: send times per nonce and observed latencies."""
+
+    def __init__(self) -> None:
+        self.sent_at: Dict[str, float] = {}
+        self.chat_latency: List[float] = []
+        self.signal_latency: List[float] = []
+        self.setup: Dict[str, List[float]] = {"ws": [], "sse": [], "signal": []}
+        self.connect_errors = 0
+        self.send_errors = 0
+        self.chat_sent = 0
+        self.chat_expected = 0
+        self.signal_sent = 0
+        self.signal_expected = 0
+        self.client_errors: List[Any] = []
+        self.measuring = False
+
+
+def extract_nonce(obj: Any) -> Optional[str]:
+    """Find our nonce in a chat message / echo or a signaling frame."""
+    if not isinstance(obj, dict):
+        return None
+    nonce = obj.get("nonce")
+    if isinstance(nonce, str) and nonce.startswith(NONCE_PREFIX):
+        return nonce
+    data = obj.get("data")
+    if isinstance(data, dict):
+        text = data.get("text")
+        if isinstance(text, str) and text.startswith(NONCE_PREFIX):
+            return text.split(" ", 1)[0]
+    return None
+
+
+async def consume(queue: asyncio.Queue, stats: Stats, kind: str) -> None:
+    """Drain one client's queue, recording latency for every tagged frame."""
+    loop = asyncio.get_running_loop()
+    target = stats.signal_latency if kind == "signal" else stats.chat_latency
+    while True:
+        tag, obj = await queue.get()
+        now = loop.time()
+        if tag == "error":
+            stats.client_errors.append(obj)
+            continue
+        if kind != "signal" and isinstance(obj, dict) and obj.get("type") != "message":
+            continue  # count broadcasts only; echoes are acknowledgements
+        nonce = extract_nonce(obj)
+        if nonce is not None and stats.measuring:
+            sent = stats.sent_at.get(nonce)
+            if sent is not None:
+                target.append(now - sent)
+
+
+class Fleet:
+    """All connected clients plus the tasks reading from them."""
+
+    def __init__(self) -> None:
+        self.tasks: List[asyncio.Task] = []
+        self.chat_ws: Dict[str, List[aiohttp.ClientWebSocketResponse]] = {}
+        self.room_ws: Dict[str, List[aiohttp.ClientWebSocketResponse]] = {}
+        self.sse_per_user: Dict[str, int] = {}
+
+    async def close(self) -> None:
+        for t in self.tasks:
+            t.cancel()
+        for conns in itertools.chain(self.chat_ws.values(), self.room_ws.values()):
+            for ws in conns:
+                try:
+                    await ws.close()
+                except Exception:
+                    pass
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+async def connect_ws(session, url: str, hello_type: str, kind: str, stats: Stats, fleet: Fleet, T: float):
+    """Open one WS client, wait for its hello and start its reader/consumer."""
+    loop = asyncio.get_running_loop()
+    q: asyncio.Queue = asyncio.Queue()
+    t0 = loop.time()
+    try:
+        ws = await session.ws_connect(url)
+        fleet.tasks.append(asyncio.create_task(ws_reader(ws, q)))
+        await wait_for_queue_match(q, lambda it: it[0] == "msg" and it[1].get("type") == hello_type, T, hello_type)
+    except Exception:
+        stats.connect_errors += 1
+        return None
+    stats.setup[kind].append(loop.time() - t0)
+    fleet.tasks.append(asyncio.create_task(consume(q, stats, kind)))
+    return ws
+
+
+async def connect_sse(session, url: str, stats: Stats, fleet: Fleet, T: float) -> bool:
+    """Open one SSE client and wait for its hello event."""
+    loop = asyncio.get_running_loop()
+    q: asyncio.Queue = asyncio.Queue()
+    ready = asyncio.Event()
+    t0 = loop.time()
+    fleet.tasks.append(asyncio.create_task(sse_listener(session, url, q, ready)))
+    try:
+        await wait_for_queue_match(q, lambda it: it[0] == "event" and it[1].get("type") == "sse_hello", T, "sse_hello")
+    except Exception:
+        stats.connect_errors += 1
+        return False
+    stats.setup["sse"].append(loop.time() - t0)
+    fleet.tasks.append(asyncio.create_task(consume(q, stats, "sse")))
+    return True
+
+
+async def ramp_up(session, args, stats: Stats, fleet: Fleet) -> float:
+    """Open every client, spreading connection starts over --ramp seconds."""
+    base = args.base.rstrip("/")
+    ws_base = base.replace("http://", "ws://").replace("https://", "wss://")
+    sem = asyncio.Semaphore(args.connect_concurrency)
+    jobs = []
+    for u in range(args.users):
+        user_id = f"{args.prefix}u{u}"
+        fleet.chat_ws[user_id] = []
+        fleet.sse_per_user[user_id] = 0
+        jobs += [("ws", user_id)] * args.ws_per_user + [("sse", user_id)] * args.sse_per_user
+    for r in range(args.rooms):
+        room_id = f"{args.prefix}r{r}"
+        fleet.room_ws[room_id] = []
+        jobs += [("signal", room_id)] * args.peers_per_room
+    random.shuffle(jobs)
+
+    loop = asyncio.get_running_loop()
+    t0 = loop.time()
+    gap = args.ramp / max(1, len(jobs))
+
+    async def one(i: int, kind: str, key: str) -> None:
+        await asyncio.sleep(i * gap)
+        async with sem:
+            if kind == "ws":
+                ws = await connect_ws(session, f"{ws_base}/ws/{key}", "ws_hello", "ws", stats, fleet, args.timeout)
+                if ws is not None:
+                    fleet.chat_ws[key].append(ws)
+            elif kind == "sse":
+                if await connect_sse(session, f"{base}/sse/{key}", stats, fleet, args.timeout):
+                    fleet.sse_per_user[key] += 1
+            else:
+                ws = await connect_ws(session, f"{ws_base}/signal/{key}", "signal_hello", "signal", stats, fleet, args.timeout)
+                if ws is not None:
+                    fleet.room_ws[key].append(ws)
+
+    await asyncio.gather(*(one(i, kind, key) for i, (kind, key) in enumerate(jobs)))
+    return loop.time() - t0
+
+
+async def drive_chat(session, args, stats: Stats, fleet: Fleet, counter) -> None:
+    """Send chat messages at --rate/s for --duration seconds."""
+    if args.rate <= 0:
+        return
+    base = args.base.rstrip("/")
+    loop = asyncio.get_running_loop()
+    users = [u for u, conns in fleet.chat_ws.items() if conns or fleet.sse_per_user[u]]
+    if not users:
+        return
+    interval = 1.0 / args.rate
+    start = loop.time()
+    pending = set()
+    i = 0
+    while True:
+        due = start + i * interval
+        if due - start >= args.duration:
+            break
+        delay = due - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        user_id = random.choice(users)
+        nonce = f"{NONCE_PREFIX}{next(counter)}"
+        text = f"{nonce} load message"
+        receivers = len(fleet.chat_ws[user_id]) + fleet.sse_per_user[user_id]
+        via_ws = fleet.chat_ws[user_id] and (args.via == "ws" or (args.via == "mix" and i % 2))
+        stats.sent_at[nonce] = loop.time()
+        stats.chat_sent += 1
+        stats.chat_expected += receivers
+        if via_ws:
+            pending.add(asyncio.create_task(send_ws(random.choice(fleet.chat_ws[user_id]), {"type": "message", "data": {"text": text}}, stats)))
+        else:
+            pending.add(asyncio.create_task(post(session, f"{base}/api/message", {"user_id": user_id, "role": "user", "text": text}, stats)))
+        if len(pending) > 1024:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        i += 1
+    await asyncio.gather(*pending)
+
+
+async def drive_signal(args, stats: Stats, fleet: Fleet, counter) -> None:
+    """Send signaling offers at --signal-rate/s for --duration seconds."""
+    if args.signal_rate <= 0:
+        return
+    loop = asyncio.get_running_loop()
+    rooms = [r for r, peers in fleet.room_ws.items() if len(peers) >= 2]
+    if not rooms:
+        return
+    interval = 1.0 / args.signal_rate
+    start = loop.time()
+    pending = set()
+    i = 0
+    while True:
+        due = start + i * interval
+        if due - start >= args.duration:
+            break
+        delay = due - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        room_id = random.choice(rooms)
+        peers = fleet.room_ws[room_id]
+        nonce = f"{NONCE_PREFIX}{next(counter)}"
+        stats.sent_at[nonce] = loop.time()
+        stats.signal_sent += 1
+        stats.signal_expected += len(peers) - 1
+        pending.add(asyncio.create_task(send_ws(random.choice(peers), {"type": "offer", "sdp": "load-sdp", "nonce": nonce}, stats)))
+        if len(pending) > 1024:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        i += 1
+    await asyncio.gather(*pending)
+
+
+async def post(session, url: str, payload: Dict[str, Any], stats: Stats) -> None:
+    try:
+        async with session.post(url, json=payload) as r:
+            if r.status != 200:
+                stats.send_errors += 1
+            await r.read()
+    except Exception:
+        stats.send_errors += 1
+
+
+async def send_ws(ws, payload: Dict[str, Any], stats: Stats) -> None:
+    try:
+        await ws.send_json(payload)
+    except Exception:
+        stats.send_errors += 1
+
+
+def compare(current: Dict[str, Any], baseline_path: str) -> None:
+    """Print the latency/throughput deltas against a previous results file."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\n[COMPARE] vs {baseline_path}")
+    rows = [
+        ("chat p50_ms", ("latency", "chat", "p50_ms")),
+        ("chat p95_ms", ("latency", "chat", "p95_ms")),
+        ("chat p99_ms", ("latency", "chat", "p99_ms")),
+        ("signal p99_ms", ("latency", "signal", "p99_ms")),
+        ("delivered/s", ("throughput", "delivered_per_s")),
+        ("ws setup p99_ms", ("setup", "ws", "p99_ms")),
+        ("sse setup p99_ms", ("setup", "sse", "p99_ms")),
+    ]
+    for label, path in rows:
+        old, new = baseline, current
+        for p in path:
+            old = old.get(p) if isinstance(old, dict) else None
+            new = new.get(p) if isinstance(new, dict) else None
+        if old is None or new is None:
+            continue
+        delta = (new - old) / old * 100 if old else 0.0
+        print(f"       {label:<18} {old:>12.3f} -> {new:>12.3f}  ({delta:+.1f}%)")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Load generator / latency benchmark for dummy realtime server")
+    parser.add_argument("--base", default="http://localhost:8000", help="Base HTTP URL (default: http://localhost:8000)")
+    parser.add_argument("--users", type=int, default=200, help="Chat users (default: 200)")
+    parser.add_argument("--ws-per-user", type=int, default=2, help="Chat WebSockets per user (default: 2)")
+    parser.add_argument("--sse-per-user", type=int, default=1, help="SSE streams per user (default: 1)")
+    parser.add_argument("--rooms", type=int, default=50, help="Signaling rooms (default: 50)")
+    parser.add_argument("--peers-per-room", type=int, default=2, help="Signaling peers per room (default: 2)")
+    parser.add_argument("--rate", type=float, default=500, help="Chat messages per second (default: 500)")
+    parser.add_argument("--signal-rate", type=float, default=100, help="Signaling offers per second (default: 100)")
+    parser.add_argument("--via", choices=("rest", "ws", "mix"), default="rest", help="How chat messages are sent (default: rest)")
+    parser.add_argument("--duration", type=float, default=20, help="Measurement duration in seconds (default: 20)")
+    parser.add_argument("--ramp", type=float, default=10, help="Seconds over which connections are opened (default: 10)")
+    parser.add_argument("--connect-concurrency", type=int, default=200, help="Connections opened at once (default: 200)")
+    parser.add_argument("--drain", type=float, default=3, help="Seconds to wait for in-flight deliveries (default: 3)")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Per-connection setup timeout (default: 10)")
+    parser.add_argument("--prefix", default="load-", help="Prefix for generated user/room ids (default: load-)")
+    parser.add_argument("--max-loss", type=float, default=0.01, help="Allowed fraction of undelivered frames (default: 0.01)")
+    parser.add_argument("--out", default="load_results.json", help="Results file (default: load_results.json)")
+    parser.add_argument("--compare", default=None, help="Previous results file to compare with")
+    parser.add_argument("--label", default="", help="Free-form build label stored in the results")
+    args = parser.parse_args()
+
+    stats = Stats()
+    fleet = Fleet()
+    counter = itertools.count()
+    total = args.users * (args.ws_per_user + args.sse_per_user) + args.rooms * args.peers_per_room
+    print(f"[INFO] Base: {args.base}")
+    print(f"[INFO] Clients: {total}  (users={args.users} x {args.ws_per_user} WS + {args.sse_per_user} SSE, rooms={args.rooms} x {args.peers_per_room})")
+
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        print(f"[STEP] Ramping up over {args.ramp}s ...")
+        ramp_s = await ramp_up(session, args, stats, fleet)
+        connected = sum(len(v) for v in stats.setup.values())
+        print(f"[INFO] Connected {connected}/{total} in {ramp_s:.2f}s ({stats.connect_errors} failed)")
+
+        print(f"[STEP] Driving {args.rate}/s chat + {args.signal_rate}/s signaling for {args.duration}s ...")
+        stats.measuring = True
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        await asyncio.gather(drive_chat(session, args, stats, fleet, counter), drive_signal(args, stats, fleet, counter))
+        send_s = loop.time() - t0
+        await asyncio.sleep(args.drain)
+        stats.measuring = False
+        await fleet.close()
+
+    delivered = len(stats.chat_latency) + len(stats.signal_latency)
+    expected = stats.chat_expected + stats.signal_expected
+    loss = 1 - delivered / expected if expected else 0.0
+    results = {
+        "label": args.label,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "connections": {
+            "requested": total,
+            "connected": connected,
+            "failed": stats.connect_errors,
+            "ramp_s": round(ramp_s, 3),
+        },
+        "setup": {kind: percentiles(xs) for kind, xs in stats.setup.items()},
+        "latency": {"chat": percentiles(stats.chat_latency), "signal": percentiles(stats.signal_latency)},
+        "throughput": {
+            "chat_sent_per_s": round(stats.chat_sent / send_s, 1) if send_s else 0,
+            "signal_sent_per_s": round(stats.signal_sent / send_s, 1) if send_s else 0,
+            "delivered_per_s": round(delivered / send_s, 1) if send_s else 0,
+        },
+        "delivery": {
+            "expected": expected,
+            "delivered": delivered,
+            "loss": round(loss, 5),
+            "send_errors": stats.send_errors,
+            "client_errors": len(stats.client_errors),
+        },
+    }
+
+    print("[RESULT] latency chat  :", json.dumps(results["latency"]["chat"]))
+    print("[RESULT] latency signal:", json.dumps(results["latency"]["signal"]))
+    print("[RESULT] setup         :", json.dumps(results["setup"]))
+    print("[RESULT] throughput    :", json.dumps(results["throughput"]))
+    print("[RESULT] delivery      :", json.dumps(results["delivery"]))
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"[INFO] Results written to {args.out}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+    ok = stats.connect_errors == 0 and loss <= args.max_loss
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n[ABORTED] KeyboardInterrupt")
+        sys.exit(1)
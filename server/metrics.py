@@ -0,0 +1,182 @@
+"""
+metrics.py — Minimal Prometheus-style metrics for the realtime server.
+
+No dependency on prometheus_client: counters and histograms are plain
+Python numbers updated inline (an increment or a bisect plus two adds), so
+they are cheap enough for the broadcast hot path. Gauges are callbacks that
+are only evaluated when /metrics is scraped; so are callback counters, for
+totals another module already keeps (exposed as counters, not gauges, since
+they only ever increase).
+
+A disabled Registry hands out no-op metrics with the same interface, so
+call sites never need to check whether metrics are on.
+"""
+from __future__ import annotations
+
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Seconds; spans sub-microsecond encodes up to slow multi-second fan-outs
+LATENCY_BUCKETS = (
+    1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+    1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        return type(self)(self.name, self.help)
+
+    def _series(self) -> Iterable[Tuple[Tuple[str, ...], "_Metric"]]:
+        if self.labelnames:
+            return self._children.items()
+        return [((), self)]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, m in self._series():
+            lines.extend(m._samples(self.name, self.labelnames, values))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def _samples(self, name, names, values) -> List[str]:
+        return [f"{name}{_fmt_labels(names, values)} {_fmt_num(self.value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def _new_child(self):
+        return Histogram(self.name, self.help, buckets=self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def _samples(self, name, names, values) -> List[str]:
+        out = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += n
+            le = f'le="{_fmt_num(bound)}"'
+            out.append(f"{name}_bucket{_fmt_labels(names, values, le)} {cumulative}")
+        out.append(f"{name}_sum{_fmt_labels(names, values)} {_fmt_num(self.sum)}")
+        out.append(f"{name}_count{_fmt_labels(names, values)} {self.count}")
+        return out
+
+
+class Gauge(_Metric):
+    # Value is computed by a callback at scrape time: {label values: value}
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str], collect: Callable[[], Dict[Tuple[str, ...], float]]) -> None:
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, v in self.collect().items():
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, values)} {_fmt_num(v)}")
+        return lines
+
+
+class CallbackCounter(Gauge):
+    # A monotonic total read by a callback at scrape time
+    kind = "counter"
+
+
+class _Noop:
+    # Stand-in for every metric type when metrics are disabled
+    def labels(self, *values: str) -> "_Noop":
+        return self
+
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+    def observe(self, value: float) -> None:
+        pass
+
+
+NOOP = _Noop()
+
+
+class Registry:
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self._metrics: List[_Metric] = []
+
+    def _add(self, metric):
+        if not self.enabled:
+            return NOOP
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str], collect: Callable[[], Dict[Tuple[str, ...], float]]):
+        return self._add(Gauge(name, help, labelnames, collect))
+
+    def counter_callback(self, name: str, help: str, labelnames: Sequence[str], collect: Callable[[], Dict[Tuple[str, ...], float]]):
+        return self._add(CallbackCounter(name, help, labelnames, collect))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,163 @@
+"""
+outbound.py — Bounded per-connection outbound queue with overflow policies.
+
+Every realtime connection owns one Outbox. Broadcasters only ever `put()`
+(never await the network), and a single consumer per connection drains it:
+a writer task for WebSockets, the response generator for SSE.
+
+Overflow policies (what happens when a put finds the queue full):
+  - drop-oldest : discard the oldest queued frame to make room
+  - coalesce    : a frame with a coalescing key replaces the queued frame
+                  with the same key (latest state wins, at any depth);
+                  otherwise behaves like drop-oldest. The caller decides
+                  which frames are state rather than events and keys them
+                  (the server keys keepalives and signaling presence)
+  - disconnect  : close the outbox; the consumer sees None and the
+                  connection is torn down
+
+Micro-batching: after `get()` a consumer may call `collect()` to merge a
+burst into one write. A frame that arrives alone is returned on its own
+straight away; only when more frames are already queued does it keep
+gathering, for at most `window` seconds or `max_bytes`.
+
+`Outbox.queued` is the number of frames waiting in all outboxes of the
+process, kept up to date on every put/pop so the load shedder can read the
+total backlog without walking the connections.
+"""
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+POLICIES = ("drop-oldest", "coalesce", "disconnect")
+
+
+class Outbox:
+    __slots__ = (
+        "maxsize", "policy", "_q", "_keys", "_ready", "closed", "overflowed",
+        "sent", "dropped", "coalesced", "high_water",
+    )
+
+    queued = 0  # frames queued across every outbox
+
+    def __init__(self, maxsize: int = 256, policy: str = "drop-oldest") -> None:
+        if policy not in POLICIES:
+            raise ValueError(f"unknown overflow policy {policy!r} (expected one of {', '.join(POLICIES)})")
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self.policy = policy
+        self._q: Deque[List[Any]] = deque()      # entries are [key, frame]
+        self._keys: Dict[str, List[Any]] = {}    # coalescing key -> queued entry
+        self._ready = asyncio.Event()
+        self.closed = False
+        self.overflowed = False
+
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.high_water = 0
+
+    def __len__(self) -> int:
+        return len(self._q)
+
+    def put(self, frame: Any, key: Optional[str] = None) -> bool:
+        """Queue a frame; returns False if the outbox is (now) closed."""
+        if self.closed:
+            return False
+
+        if key is not None and self.policy == "coalesce":
+            entry = self._keys.get(key)
+            if entry is not None:
+                entry[1] = frame
+                self.coalesced += 1
+                return True
+
+        if len(self._q) >= self.maxsize:
+            if self.policy == "disconnect":
+                self.overflowed = True
+                self.close()
+                return False
+            old = self._q.popleft()
+            if old[0] is not None and self._keys.get(old[0]) is old:
+                del self._keys[old[0]]
+            self.dropped += 1
+            Outbox.queued -= 1
+
+        entry = [key, frame]
+        self._q.append(entry)
+        Outbox.queued += 1
+        if key is not None and self.policy == "coalesce":
+            self._keys[key] = entry
+        if len(self._q) > self.high_water:
+            self.high_water = len(self._q)
+        self._ready.set()
+        return True
+
+    async def get(self) -> Optional[Any]:
+        """Next frame in order, or None once the outbox is closed."""
+        while not self._q:
+            if self.closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        if self.closed:
+            return None
+        return self._pop()
+
+    async def collect(self, first: Any, window: float, max_bytes: int) -> List[Any]:
+        """
+        `first` (just returned by get()) plus whatever belongs to the same
+        burst: nothing if the queue is empty, else queued and newly arriving
+        frames until `window` seconds pass or `max_bytes` are gathered.
+        """
+        frames = [first]
+        if not self._q or window <= 0:
+            return frames
+        size = len(first)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + window
+        while size < max_bytes and not self.closed:
+            if not self._q:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._ready.clear()
+                try:
+                    await asyncio.wait_for(self._ready.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                continue
+            frame = self._pop()
+            frames.append(frame)
+            size += len(frame)
+        return frames
+
+    def _pop(self) -> Any:
+        entry = self._q.popleft()
+        key, frame = entry
+        if key is not None and self._keys.get(key) is entry:
+            del self._keys[key]
+        self.sent += 1
+        Outbox.queued -= 1
+        return frame
+
+    def close(self) -> None:
+        self.closed = True
+        Outbox.queued -= len(self._q)
+        self._q.clear()
+        self._keys.clear()
+        self._ready.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": len(self._q),
+            "capacity": self.maxsize,
+            "policy": self.policy,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "high_water": self.high_water,
+            "overflowed": self.overflowed,
+        }
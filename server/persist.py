@@ -0,0 +1,329 @@
+"""
+persist.py — Durable append-only message log with group commit.
+
+Layout: a directory of numbered segment files (`0000000000.log`, ...), each
+holding one JSON record per line: {"u": user_id, "m": message}. Only the
+active (highest) segment is appended to; when it exceeds `segment_bytes` a
+new one is started.
+
+Writes: `append()` buffers the encoded record and returns a future. A single
+writer task drains everything buffered so far, writes it with one write()
+and one fsync() in a worker thread, then resolves all the futures of that
+batch. While one batch is being synced the next one accumulates, so under
+load many requests share each fsync (group commit).
+
+Replay: segments are memory-mapped and scanned line by line, yielding
+records in write order. A torn record at the tail of the last segment (crash
+mid-write) is truncated away.
+
+One process owns a directory: replay() and start() take an exclusive lock
+on its LOCK file (held until close()), so a second writer, e.g. another
+uvicorn worker pointed at the same MESSAGE_LOG_DIR, fails with
+LogLockedError instead of interleaving appends, rolling segments on its
+own or truncating the other's in-progress tail on replay.
+
+Compaction: given a `live(user_id, message)` predicate (is the record still
+within the store's retention?), the sealed segments are rewritten into one,
+keeping only live records, on start and after every roll to a new segment.
+So disk use and replay time follow retained history plus at most a couple
+of segments, not every message ever written. The rewrite runs in a worker
+thread next to the writer (it never touches the active segment) and lands
+atomically under the name of the last sealed segment; its first line is a
+marker {"c": first} naming the oldest segment it replaces, so a crash
+before the replaced segments are deleted is finished off by the next
+replay instead of replaying records twice.
+"""
+from __future__ import annotations
+
+import asyncio
+import mmap
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, single-writer is on the operator
+    fcntl = None
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from codec import dumps, loads
+
+SEGMENT_SUFFIX = ".log"
+COMPACT_SUFFIX = ".compact"
+
+LOCK_NAME = "LOCK"
+
+Live = Callable[[str, Dict[str, Any]], bool]  # (user_id, message) -> keep?
+
+
+class LogLockedError(RuntimeError):
+    """Another process is already using the log directory."""
+
+
+class MessageLog:
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 64 * 1024 * 1024,
+        fsync: bool = True,
+        live: Optional[Live] = None,
+    ) -> None:
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.live = live  # None disables compaction
+
+        self._fh = None
+        self._lock_fh = None
+        self._segment = 0
+        self._size = 0
+
+        self._buf: List[bytes] = []
+        self._futs: List[asyncio.Future] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._compactor: Optional[asyncio.Task] = None
+        self._compact_due = False
+        self.compactions = 0
+        self.compacted_bytes = 0  # bytes reclaimed by compaction
+
+        os.makedirs(directory, exist_ok=True)
+
+    # ---------------------- ownership ----------------------
+
+    def _lock(self) -> None:
+        if self._lock_fh is not None:
+            return
+        fh = open(os.path.join(self.directory, LOCK_NAME), "a+b")
+        if fcntl is not None:
+            try:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                fh.close()
+                raise LogLockedError(f"message log {self.directory} is in use by another process")
+        self._lock_fh = fh
+
+    def _unlock(self) -> None:
+        if self._lock_fh is not None:
+            self._lock_fh.close()  # releases the flock
+            self._lock_fh = None
+
+    # ---------------------- segments ----------------------
+
+    def _segments(self) -> List[int]:
+        out = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SEGMENT_SUFFIX):
+                stem = name[: -len(SEGMENT_SUFFIX)]
+                if stem.isdigit():
+                    out.append(int(stem))
+        return sorted(out)
+
+    def _path(self, index: int) -> str:
+        return os.path.join(self.directory, f"{index:010d}{SEGMENT_SUFFIX}")
+
+    def _open_segment(self, index: int) -> None:
+        if self._fh is not None:
+            self._fh.close()
+        self._segment = index
+        self._fh = open(self._path(index), "ab")
+        self._size = self._fh.tell()
+
+    def _recover(self) -> List[int]:
+        # Finish an interrupted compaction: drop the half-written output and
+        # the segments a completed one replaced
+        for name in os.listdir(self.directory):
+            if name.endswith(COMPACT_SUFFIX):
+                os.remove(os.path.join(self.directory, name))
+        segments = self._segments()
+        for index in reversed(segments):
+            first = self._compacted_from(index)
+            if first is not None:
+                for stale in [i for i in segments if first <= i < index]:
+                    os.remove(self._path(stale))
+                break
+        return self._segments()
+
+    def _compacted_from(self, index: int) -> Optional[int]:
+        with open(self._path(index), "rb") as f:
+            line = f.readline()
+        if not line.startswith(b'{"c":'):
+            return None
+        return loads(line)["c"]
+
+    # ---------------------- replay ----------------------
+
+    def replay(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Yield (user_id, message) for every record on disk, oldest first."""
+        self._lock()
+        segments = self._recover()
+        for i, index in enumerate(segments):
+            path = self._path(index)
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    continue
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    pos, end = 0, len(mm)
+                    while pos < end:
+                        nl = mm.find(b"\n", pos)
+                        line = mm[pos:end] if nl == -1 else mm[pos:nl]
+                        try:
+                            if nl == -1:
+                                raise ValueError("unterminated record")
+                            rec = loads(line)
+                        except ValueError:
+                            if i != len(segments) - 1:
+                                raise
+                            break  # torn tail, truncated below
+                        pos = nl + 1
+                        if "c" not in rec:
+                            yield rec["u"], rec["m"]
+            if i == len(segments) - 1 and pos < end:
+                os.truncate(path, pos)
+
+    # ---------------------- writer ----------------------
+
+    async def start(self) -> None:
+        self._lock()
+        segments = self._segments()
+        self._open_segment(segments[-1] if segments else 0)
+        self._wake = asyncio.Event()
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+        self._compact_due = True
+        self._maybe_compact()
+
+    def append(self, user_id: str, msg: Dict[str, Any]) -> asyncio.Future:
+        """Queue a record; the returned future resolves once it is durable."""
+        fut = asyncio.get_running_loop().create_future()
+        rec = dumps({"u": user_id, "m": msg})
+        self._buf.append(rec.encode("utf-8") + b"\n")
+        self._futs.append(fut)
+        self._wake.set()
+        return fut
+
+    def append_many(self, records: Iterable[Tuple[str, Dict[str, Any]]]) -> asyncio.Future:
+        """Queue (user_id, msg) records as one write; one future for all of them."""
+        fut = asyncio.get_running_loop().create_future()
+        data = "".join(dumps({"u": u, "m": m}) + "\n" for u, m in records)
+        self._buf.append(data.encode("utf-8"))
+        self._futs.append(fut)
+        self._wake.set()
+        return fut
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            batch, futs = self._buf, self._futs
+            self._buf, self._futs = [], []
+            if batch:
+                try:
+                    await loop.run_in_executor(None, self._write, b"".join(batch))
+                    self._maybe_compact()
+                except Exception as e:
+                    for f in futs:
+                        if not f.done():
+                            f.set_exception(e)
+                else:
+                    for f in futs:
+                        if not f.done():
+                            f.set_result(None)
+            if self._closing and not self._buf:
+                break
+
+    def _write(self, data: bytes) -> None:
+        if self._size and self._size + len(data) > self.segment_bytes:
+            self._open_segment(self._segment + 1)
+            self._compact_due = True
+        self._fh.write(data)
+        self._fh.flush()
+        if self.fsync:
+            os.fsync(self._fh.fileno())
+        self._size += len(data)
+
+    # ---------------------- compaction ----------------------
+
+    def _maybe_compact(self) -> None:
+        # One compaction at a time; a roll while one runs is picked up after
+        if not self._compact_due or self.live is None or self._compactor is not None:
+            return
+        self._compact_due = False
+        sealed = [index for index in self._segments() if index < self._segment]
+        if not sealed:
+            return
+        self._compactor = asyncio.create_task(self._compact_task(sealed))
+
+    async def _compact_task(self, sealed: List[int]) -> None:
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.compact, sealed)
+        except Exception:
+            pass  # the segments stay as they were; retried after the next roll
+        finally:
+            self._compactor = None
+        self._maybe_compact()
+
+    def compact(self, sealed: List[int]) -> int:
+        """
+        Rewrite the sealed segments `sealed` (oldest first, all below the
+        active one) into one holding only their live records. Returns the
+        bytes reclaimed. Runs in a worker thread; `live` is called from it.
+        """
+        last = sealed[-1]
+        before = 0
+        tmp = os.path.join(self.directory, f"{last:010d}{COMPACT_SUFFIX}")
+        with open(tmp, "wb") as out:
+            out.write(dumps({"c": sealed[0]}).encode("utf-8") + b"\n")
+            for index in sealed:
+                with open(self._path(index), "rb") as f:
+                    for line in f:
+                        before += len(line)
+                        if not line.endswith(b"\n"):
+                            line += b"\n"
+                        rec = loads(line)
+                        if "c" not in rec and self.live(rec["u"], rec["m"]):
+                            out.write(line)
+            out.flush()
+            os.fsync(out.fileno())
+            after = out.tell()
+        os.replace(tmp, self._path(last))
+        self._sync_dir()
+        for index in sealed[:-1]:
+            os.remove(self._path(index))
+        self.compactions += 1
+        self.compacted_bytes += max(0, before - after)
+        return max(0, before - after)
+
+    def _sync_dir(self) -> None:
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    async def close(self) -> None:
+        await self._stop()
+        self._unlock()
+
+    async def _stop(self) -> None:
+        # Flush and stop writing, keeping the directory locked
+        if self._compactor is not None:
+            await asyncio.gather(self._compactor, return_exceptions=True)
+        if self._task is not None:
+            self._closing = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    async def reset(self) -> None:
+        """Drop every record (used by the dev reset endpoint)."""
+        running = self._task is not None
+        await self._stop()
+        for index in self._segments():
+            os.remove(self._path(index))
+        if running:
+            await self.start()
@@ -0,0 +1,192 @@
+"""
+profiling.py — Event-loop lag monitor, slow-callback capture and a
+sampling profiler for the running server.
+
+LoopMonitor: a heartbeat on the event loop every `interval` seconds
+measures how late it fires (loop lag; reported through `on_lag`). A
+watchdog thread watches the heartbeat. Once it is overdue by half of
+`slow_threshold`, some callback is blocking the loop, and the watchdog
+grabs the loop thread's stack *while it is still blocked*, so a report
+shows the code that was running and not just that something was slow.
+When the loop recovers, the heartbeat measures the stall. If it reached
+the threshold, the stall (length + stack) goes into a bounded list of
+recent events and is logged. Keep `interval` well below the threshold:
+a callback can only be measured from the heartbeat it delays.
+
+sample_stacks(): samples the loop thread's Python stack every `interval`
+seconds from a separate thread and counts identical stacks. With
+render_collapsed() the output is the "collapsed stack" text format
+(`frame;frame;frame count` per line) that flamegraph.pl, speedscope and
+similar tools read. Samples taken while the loop waits for I/O are
+labelled `[idle]`: with the pure-Python loop they end in the selector, with
+uvloop (C code, no Python frames of its own) the innermost Python frame is
+the runner that started the loop.
+
+Both read other threads' frames through sys._current_frames(). The
+sampler needs the GIL to take a sample, so time spent in C code that holds
+it (a large JSON encode) is attributed to the Python frame that called it.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from datetime import datetime, timezone
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+log = logging.getLogger("realtime.profiling")
+
+IDLE_FRAME = "[idle]"
+
+# Innermost frame of a waiting loop thread under uvloop: whatever called into
+# the C loop, i.e. asyncio's runner (asyncio.run / Runner) or uvloop.run
+_RUNNER_FILE = os.path.join(os.path.dirname(asyncio.__file__), "runners.py")
+
+
+class LoopMonitor:
+    def __init__(
+        self,
+        interval: float = 0.025,
+        slow_threshold: float = 0.1,
+        keep: int = 50,
+        on_lag: Optional[Callable[[float], None]] = None,
+    ) -> None:
+        self.interval = interval
+        self.slow_threshold = slow_threshold  # seconds; 0 disables slow-callback capture
+        self.on_lag = on_lag
+        self.slow: Deque[Dict[str, Any]] = deque(maxlen=keep)  # most recent stalls
+        self.slow_total = 0
+        self.max_lag = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._due = 0.0
+        self._thread_id = 0
+        self._beat = 0.0        # time.monotonic() of the last heartbeat (read by the watchdog)
+        self._stack: Optional[Tuple[float, List[str]]] = None  # (heartbeat it is overdue from, stack) from the watchdog
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._due = self._loop.time() + self.interval
+        self._handle = self._loop.call_at(self._due, self._heartbeat)
+        if self.slow_threshold:
+            self._stop.clear()
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+
+    def close(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._watchdog is not None:
+            self._stop.set()
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    def _heartbeat(self) -> None:
+        now = self._loop.time()
+        lag = max(0.0, now - self._due)
+        captured, self._stack = self._stack, None
+        # Only a stack taken during this stall counts, not a late one from the previous
+        stack = captured[1] if captured is not None and captured[0] == self._beat else None
+        self._beat = time.monotonic()
+        if lag > self.max_lag:
+            self.max_lag = lag
+        if self.on_lag is not None:
+            self.on_lag(lag)
+        if self.slow_threshold and lag >= self.slow_threshold:
+            self.slow_total += 1
+            self.slow.append({
+                "at": datetime.now(timezone.utc).isoformat(),
+                "blocked_ms": round(lag * 1000, 1),
+                "stack": stack,  # None if the stall ended before the watchdog looked
+            })
+            log.warning(
+                "event loop blocked for %.0f ms%s", lag * 1000,
+                ":\n" + "\n".join(stack) if stack else "",
+            )
+        self._due = now + self.interval
+        self._handle = self._loop.call_at(self._due, self._heartbeat)
+
+    def _watch(self) -> None:
+        # Runs in its own thread. An overdue heartbeat means the loop thread
+        # is stuck in one callback right now.
+        check = max(0.005, self.slow_threshold / 4)
+        captured_for = None
+        while not self._stop.wait(check):
+            beat = self._beat
+            if beat == captured_for or time.monotonic() - beat < self.interval + self.slow_threshold / 2:
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self._stack = (beat, [
+                    f"{os.path.basename(fs.filename)}:{fs.lineno} in {fs.name}" + (f": {fs.line}" if fs.line else "")
+                    for fs in traceback.extract_stack(frame)
+                ])
+            del frame
+            captured_for = beat
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval_ms": self.interval * 1000,
+            "slow_threshold_ms": self.slow_threshold * 1000,
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "slow_total": self.slow_total,
+            "slow": list(self.slow),
+        }
+
+
+def _idle_leaf(code) -> bool:
+    # Is a stack ending in this frame the loop waiting for work?
+    filename = code.co_filename
+    if os.path.basename(filename) == "selectors.py" or filename == _RUNNER_FILE:
+        return True
+    return code.co_name == "run" and os.path.basename(os.path.dirname(filename)) == "uvloop"
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(thread_id: int, seconds: float, interval: float, idle: bool = True) -> Counter:
+    """
+    Sample `thread_id`'s stack every `interval` seconds for `seconds`
+    (blocking; run it in a thread). Returns collapsed stack -> samples.
+    """
+    counts: Counter = Counter()
+    labels: Dict[Any, str] = {}  # code object -> label, formatted once
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is None:
+            break
+        parts: List[str] = []
+        leaf = frame.f_code
+        while frame is not None:
+            code = frame.f_code
+            label = labels.get(code)
+            if label is None:
+                label = labels[code] = _frame_label(code)
+            parts.append(label)
+            frame = frame.f_back
+        parts.reverse()
+        if _idle_leaf(leaf):
+            if not idle:
+                time.sleep(interval)
+                continue
+            parts.append(IDLE_FRAME)
+        counts[";".join(parts)] += 1
+        time.sleep(interval)
+    return counts
+
+
+def render_collapsed(counts: Counter) -> str:
+    return "".join(f"{stack} {n}\n" for stack, n in counts.most_common())
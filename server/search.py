@@ -0,0 +1,246 @@
+"""
+search.py — Incremental in-memory full-text index over users' chat history.
+
+Each user has an inverted index kept in step with their history ring:
+messages are added as they are stored and removed when they fall out of
+retention, so the index never holds more than the store does.
+
+  - postings: term -> [dead, seqs]. seqs is ascending (messages only ever
+    arrive with a larger seq) and retention evicts the oldest first, so an
+    evicted message is always at the front of each of its lists. Evictions
+    just count `dead` and the dead prefix is cut off once it is half the
+    list (amortized O(1) per term).
+  - docs: seq -> the message's token tuple, used to verify candidates
+    (phrases, extra terms) and to score them without storing positions.
+  - prefixes: first PREFIX_KEY_LEN characters -> terms, for `foo*` queries.
+
+Queries are whitespace-separated clauses that must all match:
+  word       the token `word`
+  wor*       any token starting with `wor` (at least PREFIX_KEY_LEN chars)
+  "a b c"    the tokens a b c consecutively
+Candidates come from the most selective clause, the rest are checked
+against the candidate's tokens. Results are ranked by BM25 (newest first
+on ties). To bound latency only the newest MAX_CANDIDATES candidates are
+examined; the result then says it was truncated.
+"""
+from __future__ import annotations
+
+import heapq
+import math
+import re
+import sys
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+TOKEN_RE = re.compile(r"\w+")
+QUERY_RE = re.compile(r'"([^"]*)"|(\S+)')
+PREFIX_KEY_LEN = 2
+MAX_PREFIX_TERMS = 256  # terms a prefix clause draws candidates from (most frequent first)
+MAX_CANDIDATES = 10_000
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    return [sys.intern(t) for t in TOKEN_RE.findall(text.lower())]
+
+
+def parse_query(q: str) -> List[Tuple[str, Any]]:
+    """Clauses ("term", t) / ("prefix", p) / ("phrase", [t, ...])."""
+    clauses: List[Tuple[str, Any]] = []
+    for phrase, word in QUERY_RE.findall(q):
+        if phrase:
+            terms = tokenize(phrase)
+            if len(terms) == 1:
+                clauses.append(("term", terms[0]))
+            elif terms:
+                clauses.append(("phrase", terms))
+            continue
+        if word.endswith("*"):
+            terms = tokenize(word[:-1])
+            if len(terms) == 1 and len(terms[0]) >= PREFIX_KEY_LEN:
+                clauses.append(("prefix", terms[0]))
+                continue
+        terms = tokenize(word)
+        if len(terms) == 1:
+            clauses.append(("term", terms[0]))
+        elif terms:
+            clauses.append(("phrase", terms))  # e.g. "e-mail" -> e mail
+    return clauses
+
+
+def _contains_phrase(tokens: Tuple[str, ...], terms: List[str]) -> bool:
+    n = len(terms)
+    first = terms[0]
+    for i in range(len(tokens) - n + 1):
+        if tokens[i] == first and list(tokens[i:i + n]) == terms:
+            return True
+    return False
+
+
+class UserIndex:
+    __slots__ = ("postings", "docs", "prefixes", "total_len")
+
+    def __init__(self) -> None:
+        self.postings: Dict[str, List[Any]] = {}
+        self.docs: Dict[int, Tuple[str, ...]] = {}
+        self.prefixes: Dict[str, Set[str]] = {}
+        self.total_len = 0
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def add(self, seq: int, text: str) -> None:
+        tokens = tuple(tokenize(text))
+        if not tokens:
+            return
+        self.docs[seq] = tokens
+        self.total_len += len(tokens)
+        for term in set(tokens):
+            entry = self.postings.get(term)
+            if entry is None:
+                entry = self.postings[term] = [0, []]
+                self.prefixes.setdefault(term[:PREFIX_KEY_LEN], set()).add(term)
+            entry[1].append(seq)
+
+    def remove_oldest(self, seq: int) -> None:
+        # seq is being evicted from retention, so it is the oldest indexed
+        tokens = self.docs.pop(seq, None)
+        if tokens is None:
+            return
+        self.total_len -= len(tokens)
+        for term in set(tokens):
+            entry = self.postings[term]
+            entry[0] += 1
+            dead, seqs = entry
+            if dead == len(seqs):
+                del self.postings[term]
+                bucket = self.prefixes[term[:PREFIX_KEY_LEN]]
+                bucket.discard(term)
+                if not bucket:
+                    del self.prefixes[term[:PREFIX_KEY_LEN]]
+            elif dead >= 32 and dead * 2 >= len(seqs):
+                del seqs[:dead]
+                entry[0] = 0
+
+    def _live(self, term: str) -> List[int]:
+        entry = self.postings.get(term)
+        if entry is None:
+            return []
+        dead, seqs = entry
+        return seqs[dead:] if dead else seqs
+
+    def _df(self, term: str) -> int:
+        entry = self.postings.get(term)
+        return len(entry[1]) - entry[0] if entry is not None else 0
+
+    def _expand(self, prefix: str) -> List[str]:
+        bucket = self.prefixes.get(prefix[:PREFIX_KEY_LEN], ())
+        terms = [t for t in bucket if t.startswith(prefix)]
+        if len(terms) > MAX_PREFIX_TERMS:
+            terms = heapq.nlargest(MAX_PREFIX_TERMS, terms, key=self._df)
+        return terms
+
+    def search(self, clauses: List[Tuple[str, Any]], limit: int, offset: int = 0) -> Tuple[List[Tuple[float, int]], int, bool]:
+        """Ranked (score, seq) for one page, the number of matches and whether
+        only the newest MAX_CANDIDATES candidates were looked at."""
+        if not clauses or not self.docs:
+            return [], 0, False
+
+        # Candidates come from the clause with the fewest of them
+        best: Optional[Tuple[int, Any]] = None
+        for kind, value in clauses:
+            if kind == "term":
+                size, source = self._df(value), [value]
+            elif kind == "phrase":
+                rarest = min(value, key=self._df)
+                size, source = self._df(rarest), [rarest]
+            else:
+                terms = self._expand(value)
+                size, source = sum(self._df(t) for t in terms), terms
+            if size == 0:
+                return [], 0, False
+            if best is None or size < best[0]:
+                best = (size, source)
+
+        source = best[1]
+        if len(source) == 1:
+            candidates = self._live(source[0])
+        else:
+            merged: Set[int] = set()
+            for term in source:
+                merged.update(self._live(term))
+            candidates = sorted(merged)
+        truncated = len(candidates) > MAX_CANDIDATES
+        if truncated:
+            candidates = candidates[-MAX_CANDIDATES:]
+
+        # Verify every clause on the candidate's tokens and score it (BM25)
+        n_docs = len(self.docs)
+        avg_len = self.total_len / n_docs
+        idf: Dict[str, float] = {}
+
+        def weight(term: str) -> float:
+            w = idf.get(term)
+            if w is None:
+                df = self._df(term)
+                w = idf[term] = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            return w
+
+        scored: List[Tuple[float, int]] = []
+        docs = self.docs
+        for seq in candidates:
+            tokens = docs[seq]
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * len(tokens) / avg_len)
+            score = 0.0
+            for kind, value in clauses:
+                if kind == "term":
+                    matched = [value] if value in tokens else None
+                elif kind == "phrase":
+                    matched = value if _contains_phrase(tokens, value) else None
+                else:
+                    matched = [t for t in set(tokens) if t.startswith(value)]
+                if not matched:
+                    break
+                for term in matched:
+                    tf = tokens.count(term)
+                    score += weight(term) * tf * (BM25_K1 + 1) / (tf + norm)
+            else:
+                scored.append((score, seq))
+
+        page = heapq.nlargest(offset + limit, scored)[offset:]
+        return page, len(scored), truncated
+
+
+class SearchIndex:
+    """Per-user indexes; fed by MessageStore on append, eviction and clear."""
+
+    def __init__(self) -> None:
+        self._users: Dict[str, UserIndex] = {}
+
+    def __len__(self) -> int:
+        return sum(len(ix) for ix in self._users.values())
+
+    def add(self, user_id: str, seq: int, msg: Dict[str, Any]) -> None:
+        text = msg.get("text")
+        if not isinstance(text, str) or not text:
+            return
+        ix = self._users.get(user_id)
+        if ix is None:
+            ix = self._users[user_id] = UserIndex()
+        ix.add(seq, text)
+
+    def evict(self, user_id: str, seq: int) -> None:
+        ix = self._users.get(user_id)
+        if ix is not None:
+            ix.remove_oldest(seq)
+            if not ix.docs:
+                del self._users[user_id]
+
+    def search(self, user_id: str, query: str, limit: int, offset: int = 0) -> Tuple[List[Tuple[float, int]], int, bool]:
+        ix = self._users.get(user_id)
+        if ix is None:
+            return [], 0, False
+        return ix.search(parse_query(query), limit, offset)
+
+    def clear(self) -> None:
+        self._users.clear()
@@ -1,15 +1,172 @@
 from __future__ import annotations
 
 import asyncio
-import json
+import itertools
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
 import uuid
-from collections import defaultdict
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Set
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, Response
+
+import metrics
+from admission import LoadShedder, RateLimiter
+from assistant import Backend, StubBackend, load_backend
+from backplane import Backplane, UnixSocketBackplane
+from cache import ResponseCache
+from channels import ChannelIndex, valid_name
+from codec import JSON, Codec, DecodeError, Frame, dumps, loads, negotiate
+from compression import ENCODINGS, DeflateStats, compress, configure_ws_deflate, negotiate_encoding
+from outbound import POLICIES, Outbox
+from persist import MessageLog
+from profiling import LoopMonitor, render_collapsed, sample_stacks
+from search import SearchIndex
+from store import MessageStore
+from timers import Timer, TimerWheel
+
+# -----------------------------------------------------------------------------
+# Configuration (environment variables)
+# -----------------------------------------------------------------------------
+
+MESSAGE_RETENTION = int(os.environ.get("MESSAGE_RETENTION", "1000"))  # messages kept per user
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", "200"))   # default page size
+HISTORY_MAX_PAGE_SIZE = int(os.environ.get("HISTORY_MAX_PAGE_SIZE", "1000"))
+SEARCH_ENABLED = os.environ.get("SEARCH_ENABLED", "1") != "0"     # full-text index behind /api/search
+SEARCH_PAGE_SIZE = int(os.environ.get("SEARCH_PAGE_SIZE", "20"))
+SEARCH_MAX_PAGE_SIZE = int(os.environ.get("SEARCH_MAX_PAGE_SIZE", "100"))
+HISTORY_CACHE_MB = float(os.environ.get("HISTORY_CACHE_MB", "64"))  # serialized history pages kept (LRU); 0 disables
+
+# Compression. History pages of at least HTTP_COMPRESS_MIN_BYTES go out
+# gzip/brotli-encoded to clients that accept it; the encoded page is cached
+# with the plain one, so the level only costs CPU once per page version.
+HTTP_COMPRESS_MIN_BYTES = int(os.environ.get("HTTP_COMPRESS_MIN_BYTES", "1024"))  # 0 disables
+HTTP_COMPRESS_LEVELS = {
+    "gzip": int(os.environ.get("HTTP_GZIP_LEVEL", "5")),      # 1-9
+    "br": int(os.environ.get("HTTP_BROTLI_QUALITY", "4")),    # 0-11, needs the brotli package
+}
+# permessage-deflate for /ws and /signal, used when the server runs with
+# `--ws compression:DeflateWebSocketProtocol` (see compression.py). Every
+# socket compresses its own frames, so the defaults favour CPU over ratio.
+WS_DEFLATE = os.environ.get("WS_DEFLATE", "1") != "0"
+configure_ws_deflate(
+    enabled=WS_DEFLATE,
+    level=int(os.environ.get("WS_DEFLATE_LEVEL", "1")),
+    mem_level=int(os.environ.get("WS_DEFLATE_MEM_LEVEL", "5")),
+    window_bits=int(os.environ.get("WS_DEFLATE_WINDOW_BITS", "12")),               # 9-15
+    context_takeover=os.environ.get("WS_DEFLATE_CONTEXT_TAKEOVER", "1") != "0",   # ~32 KB per socket at the defaults
+    min_bytes=int(os.environ.get("WS_DEFLATE_MIN_BYTES", "128")),                 # smaller frames go out uncompressed
+)
+
+MESSAGE_LOG_DIR = os.environ.get("MESSAGE_LOG_DIR", "")                 # empty -> in-memory only
+MESSAGE_LOG_SEGMENT_MB = int(os.environ.get("MESSAGE_LOG_SEGMENT_MB", "64"))
+MESSAGE_LOG_FSYNC = os.environ.get("MESSAGE_LOG_FSYNC", "1") != "0"
+
+WS_SEND_TIMEOUT = float(os.environ.get("WS_SEND_TIMEOUT", "5"))  # seconds before a stuck socket is dropped
+# With several workers every one keeps a full copy of the history: writes
+# are replicated as they happen and a worker that (re)starts next to running
+# ones copies theirs first (at most BACKPLANE_SYNC_TIMEOUT seconds). Message
+# order may differ between workers under concurrent writes for one user, so
+# SSE event ids (per-worker seqs) are not comparable across workers and
+# Last-Event-ID resume answers "resync_required" instead of replaying.
+BACKPLANE = os.environ.get("BACKPLANE", "inproc")  # inproc | unix (for uvicorn --workers N)
+BACKPLANE_DIR = os.environ.get("BACKPLANE_DIR", os.path.join(tempfile.gettempdir(), "realtime-backplane"))
+BACKPLANE_SYNC_TIMEOUT = float(os.environ.get("BACKPLANE_SYNC_TIMEOUT", "10"))
+if BACKPLANE != "inproc" and MESSAGE_LOG_DIR:
+    # Every worker would append to (and replay, truncate and roll) the same
+    # segment files; the log supports one writer process only
+    raise ValueError("MESSAGE_LOG_DIR needs a single worker (BACKPLANE=inproc)")
+
+SSE_REPLAY_LIMIT = int(os.environ.get("SSE_REPLAY_LIMIT", "1000"))  # max missed messages replayed on resume
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+
+REGISTRY_SWEEP_INTERVAL = float(os.environ.get("REGISTRY_SWEEP_INTERVAL", "1"))  # seconds between dead-connection sweeps
+# Keepalives and idle timeouts run on one shared timer wheel (TIMER_TICK
+# resolution), so run uvicorn without its own per-connection ping tasks
+# (--ws-ping-interval 0, see compression.py). A connection quiet in both
+# directions for KEEPALIVE_INTERVAL gets an SSE comment / a WS
+# {"type": "ping"} frame, which clients may ignore: only a send that fails
+# or times out (WS_SEND_TIMEOUT) drops the peer. IDLE_TIMEOUT is an opt-in
+# stricter check: WS/signal clients that send nothing (e.g. no "pong") for
+# that long are closed.
+KEEPALIVE_INTERVAL = float(os.environ.get("KEEPALIVE_INTERVAL", "25"))  # quiet time before an SSE comment / WS {"type": "ping"}
+IDLE_TIMEOUT = float(os.environ.get("IDLE_TIMEOUT", "0"))  # close WS/signal clients silent this long; 0 = never
+TIMER_TICK = float(os.environ.get("TIMER_TICK", "0.5"))
+OUTBOX_SIZE = int(os.environ.get("OUTBOX_SIZE", "256"))          # queued frames per connection
+# Under "coalesce", frames that only carry the latest state (keepalives, a
+# signaling peer's join/leave) replace their queued predecessor instead of
+# queuing behind it. SSE streams always disconnect on overflow: a dropped
+# event would sit behind the ids of later ones, where Last-Event-ID can never
+# ask for it again, while a reconnect replays it.
+OUTBOX_POLICY = os.environ.get("OUTBOX_POLICY", "drop-oldest")   # drop-oldest | coalesce | disconnect
+if OUTBOX_POLICY not in POLICIES:
+    raise ValueError(f"OUTBOX_POLICY must be one of {', '.join(POLICIES)}")
+
+# Outbound micro-batching: a burst of frames queued for one connection is
+# written as one SSE chunk / one WS {"type": "bundle", "data": [...]} frame.
+# A lone frame is still sent immediately. 0 disables it.
+COALESCE_WINDOW_MS = float(os.environ.get("COALESCE_WINDOW_MS", "0"))   # e.g. 2-10
+COALESCE_MAX_BYTES = int(os.environ.get("COALESCE_MAX_BYTES", "65536"))  # flush a burst early at this size
+COALESCE_WINDOW = COALESCE_WINDOW_MS / 1000
+
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", "1000"))  # messages stored/broadcast per batch
+BULK_MAX_MESSAGES = int(os.environ.get("BULK_MAX_MESSAGES", "10000"))  # per JSON request or WS batch frame
+
+# Named pub/sub channels: any WS/SSE connection subscribes, POST
+# /api/channels/{name} publishes. The last CHANNEL_REPLAY frames of a channel
+# are kept so subscribers can resume from the last seq they saw.
+CHANNEL_REPLAY = int(os.environ.get("CHANNEL_REPLAY", "100"))  # 0 disables replay
+CHANNEL_REPLAY_SIZES = {  # per-channel overrides, e.g. "news=1000,typing=0"
+    name.strip(): int(size)
+    for name, _, size in (item.partition("=") for item in os.environ.get("CHANNEL_REPLAY_SIZES", "").split(",") if item.strip())
+}
+CHANNEL_IDLE_TTL = float(os.environ.get("CHANNEL_IDLE_TTL", "3600"))  # seconds an unsubscribed channel's replay is kept after its last publish
+CHANNEL_MAX_PER_CONN = int(os.environ.get("CHANNEL_MAX_PER_CONN", "100"))
+
+# Admission control. Token buckets (messages/second and burst) per user for
+# interactive chat messages (REST, WS), per user for bulk ingestion (POST
+# /api/messages, WS batch frames; a separate budget, so an import never locks
+# its user out of chat) and per signaling peer; 0 disables a limit.
+# A chat message slightly over the limit is delayed up to
+# RATE_LIMIT_MAX_DELAY_MS, beyond that it is rejected (HTTP 429 / WS
+# "throttle" frame). NDJSON uploads and signaling are never rejected by the
+# rate limit, only slowed down: the body / socket is not read meanwhile.
+RATE_LIMIT_USER = float(os.environ.get("RATE_LIMIT_USER", "20"))
+RATE_LIMIT_USER_BURST = float(os.environ.get("RATE_LIMIT_USER_BURST", "40"))
+RATE_LIMIT_BULK = float(os.environ.get("RATE_LIMIT_BULK", "1000"))
+RATE_LIMIT_BULK_BURST = float(os.environ.get("RATE_LIMIT_BULK_BURST", str(BULK_MAX_MESSAGES)))
+RATE_LIMIT_PEER = float(os.environ.get("RATE_LIMIT_PEER", "50"))  # per peer, so a room's budget grows with its size
+RATE_LIMIT_PEER_BURST = float(os.environ.get("RATE_LIMIT_PEER_BURST", "100"))
+RATE_LIMIT_MAX_DELAY = float(os.environ.get("RATE_LIMIT_MAX_DELAY_MS", "100")) / 1000
+# Overload shedding: new chat messages and searches are rejected while the
+# event loop lags or too many frames wait in outboxes; 0 disables a check
+SHED_MAX_LAG = float(os.environ.get("SHED_MAX_LAG_MS", "250")) / 1000
+SHED_MAX_QUEUED = int(os.environ.get("SHED_MAX_QUEUED", "200000"))  # frames across all connections
+SHED_RETRY_AFTER = float(os.environ.get("SHED_RETRY_AFTER", "1"))    # seconds suggested to rejected clients
+
+# Event-loop diagnostics: a heartbeat measures loop lag (the load shedder
+# above goes by the same samples); a callback that blocks the loop longer
+# than SLOW_CALLBACK_MS is logged with the stack it was blocked in (also at
+# /__dev__/profile/slow). 0 disables the capture.
+LOOP_MONITOR_INTERVAL = float(os.environ.get("LOOP_MONITOR_INTERVAL_MS", "25")) / 1000
+SLOW_CALLBACK = float(os.environ.get("SLOW_CALLBACK_MS", "100")) / 1000
+SLOW_CALLBACK_KEEP = int(os.environ.get("SLOW_CALLBACK_KEEP", "50"))  # recent stalls kept for /__dev__/profile/slow
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "60"))  # longest /__dev__/profile run
+
+# Streamed assistant replies (POST /api/chat, WS "prompt" frames)
+ASSISTANT_BACKEND = os.environ.get("ASSISTANT_BACKEND", "stub")  # stub | package.module:factory
+ASSISTANT_CONTEXT = int(os.environ.get("ASSISTANT_CONTEXT", "20"))     # history messages passed to the backend
+ASSISTANT_TIMEOUT = float(os.environ.get("ASSISTANT_TIMEOUT", "120"))  # seconds per reply before it is abandoned
+ASSISTANT_STUB_FIRST_TOKEN_MS = float(os.environ.get("ASSISTANT_STUB_FIRST_TOKEN_MS", "200"))
+ASSISTANT_STUB_TOKEN_MS = float(os.environ.get("ASSISTANT_STUB_TOKEN_MS", "20"))
 
 # -----------------------------------------------------------------------------
 # Utilities
@@ -19,77 +176,948 @@ def utc_iso() -> str:
     # Return current UTC timestamp as string
     return datetime.now(timezone.utc).isoformat()
 
+def new_ids(n: int) -> List[str]:
+    # n random (version 4) UUIDs from a single urandom() call instead of one
+    # per message
+    raw = os.urandom(16 * n)
+    return [str(uuid.UUID(bytes=raw[i:i + 16], version=4)) for i in range(0, 16 * n, 16)]
+
+log = logging.getLogger("realtime")
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match is "*" or a list of (possibly weak) entity tags
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+# -----------------------------------------------------------------------------
+# Metrics (served at /metrics). Labeled children used on hot paths are
+# resolved once here so instrumentation is an attribute add per event.
+# -----------------------------------------------------------------------------
+
+METRICS = metrics.Registry(enabled=METRICS_ENABLED)
+
+M_INGESTED = METRICS.counter("realtime_messages_ingested_total", "Messages stored in history", ("source",))
+M_INGESTED_REST = M_INGESTED.labels("rest")
+M_INGESTED_WS = M_INGESTED.labels("ws")
+
+M_BROADCASTS = METRICS.counter("realtime_broadcasts_total", "Broadcasts fanned out by this worker", ("kind",))
+M_BROADCASTS_USER = M_BROADCASTS.labels("user")
+M_BROADCASTS_ROOM = M_BROADCASTS.labels("room")
+M_BROADCASTS_CHANNEL = M_BROADCASTS.labels("channel")
+
+M_SEND_FAILURES = METRICS.counter(
+    "realtime_send_failures_total", "Connections dropped because a send failed or timed out, the outbox overflowed or the client went idle", ("kind", "reason"),
+)
+M_SIGNAL_DIRECT = METRICS.counter(
+    "realtime_signal_direct_total", "Peer-addressed signaling messages by where the target was found", ("target",),
+)
+M_SIGNAL_LOCAL = M_SIGNAL_DIRECT.labels("local")
+M_SIGNAL_REMOTE = M_SIGNAL_DIRECT.labels("remote")
+M_SIGNAL_UNKNOWN = M_SIGNAL_DIRECT.labels("unknown")
+M_HANDLER_ERRORS = METRICS.counter("realtime_handler_errors_total", "Unexpected exceptions in connection handlers", ("endpoint",))
+
+M_FANOUT = METRICS.histogram("realtime_broadcast_fanout_seconds", "Time to hand a broadcast to every local outbox and the backplane", ("kind",))
+M_FANOUT_USER = M_FANOUT.labels("user")
+M_FANOUT_ROOM = M_FANOUT.labels("room")
+M_FANOUT_CHANNEL = M_FANOUT.labels("channel")
+M_ENCODE = METRICS.histogram("realtime_json_encode_seconds", "Time to JSON-encode one broadcast payload")
+M_BATCH_SIZE = METRICS.histogram("realtime_ingest_batch_size", "Messages per bulk batch (POST /api/messages, WS batch frames)", buckets=metrics.DEPTH_BUCKETS)
+M_WRITE_FRAMES = METRICS.histogram("realtime_frames_per_write", "Frames merged into each WS frame / SSE chunk written (micro-batching)", ("kind",), buckets=metrics.DEPTH_BUCKETS)
+M_WRITE_FRAMES_WS = M_WRITE_FRAMES.labels("ws")
+M_WRITE_FRAMES_SSE = M_WRITE_FRAMES.labels("sse")
+M_HISTORY = METRICS.counter("realtime_history_requests_total", "History requests by how they were served", ("result",))
+M_HISTORY_304 = M_HISTORY.labels("not_modified")
+M_HISTORY_HIT = M_HISTORY.labels("cache_hit")
+M_HISTORY_MISS = M_HISTORY.labels("cache_miss")
+M_HISTORY_ENCODED = METRICS.counter("realtime_history_encoded_total", "History pages sent with a Content-Encoding", ("encoding",))
+M_HISTORY_ENCODED_BY = {encoding: M_HISTORY_ENCODED.labels(encoding) for encoding in ENCODINGS}
+M_SEARCH = METRICS.histogram("realtime_search_seconds", "Time to run one /api/search query")
+M_ADMISSION = METRICS.counter("realtime_admission_total", "Messages slowed down or turned away by admission control", ("result",))
+M_ADMISSION_DELAYED = M_ADMISSION.labels("delayed")
+M_ADMISSION_LIMITED = M_ADMISSION.labels("rate_limited")
+M_ADMISSION_OVERLOADED = M_ADMISSION.labels("overloaded")
+M_ASSISTANT_TTFT = METRICS.histogram("realtime_assistant_ttft_seconds", "Time from a prompt to its first streamed delta")
+M_ASSISTANT_DURATION = METRICS.histogram("realtime_assistant_reply_seconds", "Time from a prompt to the end of its reply stream")
+M_ASSISTANT_DELTAS = METRICS.counter("realtime_assistant_deltas_total", "Delta frames streamed for assistant replies")
+M_ASSISTANT_REPLIES = METRICS.counter("realtime_assistant_replies_total", "Assistant reply streams by outcome", ("result",))
+M_LOOP_LAG = METRICS.histogram("realtime_event_loop_delay_seconds", "How late the loop monitor's heartbeat ran (event-loop lag)")
+M_SLOW_CALLBACKS = METRICS.counter("realtime_slow_callbacks_total", "Times a callback blocked the event loop longer than SLOW_CALLBACK_MS")
+M_SSE_DEPTH = METRICS.histogram("realtime_sse_queue_depth", "SSE outbox depth left behind each delivered event", buckets=metrics.DEPTH_BUCKETS)
+
 # -----------------------------------------------------------------------------
 # In-memory stores
 # -----------------------------------------------------------------------------
 
-MESSAGES: Dict[str, List[Dict[str, Any]]] = defaultdict(list)  # user_id -> list of messages
+SEARCH_INDEX = SearchIndex() if SEARCH_ENABLED else None  # follows MESSAGES, including evictions
+MESSAGES = MessageStore(retention=MESSAGE_RETENTION, index=SEARCH_INDEX)  # user_id -> ring buffer of messages
+
+# Serialized /api/history responses, valid while the user's version is
+# unchanged. ETags carry a per-process id so a restarted (or another)
+# worker never confirms a page it did not serve.
+HISTORY_CACHE = ResponseCache(int(HISTORY_CACHE_MB * 1024 * 1024))
+BOOT_ID = uuid.uuid4().hex[:8]
+
+# Admission control (see admission.py)
+USER_LIMITER = RateLimiter(RATE_LIMIT_USER, RATE_LIMIT_USER_BURST) if RATE_LIMIT_USER > 0 else None
+BULK_LIMITER = RateLimiter(RATE_LIMIT_BULK, RATE_LIMIT_BULK_BURST) if RATE_LIMIT_BULK > 0 else None
+PEER_LIMITER = RateLimiter(RATE_LIMIT_PEER, RATE_LIMIT_PEER_BURST) if RATE_LIMIT_PEER > 0 else None
+SHEDDER = LoadShedder(SHED_MAX_LAG, SHED_MAX_QUEUED, lambda: Outbox.queued, LOOP_MONITOR_INTERVAL)
+
+def on_loop_lag(lag: float) -> None:
+    # The one lag sampler of the process: also drives the load shedder
+    M_LOOP_LAG.observe(lag)
+    SHEDDER.observe(lag)
+    if SLOW_CALLBACK and lag >= SLOW_CALLBACK:
+        M_SLOW_CALLBACKS.inc()
+
+LOOP_MONITOR = LoopMonitor(LOOP_MONITOR_INTERVAL, SLOW_CALLBACK, SLOW_CALLBACK_KEEP, on_lag=on_loop_lag)
+PROFILE_SLOT = asyncio.Lock()  # one /__dev__/profile run at a time
+
+# Generator behind streamed assistant replies (see assistant.py)
+ASSISTANT: Backend = (
+    StubBackend(ASSISTANT_STUB_FIRST_TOKEN_MS / 1000, ASSISTANT_STUB_TOKEN_MS / 1000)
+    if ASSISTANT_BACKEND == "stub" else load_backend(ASSISTANT_BACKEND)
+)
+
+# Optional durable backend; MESSAGES is rebuilt from it on startup. Sealed
+# segments are compacted down to the messages MESSAGES still retains (the
+# check is two dict lookups, safe from the compaction thread).
+MESSAGE_LOG = (
+    MessageLog(
+        MESSAGE_LOG_DIR, segment_bytes=MESSAGE_LOG_SEGMENT_MB * 1024 * 1024, fsync=MESSAGE_LOG_FSYNC,
+        live=lambda user_id, msg: MESSAGES.retains(user_id, msg.get("id")),
+    )
+    if MESSAGE_LOG_DIR else None
+)
+
+async def store_message(user_id: str, msg: Dict[str, Any]) -> int:
+    # Wait for the group commit (if enabled), then append to the in-memory
+    # store. Callers broadcast right after this returns, with no await in
+    # between, so a message's seq is never visible before it is broadcast
+    # (SSE event ids rely on that).
+    if MESSAGE_LOG is not None:
+        await MESSAGE_LOG.append(user_id, msg)
+    seq = MESSAGES.append(user_id, msg)
+    # Replicate to the other workers' stores (ahead of the broadcast, which
+    # travels on the same ordered stream); with no other worker there is
+    # nothing to encode
+    if hub.backplane.peers():
+        hub.backplane.publish("m", user_id, dumps(msg))
+    return seq
+
+async def store_messages(batches: Dict[str, List[Dict[str, Any]]]) -> None:
+    # Bulk form of store_message: one durable write (and fsync) for the
+    # whole batch, then one store and one backplane event per user. The same
+    # no-await rule applies: broadcast right after this returns.
+    if MESSAGE_LOG is not None:
+        await MESSAGE_LOG.append_many((user_id, m) for user_id, msgs in batches.items() for m in msgs)
+    replicate = hub.backplane.peers()
+    for user_id, msgs in batches.items():
+        MESSAGES.extend(user_id, msgs)
+        if replicate:
+            hub.backplane.publish("b", user_id, dumps(msgs))
+
+async def ingest_batch(items: List[Dict[str, Any]]) -> List[str]:
+    # Store validated REST messages ({user_id, text, role}) and broadcast one
+    # combined "batch" frame per user. Returns the new message ids in order.
+    ids = new_ids(len(items))
+    ts = utc_iso()
+    batches: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for item, msg_id in zip(items, ids):
+        batches[item["user_id"]].append({"id": msg_id, "ts": ts, **item})
+    await store_messages(batches)
+    for user_id, msgs in batches.items():
+        await hub.broadcast_to_user(user_id, {"type": "batch", "data": msgs})
+    M_INGESTED_REST.inc(len(items))
+    M_BATCH_SIZE.observe(len(items))
+    return ids
+
+def admit(limiter: Optional[RateLimiter], key: str, cost: int = 1, shed: bool = True) -> Tuple[Optional[str], float]:
+    # Admission check for `cost` new messages from `key`. Returns (None,
+    # delay) to go ahead after `delay` seconds (usually 0), or (reason,
+    # retry_after) with reason "overloaded" / "rate_limited" to reject.
+    if shed and SHEDDER.overloaded:
+        M_ADMISSION_OVERLOADED.inc(cost)
+        return "overloaded", SHED_RETRY_AFTER
+    if limiter is None:
+        return None, 0.0
+    ok, wait = limiter.acquire(key, cost, RATE_LIMIT_MAX_DELAY)
+    if not ok:
+        M_ADMISSION_LIMITED.inc(cost)
+        return "rate_limited", wait
+    if wait:
+        M_ADMISSION_DELAYED.inc(cost)
+    return None, wait
+
+async def admit_http(limiter: Optional[RateLimiter], key: str, cost: int = 1, shed: bool = True) -> None:
+    # admit() for REST handlers: waits out a short delay, raises 429 with
+    # Retry-After on rejection
+    reason, wait = admit(limiter, key, cost, shed)
+    await settle_http(reason, wait, key)
+
+async def admit_http_all(limiter: Optional[RateLimiter], costs: Dict[str, int]) -> None:
+    # admit_http() for one request charged to several keys: all of them pay
+    # or, on a 429, none does. Overload is not checked here.
+    if limiter is None:
+        return
+    ok, wait, slowest = limiter.acquire_all(costs, RATE_LIMIT_MAX_DELAY)
+    total = sum(costs.values())
+    if not ok:
+        M_ADMISSION_LIMITED.inc(total)
+        await settle_http("rate_limited", wait, slowest)
+    if wait:
+        M_ADMISSION_DELAYED.inc(total)
+        await asyncio.sleep(wait)
+
+async def settle_http(reason: Optional[str], wait: float, key: str) -> None:
+    if reason is not None:
+        detail = "server overloaded" if reason == "overloaded" else f"rate limit exceeded for {key}"
+        raise HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(max(1, math.ceil(wait)))})
+    if wait:
+        await asyncio.sleep(wait)
+
+async def pace(limiter: Optional[RateLimiter], key: str, cost: int = 1) -> None:
+    # Rate limit without rejecting: wait until `key` can afford `cost`
+    if limiter is not None:
+        _, wait = limiter.acquire(key, cost, math.inf)
+        if wait:
+            M_ADMISSION_DELAYED.inc(cost)
+            await asyncio.sleep(wait)
+
+async def pace_batch(items: List[Dict[str, Any]]) -> None:
+    # Streaming (NDJSON) form: never rejects mid-stream, the upload is slowed
+    # down instead. While we sleep the body is not read, so TCP pushes back
+    # on the client.
+    while SHEDDER.overloaded:
+        await asyncio.sleep(SHEDDER.interval)
+    for user_id, n in Counter(item["user_id"] for item in items).items():
+        await pace(BULK_LIMITER, user_id, n)
+
+def prune_idle(interval: float) -> None:
+    # Forget full rate-limit buckets and stale unsubscribed channels
+    for limiter in (USER_LIMITER, BULK_LIMITER, PEER_LIMITER):
+        if limiter is not None:
+            limiter.prune()
+    hub.channels.prune(CHANNEL_IDLE_TTL)
+    hub.wheel.schedule(interval, prune_idle, interval)
+
+def sse_event(text: str, event_id: int) -> str:
+    # One SSE chunk. The id is the user's message cursor: the number of
+    # messages stored (and broadcast) so far, so a reconnecting client's
+    # Last-Event-ID says exactly which messages it has already seen.
+    return f"id: {event_id}\ndata: {text}\n\n"
+
+class Connection:
+    # One realtime client (chat WS, SSE stream or signaling WS) and its
+    # bounded outbound queue. Everything sent to the client goes through
+    # the outbox; a single consumer drains it (writer task / SSE generator).
+    __slots__ = ("id", "kind", "key", "ws", "codec", "peer", "outbox", "writer", "timer", "last_rx", "last_sent", "replies")
+
+    _ids = itertools.count(1)
+
+    def __init__(self, kind: str, key: str, ws: Optional[WebSocket] = None, codec: Codec = JSON) -> None:
+        self.id = next(Connection._ids)
+        self.kind = kind  # "ws" | "sse" | "signal"
+        self.key = key    # user_id or room_id
+        self.ws = ws
+        self.codec = codec  # WS subprotocol encoding; SSE is always JSON
+        self.peer: Optional[str] = None  # signaling peer id within the room
+        self.outbox = Outbox(OUTBOX_SIZE, "disconnect" if kind == "sse" else OUTBOX_POLICY)
+        self.writer: Optional[asyncio.Task] = None
+        self.timer: Optional[Timer] = None  # next keepalive / idle check
+        self.last_rx = time.monotonic()     # last frame from the client (WS)
+        self.last_sent = 0                  # outbox.sent at the last keepalive check
+        self.replies: Optional[Dict[str, asyncio.Task]] = None  # assistant replies this client asked for
+
+    def close(self) -> None:
+        # Stop queuing, drop off the timer wheel and abandon the replies
+        # still being generated for this client
+        self.outbox.close()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.replies:
+            for task in list(self.replies.values()):
+                task.cancel()
+
+    def start_reply(self, reply_id: str, coro) -> None:
+        # Run a reply stream owned by this connection (cancelled with it)
+        if self.replies is None:
+            self.replies = {}
+        task = asyncio.create_task(coro)
+        self.replies[reply_id] = task
+        task.add_done_callback(lambda _: self.replies.pop(reply_id, None))
+
+    def cancel_reply(self, reply_id: Optional[str] = None) -> int:
+        # Cancel one of this connection's replies, or all of them
+        if not self.replies:
+            return 0
+        tasks = list(self.replies.values()) if reply_id is None else [t for t in (self.replies.get(reply_id),) if t]
+        for task in tasks:
+            task.cancel()
+        return len(tasks)
+
+    def send(self, payload: Dict[str, Any], coalesce_key: Optional[str] = None) -> bool:
+        # Queue a payload for this connection only
+        if self.kind == "sse":
+            return self.outbox.put(sse_event(dumps(payload), MESSAGES.next_seq(self.key)), coalesce_key)
+        return self.outbox.put(self.codec.encode(payload), coalesce_key)
+
+    async def receive(self) -> Any:
+        # Next decoded frame from the client; undecodable frames come back as
+        # raw text (the caller wraps them). Raises WebSocketDisconnect.
+        message = await self.ws.receive()
+        self.last_rx = time.monotonic()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+        data = message.get("text")
+        if data is None:
+            data = message.get("bytes") or b""
+        try:
+            return self.codec.decode(data)
+        except DecodeError:
+            return data if isinstance(data, str) else data.decode("utf-8", errors="replace")
+
+    def stats(self) -> Dict[str, Any]:
+        out = {"id": self.id, "kind": self.kind, "key": self.key, "codec": self.codec.name, **self.outbox.stats()}
+        if self.peer is not None:
+            out["peer"] = self.peer
+        return out
+
+class Registry:
+    # key (user_id / room_id) -> set of live connections. Only ever mutated
+    # from the event loop and never across an await, so every operation is
+    # atomic without a lock: register/unregister are O(1) dict/set updates
+    # and cannot queue behind each other during reconnect storms.
+    __slots__ = ("_by_key", "_count")
 
-class Hub:
-    # Tracks all realtime connections and provides broadcast helpers
     def __init__(self) -> None:
-        self.ws_by_user: Dict[str, Set[WebSocket]] = defaultdict(set)
-        self.ws_rooms: Dict[str, Set[WebSocket]] = defaultdict(set)
+        self._by_key: Dict[str, Set[Connection]] = {}
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def get(self, key: str):
+        return self._by_key.get(key, ())
+
+    def add(self, key: str, conn: Connection) -> None:
+        conns = self._by_key.get(key)
+        if conns is None:
+            conns = self._by_key[key] = set()
+        if conn not in conns:
+            conns.add(conn)
+            self._count += 1
+
+    def discard(self, key: str, conn: Connection) -> None:
+        conns = self._by_key.get(key)
+        if conns is not None and conn in conns:
+            conns.remove(conn)
+            self._count -= 1
+            if not conns:
+                del self._by_key[key]
+
+    def values(self):
+        return self._by_key.values()
+
+class Hub:
+    # Tracks all realtime connections and provides broadcast helpers.
+    # Broadcasts are delivered to this worker's connections directly and
+    # forwarded to other workers through the backplane.
+    def __init__(self, backplane: Backplane) -> None:
+        self.backplane = backplane
+
+        self.ws_by_user = Registry()
+        self.ws_rooms = Registry()
+
+        self.sse_by_user = Registry()
 
-        self.sse_queues: Dict[str, List[asyncio.Queue]] = defaultdict(list)
+        # room_id -> peer_id -> Connection, or None for a peer on another
+        # worker (learned from its join/leave events on the backplane)
+        self.room_peers: Dict[str, Dict[str, Optional[Connection]]] = {}
 
-        self._lock = asyncio.Lock()
+        # Named channels, subscribed to by connections of any kind
+        self.channels = ChannelIndex(CHANNEL_REPLAY, CHANNEL_REPLAY_SIZES)
+
+        # Keepalives, idle timeouts and the dead-connection sweep for every
+        # connection: one loop timer in total instead of one per connection
+        self.wheel = TimerWheel(TIMER_TICK)
+
+        # Connections whose writer died; unregistered by sweep(), never on
+        # the broadcast path
+        self._dead: List[Connection] = []
 
     # ---------------------- WebSocket (chat) ----------------------
 
-    async def add_ws_user(self, user_id: str, ws: WebSocket) -> None:
-        async with self._lock:
-            self.ws_by_user[user_id].add(ws)
+    def add_ws_user(self, user_id: str, ws: WebSocket, codec: Codec = JSON) -> Connection:
+        conn = Connection("ws", user_id, ws, codec)
+        self.ws_by_user.add(user_id, conn)
+        conn.writer = asyncio.create_task(self._ws_writer(conn))
+        self.watch(conn)
+        return conn
 
-    async def remove_ws_user(self, user_id: str, ws: WebSocket) -> None:
-        async with self._lock:
-            self.ws_by_user[user_id].discard(ws)
-            if not self.ws_by_user[user_id]:
-                self.ws_by_user.pop(user_id, None)
+    def remove_ws_user(self, user_id: str, conn: Connection) -> None:
+        conn.close()
+        self.ws_by_user.discard(user_id, conn)
+        self.channels.drop(conn)
 
-    async def broadcast_to_user(self, user_id: str, payload: Dict[str, Any]) -> None:
-        # Send payload to all WebSockets and SSE subscribers of a user
-        for ws in list(self.ws_by_user.get(user_id, [])):
-            try:
-                await ws.send_text(json.dumps(payload, ensure_ascii=False))
-            except Exception:
-                await self.remove_ws_user(user_id, ws)
+    async def broadcast_to_user(self, user_id: str, payload: Dict[str, Any], coalesce_key: Optional[str] = None) -> None:
+        # Queue payload for all WebSockets and SSE subscribers of a user.
+        # The payload is encoded once per codec and shared by every connection.
+        t0 = time.perf_counter()
+        frame = Frame(payload, dumps(payload))
+        t1 = time.perf_counter()
+        self.deliver_user(user_id, frame, coalesce_key)
+        self.backplane.publish("u", user_id, frame.json, coalesce_key)
+        M_ENCODE.observe(t1 - t0)
+        M_FANOUT_USER.observe(time.perf_counter() - t1)
+        M_BROADCASTS_USER.inc()
+
+    def deliver_user(self, user_id: str, frame: Frame, coalesce_key: Optional[str] = None) -> None:
+        # Local half of broadcast_to_user (also called for backplane events)
+        self._fanout(self.ws_by_user.get(user_id), frame, coalesce_key)
+        sse_conns = self.sse_by_user.get(user_id)
+        if sse_conns:
+            chunk = sse_event(frame.json, MESSAGES.next_seq(user_id))
+            for conn in sse_conns:
+                conn.outbox.put(chunk, coalesce_key)
+
+    # ---------------------- SSE ----------------------
+
+    def add_sse(self, user_id: str) -> Connection:
+        conn = Connection("sse", user_id)
+        self.sse_by_user.add(user_id, conn)
+        self.watch(conn)
+        return conn
 
-        for q in list(self.sse_queues.get(user_id, [])):
+    def remove_sse(self, user_id: str, conn: Connection) -> None:
+        conn.close()
+        self.sse_by_user.discard(user_id, conn)
+        self.channels.drop(conn)
+
+    # ---------------------- Fan-out engine ----------------------
+
+    @staticmethod
+    def _fanout(conns, frame: Frame, coalesce_key: Optional[str] = None, skip: Optional[Connection] = None) -> None:
+        # Hand one pre-encoded frame to every WebSocket's outbox. Never waits
+        # on the network: slow clients only fill (and overflow) their own queue.
+        text = None
+        for conn in conns:
+            if conn is skip:
+                continue
+            if conn.codec is JSON:
+                if text is None:
+                    text = frame.json
+                conn.outbox.put(text, coalesce_key)
+            else:
+                conn.outbox.put(frame.encoded(conn.codec), coalesce_key)
+
+    async def _ws_writer(self, conn: Connection) -> None:
+        # Drain one WebSocket's outbox. A send that fails or exceeds
+        # WS_SEND_TIMEOUT, or an overflow under the "disconnect" policy,
+        # closes the socket and leaves it for the background sweep.
+        failed = None
+        send = conn.ws.send_bytes if conn.codec.binary else conn.ws.send_text
+        while True:
+            data = await conn.outbox.get()
+            if data is None:
+                break
+            if COALESCE_WINDOW:
+                frames = await conn.outbox.collect(data, COALESCE_WINDOW, COALESCE_MAX_BYTES)
+                if len(frames) > 1:
+                    data = conn.codec.bundle(frames)
+                M_WRITE_FRAMES_WS.observe(len(frames))
             try:
-                q.put_nowait(payload)
+                await asyncio.wait_for(send(data), timeout=WS_SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                failed = "timeout"
+                break
             except Exception:
-                pass
+                failed = "error"
+                break
+        if conn.outbox.overflowed:
+            failed = "overflow"
+        if failed is not None:
+            M_SEND_FAILURES.labels(conn.kind, failed).inc()
+            conn.close()
+            self._dead.append(conn)
+            await self._close_ws(conn, 1011)
+
+    @staticmethod
+    async def _close_ws(conn: Connection, code: int) -> None:
+        try:
+            await asyncio.wait_for(conn.ws.close(code=code), timeout=WS_SEND_TIMEOUT)
+        except Exception:
+            pass
 
     # ---------------------- WebRTC signaling ----------------------
 
-    async def add_ws_room(self, room_id: str, ws: WebSocket) -> None:
-        async with self._lock:
-            self.ws_rooms[room_id].add(ws)
+    def add_ws_room(self, room_id: str, ws: WebSocket, codec: Codec = JSON) -> Connection:
+        # Join with a fresh peer id and announce it to the rest of the room
+        conn = Connection("signal", room_id, ws, codec)
+        conn.peer = uuid.uuid4().hex[:12]
+        self.ws_rooms.add(room_id, conn)
+        self.room_peers.setdefault(room_id, {})[conn.peer] = conn
+        conn.writer = asyncio.create_task(self._ws_writer(conn))
+        self.watch(conn)
+        self._presence(room_id, conn, "peer_joined")
+        return conn
 
-    async def remove_ws_room(self, room_id: str, ws: WebSocket) -> None:
-        async with self._lock:
-            self.ws_rooms[room_id].discard(ws)
-            if not self.ws_rooms[room_id]:
-                self.ws_rooms.pop(room_id, None)
+    def remove_ws_room(self, room_id: str, conn: Connection) -> None:
+        conn.close()
+        self.ws_rooms.discard(room_id, conn)
+        self.channels.drop(conn)
+        self._leave_room(conn)
 
-    async def broadcast_room(self, room_id: str, payload: Dict[str, Any], sender: WebSocket) -> None:
+    def _leave_room(self, conn: Connection) -> None:
+        # Drop the peer id and announce the leave (once, whoever gets here first)
+        peers = self.room_peers.get(conn.key)
+        if not peers or peers.get(conn.peer) is not conn:
+            return
+        del peers[conn.peer]
+        if not peers:
+            del self.room_peers[conn.key]
+        self._presence(conn.key, conn, "peer_left")
+
+    def _presence(self, room_id: str, conn: Connection, event: str) -> None:
+        frame = Frame({"type": event, "room": room_id, "peer_id": conn.peer, "ts": utc_iso()})
+        self.deliver_room(room_id, frame, skip=conn, coalesce_key=f"presence:{conn.peer}")
+        self.backplane.publish("j" if event == "peer_joined" else "l", room_id, frame.json, conn.peer)
+
+    def remote_presence(self, room_id: str, peer: str, joined: bool, frame: Frame) -> None:
+        # A peer joined/left on another worker: track it, tell local peers
+        if joined:
+            self.room_peers.setdefault(room_id, {})[peer] = None
+        else:
+            peers = self.room_peers.get(room_id)
+            if peers and peer in peers and peers[peer] is None:
+                del peers[peer]
+                if not peers:
+                    del self.room_peers[room_id]
+        self.deliver_room(room_id, frame, coalesce_key=f"presence:{peer}")
+
+    def room_peer_ids(self, room_id: str, exclude: Optional[str] = None) -> List[str]:
+        return [peer for peer in self.room_peers.get(room_id, ()) if peer != exclude]
+
+    def send_to_peer(self, room_id: str, peer: str, payload: Dict[str, Any]) -> bool:
+        # Deliver to one peer of the room only, wherever it is connected.
+        # False if the room has no such peer.
+        peers = self.room_peers.get(room_id)
+        if not peers or peer not in peers:
+            M_SIGNAL_UNKNOWN.inc()
+            return False
+        conn = peers[peer]
+        if conn is not None:
+            conn.send(payload)
+            M_SIGNAL_LOCAL.inc()
+        else:
+            if self.backplane.peers():
+                self.backplane.publish("p", room_id, dumps(payload), peer)
+            M_SIGNAL_REMOTE.inc()
+        return True
+
+    def deliver_peer(self, room_id: str, peer: str, frame: Frame) -> None:
+        # Local half of send_to_peer for messages routed by another worker
+        conn = self.room_peers.get(room_id, {}).get(peer)
+        if conn is not None:
+            conn.outbox.put(frame.encoded(conn.codec))
+
+    async def broadcast_room(self, room_id: str, payload: Dict[str, Any], sender: Connection) -> None:
         # Relay signaling messages to everyone except the sender
-        for ws in list(self.ws_rooms.get(room_id, [])):
-            if ws is sender:
+        t0 = time.perf_counter()
+        frame = Frame(payload, dumps(payload))
+        t1 = time.perf_counter()
+        self.deliver_room(room_id, frame, skip=sender)
+        self.backplane.publish("r", room_id, frame.json)
+        M_ENCODE.observe(t1 - t0)
+        M_FANOUT_ROOM.observe(time.perf_counter() - t1)
+        M_BROADCASTS_ROOM.inc()
+
+    def deliver_room(self, room_id: str, frame: Frame, skip: Optional[Connection] = None, coalesce_key: Optional[str] = None) -> None:
+        # Local half of broadcast_room (also called for backplane events)
+        conns = self.ws_rooms.get(room_id)
+        if conns:
+            self._fanout(conns, frame, coalesce_key, skip)
+
+    # ---------------------- Channels ----------------------
+
+    def subscribe(self, conn: Connection, name: str, since: Optional[int] = None) -> Tuple[Dict[str, Any], List[str]]:
+        # Subscribe; returns the channel's position and, if `since` is given,
+        # the buffered frames published after it. Queue those (send_json)
+        # before yielding to the loop and the client misses nothing between
+        # the replay and the live frames.
+        channel = self.channels.subscribe(name, conn)
+        info: Dict[str, Any] = {"seq": channel.seq}
+        frames: List[str] = []
+        if since is not None:
+            frames, gap = channel.since(since)
+            info["replayed"] = len(frames)
+            info["gap"] = gap  # frames after `since` were lost; refetch state
+        return info, frames
+
+    @staticmethod
+    def send_json(conn: Connection, text: str) -> None:
+        # Queue an already encoded JSON frame on any kind of connection
+        if conn.kind == "sse":
+            conn.outbox.put(f"data: {text}\n\n")
+        elif conn.codec is JSON:
+            conn.outbox.put(text)
+        else:
+            conn.outbox.put(Frame(json_text=text).encoded(conn.codec))
+
+    async def publish_channel(self, name: str, data: Any) -> int:
+        # Publish `data` to every subscriber of the channel, on every worker.
+        # Returns its seq on this worker (0 if nobody here could get it).
+        t0 = time.perf_counter()
+        data_json = dumps(data)
+        t1 = time.perf_counter()
+        seq = self.deliver_channel(name, data_json)
+        self.backplane.publish("c", name, data_json)
+        M_ENCODE.observe(t1 - t0)
+        M_FANOUT_CHANNEL.observe(time.perf_counter() - t1)
+        M_BROADCASTS_CHANNEL.inc()
+        return seq
+
+    def deliver_channel(self, name: str, data_json: str) -> int:
+        # Local half of publish_channel (also called for backplane events).
+        # The frame is built once around the already encoded data and shared
+        # by every subscriber: one JSON text for WS (one more encoding per
+        # other codec) and one chunk for SSE. Channel frames on an SSE stream
+        # carry no event id: ids there are the user's message cursor.
+        channel = self.channels.for_publish(name)
+        if channel is None:
+            return 0
+        seq = channel.advance()
+        text = f'{{"type":"channel","channel":{dumps(name)},"seq":{seq},"ts":"{utc_iso()}","data":{data_json}}}'
+        channel.record(seq, text)
+        frame = None
+        sse_chunk = None
+        for conn in channel.subscribers:
+            if conn.kind == "sse":
+                if sse_chunk is None:
+                    sse_chunk = f"data: {text}\n\n"
+                conn.outbox.put(sse_chunk)
+            elif conn.codec is JSON:
+                conn.outbox.put(text)
+            else:
+                if frame is None:
+                    frame = Frame(json_text=text)
+                conn.outbox.put(frame.encoded(conn.codec))
+        return seq
+
+    # ---------------------- Maintenance ----------------------
+
+    def sweep(self) -> int:
+        # Unregister connections whose writer died. O(number of dead ones).
+        dead, self._dead = self._dead, []
+        registries = {"ws": self.ws_by_user, "sse": self.sse_by_user, "signal": self.ws_rooms}
+        for conn in dead:
+            registries[conn.kind].discard(conn.key, conn)
+            self.channels.drop(conn)
+            if conn.peer is not None:
+                self._leave_room(conn)
+        return len(dead)
+
+    def start(self, sweep_interval: float) -> None:
+        self.wheel.start()
+        self._sweep_tick(sweep_interval)
+
+    def stop(self) -> None:
+        self.wheel.close()
+
+    def _sweep_tick(self, interval: float) -> None:
+        self.sweep()
+        self.wheel.schedule(interval, self._sweep_tick, interval)
+
+    def watch(self, conn: Connection) -> None:
+        # Put a new connection on the wheel; it re-arms itself every interval
+        conn.last_sent = conn.outbox.sent
+        conn.timer = self.wheel.schedule(KEEPALIVE_INTERVAL, self._keepalive, conn)
+
+    def _keepalive(self, conn: Connection) -> None:
+        # Runs every KEEPALIVE_INTERVAL per connection. Evicts WebSockets
+        # whose client has been silent past IDLE_TIMEOUT (if set); otherwise
+        # sends a keepalive if nothing went out since the last check and, for
+        # WebSockets, nothing came in either. A dead peer then surfaces
+        # through the writer's failed or timed-out send.
+        conn.timer = None
+        if conn.outbox.closed:
+            return
+        silent = time.monotonic() - conn.last_rx
+        if conn.kind != "sse" and IDLE_TIMEOUT and silent > IDLE_TIMEOUT:
+            self.evict(conn, "idle")
+            return
+        heard = conn.kind != "sse" and silent < KEEPALIVE_INTERVAL
+        if conn.outbox.sent == conn.last_sent and not len(conn.outbox) and not heard:
+            if conn.kind == "sse":
+                conn.outbox.put(f": keepalive {utc_iso()}\n\n", "keepalive")
+            else:
+                conn.send({"type": "ping", "ts": utc_iso()}, "keepalive")
+            conn.last_sent = conn.outbox.sent + 1  # don't count our own keepalive as traffic
+        else:
+            conn.last_sent = conn.outbox.sent
+        conn.timer = self.wheel.schedule(KEEPALIVE_INTERVAL, self._keepalive, conn)
+
+    def evict(self, conn: Connection, reason: str) -> None:
+        # Drop a connection from outside its handler: the writer stops, the
+        # socket is closed (its handler then unregisters it) and the sweep
+        # removes it from the registry right away in any case
+        M_SEND_FAILURES.labels(conn.kind, reason).inc()
+        conn.close()
+        self._dead.append(conn)
+        if conn.ws is not None:
+            asyncio.create_task(self._close_ws(conn, 1001))
+
+    # ---------------------- Introspection ----------------------
+
+    def connection_stats(self) -> List[Dict[str, Any]]:
+        # Queue depth / drop counters for every live connection
+        out = []
+        for registry in (self.ws_by_user, self.sse_by_user, self.ws_rooms):
+            for conns in registry.values():
+                out.extend(conn.stats() for conn in conns)
+        return out
+
+hub = Hub(UnixSocketBackplane(BACKPLANE_DIR) if BACKPLANE == "unix" else Backplane())
+
+METRICS.gauge(
+    "realtime_connections", "Live connections on this worker", ("kind",),
+    lambda: {("ws",): len(hub.ws_by_user), ("sse",): len(hub.sse_by_user), ("signal",): len(hub.ws_rooms)},
+)
+METRICS.gauge(
+    "realtime_backplane_peers", "Other workers connected through the backplane", (),
+    lambda: {(): hub.backplane.peers()},
+)
+METRICS.gauge(
+    "realtime_history_cache_bytes", "Bytes held by the history response cache", (),
+    lambda: {(): HISTORY_CACHE.bytes},
+)
+METRICS.counter_callback(
+    "realtime_ws_deflate_bytes_total", "Payload bytes of permessage-deflate compressed WS frames, before and after", ("stage",),
+    lambda: {("in",): DeflateStats.bytes_in, ("out",): DeflateStats.bytes_out},
+)
+METRICS.counter_callback(
+    "realtime_ws_deflate_skipped_total", "WS frames sent uncompressed for being under WS_DEFLATE_MIN_BYTES", (),
+    lambda: {(): DeflateStats.skipped},
+)
+METRICS.counter_callback(
+    "realtime_message_log_compacted_bytes_total", "Bytes of expired records dropped from the message log by compaction", (),
+    lambda: {(): MESSAGE_LOG.compacted_bytes if MESSAGE_LOG is not None else 0},
+)
+METRICS.gauge(
+    "realtime_timers_pending", "Keepalive/idle/sweep timers on the shared timer wheel", (),
+    lambda: {(): len(hub.wheel)},
+)
+METRICS.gauge(
+    "realtime_channels", "Named channels held by this worker (subscribed or with frames to replay)", (),
+    lambda: {(): len(hub.channels)},
+)
+METRICS.gauge(
+    "realtime_channel_subscriptions", "Channel subscriptions of this worker's connections", (),
+    lambda: {(): hub.channels.subscriptions},
+)
+METRICS.gauge(
+    "realtime_event_loop_lag_seconds", "Smoothed event-loop lag seen by the load shedder", (),
+    lambda: {(): SHEDDER.lag},
+)
+METRICS.gauge(
+    "realtime_outbox_queued_frames", "Frames waiting in all connection outboxes", (),
+    lambda: {(): Outbox.queued},
+)
+METRICS.gauge(
+    "realtime_overloaded", "1 while the load shedder rejects new work", (),
+    lambda: {(): int(SHEDDER.overloaded)},
+)
+
+class HistorySync:
+    # History catch-up for a worker starting next to running ones: it asks
+    # one peer for a snapshot ("s"), which answers with one "h" event per
+    # user and an "e" at the end, on the same ordered stream as its live
+    # writes. Replicated writes ("m"/"b") arriving meanwhile, from any peer,
+    # are held back and applied after the snapshot, minus what it already
+    # had. Runs before the app takes requests, so nothing is written locally.
+    def __init__(self) -> None:
+        self.held: Optional[List[Tuple[str, str, str]]] = None  # (topic, user_id, body) while syncing
+        self.source: Optional[str] = None
+        self._done: Optional[asyncio.Future] = None
+
+    async def run(self, backplane: Backplane, timeout: float) -> None:
+        peers = backplane.peer_ids()
+        if not peers:
+            return
+        self.held, self.source = [], peers[0]
+        self._done = asyncio.get_running_loop().create_future()
+        try:
+            if backplane.send(self.source, "s", "", "", backplane.ident):
+                await asyncio.wait_for(self._done, timeout)
+        except asyncio.TimeoutError:
+            log.warning("history catch-up from worker %s timed out after %ss; continuing with what arrived", self.source, timeout)
+        finally:
+            held, self.held, self.source = self.held, None, None
+            for topic, user_id, body in held:
+                msgs = [loads(body)] if topic == "m" else loads(body)
+                new = [m for m in msgs if not MESSAGES.retains(user_id, m.get("id"))]
+                if new:
+                    MESSAGES.extend(user_id, new)
+
+    def snapshot(self, user_id: str, body: str) -> None:
+        if self.held is not None:
+            MESSAGES.extend(user_id, loads(body))
+
+    def finished(self) -> None:
+        if self._done is not None and not self._done.done():
+            self._done.set_result(None)
+
+HISTORY_SYNC = HistorySync()
+
+def send_history(peer: str) -> None:
+    # Answer a catch-up request: this worker's whole history, then the end
+    for user_id, msgs in MESSAGES.snapshot():
+        if msgs:
+            hub.backplane.send(peer, "h", user_id, dumps(msgs))
+    hub.backplane.send(peer, "e", "", "")
+
+def on_backplane_event(topic: str, key: str, extra: Optional[str], body: str) -> None:
+    # Events published by other workers. A bad event is logged and counted,
+    # and must not take the link to that worker down.
+    try:
+        deliver_backplane_event(topic, key, extra, body)
+    except Exception:
+        M_HANDLER_ERRORS.labels("backplane").inc()
+        log.exception("backplane event %r for %s failed", topic, key)
+
+def deliver_backplane_event(topic: str, key: str, extra: Optional[str], body: str) -> None:
+    if topic in ("m", "b") and HISTORY_SYNC.held is not None:
+        HISTORY_SYNC.held.append((topic, key, body))
+    elif topic == "m":
+        MESSAGES.append(key, loads(body))
+    elif topic == "b":
+        MESSAGES.extend(key, loads(body))
+    elif topic == "u":
+        hub.deliver_user(key, Frame(json_text=body), extra)
+    elif topic == "r":
+        hub.deliver_room(key, Frame(json_text=body))
+    elif topic == "p":
+        hub.deliver_peer(key, extra, Frame(json_text=body))
+    elif topic == "c":
+        hub.deliver_channel(key, body)
+    elif topic in ("j", "l"):
+        hub.remote_presence(key, extra, topic == "j", Frame(json_text=body))
+    elif topic == "x":
+        MESSAGES.clear()
+        HISTORY_CACHE.clear()
+        hub.channels.clear_replay()
+    elif topic == "s":
+        send_history(extra)
+    elif topic == "h":
+        HISTORY_SYNC.snapshot(key, body)
+    elif topic == "e":
+        HISTORY_SYNC.finished()
+
+# -----------------------------------------------------------------------------
+# Streamed assistant replies
+# -----------------------------------------------------------------------------
+
+def history_context(user_id: str) -> List[Dict[str, str]]:
+    # The user's latest messages, oldest first, as backend context
+    messages, _ = MESSAGES.page(user_id, ASSISTANT_CONTEXT)
+    return [{"role": m.get("role") or "user", "text": m["text"]} for m in messages if m.get("text")]
+
+async def stream_reply(
+    user_id: Optional[str],
+    context: List[Dict[str, str]],
+    reply_id: Optional[str] = None,
+    reply_to: Optional[str] = None,
+    sink: Optional[Callable[[Dict[str, Any]], Any]] = None,
+    started: Optional[float] = None,
+) -> Optional[Dict[str, Any]]:
+    # Run the backend and forward each delta as soon as it arrives, to all
+    # of the user's connections (on every worker) and to `sink` (a streaming
+    # HTTP response). Frames: "reply_start", then one "delta" per piece of
+    # text, then the finished reply as an ordinary "message" with the same
+    # id, stored once. A cancelled, failed or timed-out reply is not stored
+    # and ends with "reply_end" instead. Without a user_id nothing is stored
+    # or broadcast. Returns the reply message, or None if it did not finish.
+    reply_id = reply_id or str(uuid.uuid4())
+    started = time.perf_counter() if started is None else started
+    parts: List[str] = []
+
+    async def emit(frame: Dict[str, Any]) -> None:
+        if user_id is not None:
+            await hub.broadcast_to_user(user_id, frame)
+        if sink is not None:
+            sink(frame)
+
+    async def run() -> None:
+        async for text in ASSISTANT.stream(context):
+            if not text:
                 continue
-            try:
-                await ws.send_text(json.dumps(payload, ensure_ascii=False))
-            except Exception:
-                await self.remove_ws_room(room_id, ws)
+            if not parts:
+                M_ASSISTANT_TTFT.observe(time.perf_counter() - started)
+            await emit({"type": "delta", "data": {"reply_id": reply_id, "index": len(parts), "text": text}})
+            parts.append(text)
+            M_ASSISTANT_DELTAS.inc()
+        if not parts:
+            raise ValueError("empty reply")
 
-hub = Hub()
+    await emit({"type": "reply_start", "data": {"reply_id": reply_id, "reply_to": reply_to, "ts": utc_iso()}})
+    reason: Optional[str] = "error"
+    try:
+        await asyncio.wait_for(run(), timeout=ASSISTANT_TIMEOUT)
+        reason = None
+    except asyncio.CancelledError:
+        reason = "cancelled"
+        raise
+    except asyncio.TimeoutError:
+        reason = "timeout"
+    except Exception:
+        log.exception("assistant backend %s failed", ASSISTANT.name)
+    finally:
+        M_ASSISTANT_DURATION.observe(time.perf_counter() - started)
+        M_ASSISTANT_REPLIES.labels(reason or "completed").inc()
+        if reason is not None:
+            # emit() never suspends, so this is delivered even when cancelled
+            await emit({"type": "reply_end", "data": {"reply_id": reply_id, "reason": reason, "ts": utc_iso()}})
+    if reason is not None:
+        return None
+
+    msg = {"id": reply_id, "ts": utc_iso(), "role": "assistant", "text": "".join(parts)}
+    if reply_to is not None:
+        msg["reply_to"] = reply_to
+    if user_id is not None:
+        msg["user_id"] = user_id
+        await store_message(user_id, msg)
+    await emit({"type": "message", "data": msg})
+    return msg
 
 # -----------------------------------------------------------------------------
 # FastAPI app
 # -----------------------------------------------------------------------------
 
-app = FastAPI(title="Dummy Realtime Server for React Chat Bot")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if MESSAGE_LOG is not None:
+        for user_id, msg in MESSAGE_LOG.replay():
+            MESSAGES.append(user_id, msg)
+        await MESSAGE_LOG.start()
+    await hub.backplane.start(on_backplane_event)
+    await HISTORY_SYNC.run(hub.backplane, BACKPLANE_SYNC_TIMEOUT)
+    hub.start(REGISTRY_SWEEP_INTERVAL)
+    prune_idle(10)
+    LOOP_MONITOR.start()  # feeds SHEDDER through on_loop_lag
+    try:
+        yield
+    finally:
+        LOOP_MONITOR.close()
+        SHEDDER.close()
+        hub.stop()
+        await ASSISTANT.close()
+        await hub.backplane.close()
+        if MESSAGE_LOG is not None:
+            await MESSAGE_LOG.close()
+
+app = FastAPI(title="Dummy Realtime Server for React Chat Bot", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -107,64 +1135,409 @@ app.add_middleware(
 async def root():
     return {"ok": True, "service": "dummy-realtime", "time": utc_iso()}
 
+@app.get("/metrics")
+async def get_metrics():
+    # Prometheus text exposition format
+    if not METRICS.enabled:
+        raise HTTPException(status_code=404, detail="metrics are disabled")
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
 # -----------------------------------------------------------------------------
 # REST endpoints
 # -----------------------------------------------------------------------------
 
 @app.get("/api/history/{user_id}")
-async def get_history(user_id: str):
-    return {"user_id": user_id, "messages": MESSAGES.get(user_id, [])[-200:]}
+async def get_history(
+    user_id: str,
+    request: Request,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = HISTORY_PAGE_SIZE,
+):
+    # Cursor-paginated history. `before`/`after` are a message id or an ISO
+    # timestamp (both exclusive); without cursors the newest page is returned.
+    # The ETag is the user's history version: an unchanged history answers
+    # If-None-Match with 304 and otherwise comes from the response cache.
+    # Pages of HTTP_COMPRESS_MIN_BYTES and more are gzip/brotli-encoded.
+    if limit < 1 or limit > HISTORY_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {HISTORY_MAX_PAGE_SIZE}")
 
-@app.post("/api/message")
-async def post_message(payload: Dict[str, Any]):
+    epoch, seq = MESSAGES.version(user_id)
+    etag = f'"{BOOT_ID}-{epoch}-{seq}"'
+    # A compressed page is another representation of the same version, so it
+    # gets its own ETag; either one revalidates
+    encoding = negotiate_encoding(request.headers.get("accept-encoding")) if HTTP_COMPRESS_MIN_BYTES else None
+    encoded_etag = f'{etag[:-1]}-{encoding}"' if encoding else None
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        for tag in (etag, encoded_etag):
+            if tag and etag_matches(if_none_match, tag):
+                M_HISTORY_304.inc()
+                headers["ETag"] = tag
+                return Response(status_code=304, headers=headers)
+
+    key = (user_id, before, after, limit)
+    body = HISTORY_CACHE.get(key, etag)
+    if body is not None:
+        M_HISTORY_HIT.inc()
+        return history_response(key, etag, body, encoding, encoded_etag, headers)
+    M_HISTORY_MISS.inc()
+
+    before_seq = after_seq = None
+    if before is not None:
+        before_seq = MESSAGES.resolve_cursor(user_id, before)
+        if before_seq is None:
+            raise HTTPException(status_code=400, detail="unknown 'before' cursor")
+    if after is not None:
+        after_seq = MESSAGES.resolve_cursor(user_id, after, after=True)
+        if after_seq is None:
+            raise HTTPException(status_code=400, detail="unknown 'after' cursor")
+
+    messages, has_more = MESSAGES.page(user_id, limit, before=before_seq, after=after_seq)
+    forward = after is not None and before is None
+    body = dumps({
+        "user_id": user_id,
+        "messages": messages,
+        "has_more": has_more,
+        # Cursor for the next page in the same direction
+        "next": (messages[-1]["id"] if forward else messages[0]["id"]) if has_more and messages else None,
+    }).encode("utf-8")
+    HISTORY_CACHE.put(key, etag, body)
+    return history_response(key, etag, body, encoding, encoded_etag, headers)
+
+def history_response(
+    key: Tuple, etag: str, body: bytes, encoding: Optional[str], encoded_etag: Optional[str], headers: Dict[str, str],
+) -> Response:
+    # The page as is, or compressed (and cached compressed) when it is large
+    # enough and the client accepts an encoding
+    if encoding is None or len(body) < HTTP_COMPRESS_MIN_BYTES:
+        return Response(body, media_type="application/json", headers=headers)
+    encoded_key = key + (encoding,)
+    encoded = HISTORY_CACHE.get(encoded_key, etag)
+    if encoded is None:
+        encoded = compress(body, encoding, HTTP_COMPRESS_LEVELS[encoding])
+        HISTORY_CACHE.put(encoded_key, etag, encoded)
+    M_HISTORY_ENCODED_BY[encoding].inc()
+    headers["ETag"] = encoded_etag
+    headers["Content-Encoding"] = encoding
+    return Response(encoded, media_type="application/json", headers=headers)
+
+def validate_message(payload: Any) -> Dict[str, str]:
+    # Normalized {user_id, role, text} of a REST message; ValueError if invalid
+    if not isinstance(payload, dict):
+        raise ValueError("message must be an object")
     user_id = str(payload.get("user_id", "")).strip()
     text = str(payload.get("text", "")).strip()
-    role = (payload.get("role") or "user").strip()
+    role = str(payload.get("role") or "user").strip()
 
     if not user_id or not text:
-        raise HTTPException(status_code=400, detail="user_id and text are required")
+        raise ValueError("user_id and text are required")
+    return {"user_id": user_id, "role": role, "text": text}
+
+@app.get("/api/search/{user_id}")
+async def search_history(user_id: str, q: str = "", limit: int = SEARCH_PAGE_SIZE, offset: int = 0):
+    # Ranked full-text search over the user's retained messages. `q` holds
+    # words, `prefix*` and "quoted phrases", all of which must match.
+    if SEARCH_INDEX is None:
+        raise HTTPException(status_code=404, detail="search is disabled")
+    if limit < 1 or limit > SEARCH_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {SEARCH_MAX_PAGE_SIZE}")
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="offset must be >= 0")
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="q is required")
+    await admit_http(None, user_id)
 
-    msg = {
-        "id": str(uuid.uuid4()),
-        "ts": utc_iso(),
+    t0 = time.perf_counter()
+    hits, total, truncated = SEARCH_INDEX.search(user_id, q, limit, offset)
+    M_SEARCH.observe(time.perf_counter() - t0)
+    hist = MESSAGES.get(user_id)
+    results = [{"score": round(score, 4), "message": hist.get(seq)} for score, seq in hits]
+    return {
         "user_id": user_id,
-        "role": role,
-        "text": text,
+        "q": q,
+        "total": total,
+        "truncated": truncated,  # only the newest matches were ranked
+        "results": results,
+        "next_offset": offset + len(results) if offset + len(results) < total else None,
     }
-    MESSAGES[user_id].append(msg)
+
+@app.post("/api/message")
+async def post_message(payload: Dict[str, Any]):
+    try:
+        fields = validate_message(payload)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    user_id = fields["user_id"]
+    await admit_http(USER_LIMITER, user_id)
+    msg = {"id": str(uuid.uuid4()), "ts": utc_iso(), **fields}
+    await store_message(user_id, msg)
+    M_INGESTED_REST.inc()
 
     await hub.broadcast_to_user(user_id, {"type": "message", "data": msg})
     return {"ok": True, "message": msg}
 
+@app.post("/api/chat")
+async def chat(payload: Dict[str, Any], request: Request):
+    # Assistant reply to a conversation ({"messages": [{role, text|content}],
+    # "user_id"?, "stream"?}). With "stream": true (or Accept:
+    # text/event-stream) the reply frames are streamed back as SSE events;
+    # otherwise the response waits for {"reply": ...}. With a user_id the
+    # last user message and the reply are stored, and the reply streams to
+    # the user's WS/SSE connections too. A client that disconnects cancels
+    # the generation.
+    items = payload.get("messages")
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="expected a non-empty list of messages")
+    context = []
+    for item in items[-ASSISTANT_CONTEXT:]:
+        if isinstance(item, dict):
+            text = str(item.get("text") or item.get("content") or "").strip()
+            if text:
+                context.append({"role": str(item.get("role") or "user"), "text": text})
+    if not context:
+        raise HTTPException(status_code=400, detail="messages have no text")
+
+    started = time.perf_counter()
+    user_id = str(payload.get("user_id") or "").strip() or None
+    reply_to = None
+    await admit_http(USER_LIMITER if user_id else None, user_id or "")
+    if user_id is not None and context[-1]["role"] == "user":
+        prompt = {"id": str(uuid.uuid4()), "ts": utc_iso(), "user_id": user_id, "role": "user", "text": context[-1]["text"]}
+        await store_message(user_id, prompt)
+        M_INGESTED_REST.inc()
+        await hub.broadcast_to_user(user_id, {"type": "message", "data": prompt})
+        reply_to = prompt["id"]
+
+    if payload.get("stream") or "text/event-stream" in request.headers.get("accept", ""):
+        frames: asyncio.Queue = asyncio.Queue()
+
+        async def produce() -> None:
+            try:
+                await stream_reply(user_id, context, reply_to=reply_to, sink=frames.put_nowait, started=started)
+            finally:
+                frames.put_nowait(None)
+
+        async def event_gen():
+            task = asyncio.create_task(produce())
+            try:
+                while (frame := await frames.get()) is not None:
+                    yield f"data: {dumps(frame)}\n\n"
+            finally:
+                task.cancel()  # no-op once finished; stops generating if the client left
+
+        headers = {"Cache-Control": "no-cache, no-transform", "X-Accel-Buffering": "no"}
+        return StreamingResponse(event_gen(), media_type="text/event-stream", headers=headers)
+
+    # Whole reply; the body has been read, so the next receive() only
+    # returns once the client disconnects
+    task = asyncio.create_task(stream_reply(user_id, context, reply_to=reply_to, started=started))
+    gone = asyncio.create_task(request.receive())
+    await asyncio.wait((task, gone), return_when=asyncio.FIRST_COMPLETED)
+    if not task.done():
+        task.cancel()
+        return Response(status_code=499)
+    gone.cancel()
+    msg = task.result()
+    if msg is None:
+        raise HTTPException(status_code=502, detail="assistant reply failed")
+    return {"ok": True, "reply": msg["text"], "message": msg}
+
+@app.get("/api/channels")
+async def list_channels():
+    # Channels known to this worker with their subscriber counts
+    return {"channels": hub.channels.stats()}
+
+@app.get("/api/channels/{name}")
+async def channel_replay(name: str, since: int = 0):
+    # Frames still in the channel's replay buffer after `since` (polling)
+    if not valid_name(name):
+        raise HTTPException(status_code=400, detail="bad channel name")
+    channel = hub.channels.get(name)
+    if channel is None:
+        return {"channel": name, "seq": 0, "gap": since > 0, "messages": []}
+    frames, gap = channel.since(since)
+    return {"channel": name, "seq": channel.seq, "gap": gap, "messages": [loads(text) for text in frames]}
+
+@app.post("/api/channels/{name}")
+async def publish_channel(name: str, request: Request):
+    # The JSON body is published as the "data" of one channel frame
+    if not valid_name(name):
+        raise HTTPException(status_code=400, detail="bad channel name (letters, digits, '_', '.', '-')")
+    try:
+        data = loads(await request.body())
+    except DecodeError:
+        raise HTTPException(status_code=400, detail="body must be JSON")
+    await admit_http(None, name)
+    seq = await hub.publish_channel(name, data)
+    channel = hub.channels.get(name)
+    return {"ok": True, "channel": name, "seq": seq or None, "subscribers": len(channel.subscribers) if channel else 0}
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+@app.post("/api/messages")
+async def post_messages(request: Request):
+    # Bulk ingestion. The body is either JSON ({"messages": [...]} or a bare
+    # list, all-or-nothing) or NDJSON, one message per line, which is read as
+    # a stream: every BULK_BATCH_SIZE valid lines are stored and broadcast as
+    # they arrive and invalid lines are reported instead of failing the rest.
+    # Each batch is one log write and one "batch" frame per connection.
+    ctype = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if ctype in NDJSON_TYPES:
+        return await ingest_ndjson(request)
+
+    try:
+        body = loads(await request.body())
+    except DecodeError:
+        raise HTTPException(status_code=400, detail="body must be JSON or NDJSON")
+    items = body.get("messages") if isinstance(body, dict) else body
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="expected a non-empty list of messages")
+    if len(items) > BULK_MAX_MESSAGES:
+        raise HTTPException(status_code=413, detail=f"at most {BULK_MAX_MESSAGES} messages per request; use NDJSON for more")
+
+    valid = []
+    for i, item in enumerate(items):
+        try:
+            valid.append(validate_message(item))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"messages[{i}]: {e}")
+    # Each user pays for their messages from their bulk budget, all of them
+    # or none (a 429 for one user charges nobody); overload is checked once
+    # up front
+    await admit_http(None, "")
+    await admit_http_all(BULK_LIMITER, Counter(item["user_id"] for item in valid))
+
+    ids: List[str] = []
+    for i in range(0, len(valid), BULK_BATCH_SIZE):
+        ids += await ingest_batch(valid[i:i + BULK_BATCH_SIZE])
+    return {"ok": True, "count": len(ids), "ids": ids}
+
+async def ingest_ndjson(request: Request) -> Dict[str, Any]:
+    await admit_http(None, "")  # refuse to start an upload while overloaded
+    ids: List[str] = []
+    errors: List[Dict[str, Any]] = []
+    rejected = 0
+    pending: List[Dict[str, str]] = []
+    line_no = 0
+
+    def parse(line: bytes) -> None:
+        nonlocal line_no, rejected
+        line_no += 1
+        if not line.strip():
+            return
+        try:
+            pending.append(validate_message(loads(line)))
+        except ValueError as e:  # DecodeError included
+            rejected += 1
+            if len(errors) < 100:
+                errors.append({"line": line_no, "error": str(e)})
+
+    buf = b""
+    async for chunk in request.stream():
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            parse(line)
+        while len(pending) >= BULK_BATCH_SIZE:
+            await pace_batch(pending[:BULK_BATCH_SIZE])
+            ids += await ingest_batch(pending[:BULK_BATCH_SIZE])
+            del pending[:BULK_BATCH_SIZE]
+    parse(buf)
+    if pending:
+        await pace_batch(pending)
+        ids += await ingest_batch(pending)
+    return {"ok": True, "count": len(ids), "ids": ids, "rejected": rejected, "errors": errors}
+
 # -----------------------------------------------------------------------------
 # SSE endpoint
 # -----------------------------------------------------------------------------
 
 @app.get("/sse/{user_id}")
-async def sse(user_id: str, request: Request):
-    q: asyncio.Queue = asyncio.Queue()
-    hub.sse_queues[user_id].append(q)
+async def sse(user_id: str, request: Request, last_event_id: Optional[str] = None, channels: str = ""):
+    # Resume point: the standard Last-Event-ID header sent by EventSource on
+    # reconnect, or ?last_event_id= for the first connect of a new page.
+    # ?channels=news,alerts:41 also subscribes the stream to named channels,
+    # replaying a channel's frames after the seq given with ":".
+    resume_from = request.headers.get("last-event-id") or last_event_id
+    wanted: Dict[str, Optional[int]] = {}
+    for item in filter(None, (part.strip() for part in channels.split(","))):
+        name, _, since = item.partition(":")
+        if not valid_name(name) or (since and not since.isdigit()):
+            raise HTTPException(status_code=400, detail=f"bad channel {item!r} (expected name or name:seq)")
+        wanted[name] = int(since) if since else None
+    if len(wanted) > CHANNEL_MAX_PER_CONN:
+        raise HTTPException(status_code=400, detail=f"at most {CHANNEL_MAX_PER_CONN} channels per connection")
+
+    conn = hub.add_sse(user_id)
+    channel_infos: Dict[str, Any] = {}
+    for name, since in wanted.items():
+        channel_infos[name], frames = hub.subscribe(conn, name, since)
+        for text in frames:
+            hub.send_json(conn, text)
+
+    # Compute the replay right after registering (no await in between):
+    # messages stored before this point are replayed, later ones arrive live.
+    cursor = MESSAGES.next_seq(user_id)
+    hello_id = cursor
+    replay: List[str] = []
+    resync: Optional[str] = None
+    if resume_from is not None and hub.backplane.name != "inproc":
+        # Ids are this worker's seqs; the one the client saw may not match
+        resync = "resume is not supported with multiple workers"
+    elif resume_from is not None:
+        try:
+            since = int(resume_from)
+        except ValueError:
+            since = -1
+        hist = MESSAGES.get(user_id)
+        first = hist.first_seq if hist is not None else 0
+        if since < 0 or since > cursor:
+            resync = "unknown event id"
+        elif since < first or cursor - since > SSE_REPLAY_LIMIT:
+            resync = "gap too old to replay"
+        elif since < cursor:
+            hello_id = since  # keep ids monotonic: hello precedes the replay
+            replay = [
+                sse_event(dumps({"type": "message", "data": m}), seq + 1)
+                for seq, m in zip(range(since, cursor), hist.range(since, cursor))
+            ]
 
     async def event_gen():
-        # Send a "hello" event
-        await q.put({"type": "sse_hello", "data": {"ts": utc_iso(), "note": "connected"}})
+        # Send a "hello" event, then any missed messages, then live events
+        hello = {"ts": utc_iso(), "note": "connected"}
+        if channel_infos:
+            hello["channels"] = channel_infos
+        yield sse_event(dumps({"type": "sse_hello", "data": hello}), hello_id)
+        if resync is not None:
+            # Client must refetch /api/history; the id moves it to the present
+            yield sse_event(dumps({"type": "resync_required", "data": {"reason": resync, "last_event_id": resume_from}}), cursor)
+        for chunk in replay:
+            yield chunk
 
         try:
             while True:
-                # If no data within 25s, send a keepalive comment
-                try:
-                    item = await asyncio.wait_for(q.get(), timeout=25)
-                    yield f"data: {json.dumps(item, ensure_ascii=False)}\n\n"
-                except asyncio.TimeoutError:
-                    yield f": keepalive {utc_iso()}\n\n"
+                # Keepalive comments are queued by the hub's timer wheel
+                # when the stream has been quiet for KEEPALIVE_INTERVAL
+                chunk = await conn.outbox.get()
+                if chunk is None:
+                    if conn.outbox.overflowed:
+                        M_SEND_FAILURES.labels("sse", "overflow").inc()
+                    break  # outbox closed (overflow); the client resumes from its last id
+                if COALESCE_WINDOW:
+                    # Consecutive SSE events concatenate into one chunk as-is
+                    chunks = await conn.outbox.collect(chunk, COALESCE_WINDOW, COALESCE_MAX_BYTES)
+                    chunk = "".join(chunks)
+                    M_WRITE_FRAMES_SSE.observe(len(chunks))
+                M_SSE_DEPTH.observe(len(conn.outbox))
+                yield chunk
 
                 if await request.is_disconnected():
                     break
         finally:
-            try:
-                hub.sse_queues[user_id].remove(q)
-            except ValueError:
-                pass
+            hub.remove_sse(user_id, conn)
 
     headers = {
         "Cache-Control": "no-cache, no-transform",
@@ -177,44 +1550,177 @@ async def sse(user_id: str, request: Request):
 # WebSocket (chat) endpoint
 # -----------------------------------------------------------------------------
 
+def accept_codec(websocket: WebSocket) -> Codec:
+    # Pick the encoding from the client's subprotocol list ("msgpack",
+    # "json"); clients that ask for none get JSON text frames as before.
+    return negotiate(websocket.scope.get("subprotocols") or ())
+
+async def admit_ws(conn: Connection, limiter: Optional[RateLimiter], mtype: Any, cost: int = 1, shed: bool = True) -> bool:
+    # admit() for WebSocket frames. A short delay is waited out (the socket
+    # is not read meanwhile); a rejected frame is dropped and the client
+    # gets a "throttle" frame saying when to retry.
+    reason, wait = admit(limiter, conn.key, cost, shed)
+    if reason is not None:
+        conn.send({"type": "throttle", "data": {"reason": reason, "retry_after": round(wait, 3), "dropped": mtype}, "ts": utc_iso()})
+        return False
+    if wait:
+        await asyncio.sleep(wait)
+    return True
+
+def channel_command(conn: Connection, mtype: str, data: Any) -> None:
+    # {"type": "subscribe", "data": {"channels": [...], "since": {name: seq}}}
+    # answered with "subscribed" (each channel's seq), followed by the frames
+    # replayed for channels named in "since";
+    # {"type": "unsubscribe", "data": {"channels": [...]}} with "unsubscribed"
+    data = data if isinstance(data, dict) else {}
+    names = data.get("channels")
+    if isinstance(names, str):
+        names = [names]
+    if not isinstance(names, list) or not names or not all(valid_name(n) for n in names):
+        conn.send({"type": "error", "data": {"reason": "channels must be a list of names (letters, digits, '_', '.', '-')"}, "ts": utc_iso()})
+        return
+    if mtype == "unsubscribe":
+        for name in names:
+            hub.channels.unsubscribe(name, conn)
+        conn.send({"type": "unsubscribed", "data": {"channels": names}, "ts": utc_iso()})
+        return
+    if len(hub.channels.channels_of(conn) | set(names)) > CHANNEL_MAX_PER_CONN:
+        conn.send({"type": "error", "data": {"reason": f"at most {CHANNEL_MAX_PER_CONN} channels per connection"}, "ts": utc_iso()})
+        return
+    since = data.get("since") if isinstance(data.get("since"), dict) else {}
+    infos: Dict[str, Any] = {}
+    replay: List[str] = []
+    for name in names:
+        seq = since.get(name)
+        infos[name], frames = hub.subscribe(conn, name, seq if isinstance(seq, int) and seq >= 0 else None)
+        replay += frames
+    conn.send({"type": "subscribed", "data": {"channels": infos}, "ts": utc_iso()})
+    for text in replay:
+        hub.send_json(conn, text)
+
+def validate_batch(items: List[Any], user_id: str, ts: str) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    # Messages of a WS "batch" frame, checked with validate_message (the
+    # user is the connection's); extra fields are kept as for "message".
+    # Returns (messages, None), or ([], error) naming the first bad item.
+    batch = []
+    for i, item in enumerate(items):
+        try:
+            fields = validate_message({**item, "user_id": user_id} if isinstance(item, dict) else item)
+        except ValueError as e:
+            return [], {"reason": f"data[{i}]: {e}", "index": i}
+        batch.append({**item, **fields, "echoed": True, "ts": ts})
+    return batch, None
+
 @app.websocket("/ws/{user_id}")
 async def ws_chat(websocket: WebSocket, user_id: str):
-    await websocket.accept()
-    await hub.add_ws_user(user_id, websocket)
+    codec = accept_codec(websocket)
+    await websocket.accept(subprotocol=codec.name if codec else None)
+    conn = hub.add_ws_user(user_id, websocket, codec or JSON)
 
     # Send a greeting
-    await websocket.send_text(json.dumps({"type": "ws_hello", "data": {"ts": utc_iso(), "user_id": user_id}}))
+    conn.send({"type": "ws_hello", "data": {"ts": utc_iso(), "user_id": user_id}})
 
     try:
         while True:
-            raw = await websocket.receive_text()
-            try:
-                msg = json.loads(raw)
-            except json.JSONDecodeError:
-                msg = {"type": "text", "data": {"text": raw}}
+            msg = await conn.receive()
+            if isinstance(msg, str):
+                msg = {"type": "text", "data": {"text": msg}}
 
             mtype = msg.get("type")
 
             if mtype == "ping":
-                await websocket.send_text(json.dumps({"type": "pong", "ts": utc_iso()}))
+                conn.send({"type": "pong", "ts": utc_iso()})
+                continue
+
+            if mtype == "pong":
+                continue  # answer to the server's keepalive ping
+
+            # Frames that shed work are never throttled
+            if mtype == "cancel":
+                data = msg.get("data") if isinstance(msg.get("data"), dict) else {}
+                conn.cancel_reply(data.get("reply_id"))
+                continue
+
+            if mtype == "unsubscribe":
+                channel_command(conn, mtype, msg.get("data"))
+                continue
+
+            # Batches pay for the messages they carry once validated (below)
+            if mtype != "batch" and not await admit_ws(conn, USER_LIMITER, mtype):
                 continue
 
             if mtype == "message":
                 # Echo back
-                await websocket.send_text(json.dumps({"type": "echo", "data": msg.get("data")}, ensure_ascii=False))
+                conn.send({"type": "echo", "data": msg.get("data")})
+                data = {**(msg.get("data") or {}), "echoed": True, "ts": utc_iso()}
+                # Messages with text are kept in history like REST ones
+                if str(data.get("text", "")).strip():
+                    data["id"] = str(uuid.uuid4())
+                    data.setdefault("role", "user")
+                    data["user_id"] = user_id
+                    await store_message(user_id, data)
+                    M_INGESTED_WS.inc()
                 # Also broadcast to the same user's channels
-                await hub.broadcast_to_user(user_id, {"type": "message", "data": {**(msg.get("data") or {}), "echoed": True, "ts": utc_iso()}})
+                await hub.broadcast_to_user(user_id, {"type": "message", "data": data})
+                continue
+
+            if mtype == "prompt":
+                # Stored like a "message", then answered by the assistant:
+                # the reply streams to all of the user's connections as
+                # "delta" frames and is cancelled if this client goes away
+                # (or sends {"type": "cancel"})
+                data = msg.get("data") if isinstance(msg.get("data"), dict) else {}
+                text = str(data.get("text", "")).strip()
+                if not text:
+                    conn.send({"type": "error", "data": {"reason": "prompt text is required"}, "ts": utc_iso()})
+                    continue
+                started = time.perf_counter()
+                prompt = {"id": str(uuid.uuid4()), "ts": utc_iso(), "user_id": user_id, "role": "user", "text": text}
+                await store_message(user_id, prompt)
+                M_INGESTED_WS.inc()
+                await hub.broadcast_to_user(user_id, {"type": "message", "data": prompt})
+                reply_id = str(uuid.uuid4())
+                conn.start_reply(reply_id, stream_reply(user_id, history_context(user_id), reply_id, prompt["id"], started=started))
+                continue
+
+            if mtype == "subscribe":
+                channel_command(conn, mtype, msg.get("data"))
+                continue
+
+            if mtype == "batch":
+                # Many messages in one frame: validated all-or-nothing like
+                # POST /api/messages, stored in one operation and broadcast
+                # as one "batch" frame, acknowledged once (no per-message echo)
+                items = msg.get("data")
+                if not isinstance(items, list) or not items or len(items) > BULK_MAX_MESSAGES:
+                    conn.send({"type": "error", "data": {"reason": f"batch data must be a non-empty list of at most {BULK_MAX_MESSAGES} messages"}, "ts": utc_iso()})
+                    continue
+                ts = utc_iso()
+                batch, error = validate_batch(items, user_id, ts)
+                if error is not None:
+                    conn.send({"type": "error", "data": error, "ts": ts})
+                    continue
+                if not await admit_ws(conn, BULK_LIMITER, mtype, len(batch)):
+                    continue
+                for data, msg_id in zip(batch, new_ids(len(batch))):
+                    data["id"] = msg_id
+                await store_messages({user_id: batch})
+                M_INGESTED_WS.inc(len(batch))
+                M_BATCH_SIZE.observe(len(batch))
+                await hub.broadcast_to_user(user_id, {"type": "batch", "data": batch})
+                conn.send({"type": "batch_ack", "data": {"count": len(batch), "ids": [data["id"] for data in batch]}, "ts": ts})
                 continue
 
             # Unknown message type -> acknowledge anyway
-            await websocket.send_text(json.dumps({"type": "ack", "data": msg, "ts": utc_iso()}, ensure_ascii=False))
+            conn.send({"type": "ack", "data": msg, "ts": utc_iso()})
 
     except WebSocketDisconnect:
         # Client closed connection
-        await hub.remove_ws_user(user_id, websocket)
-    except Exception as e:
-        await hub.remove_ws_user(user_id, websocket)
-        # Optionally log in real world
+        hub.remove_ws_user(user_id, conn)
+    except Exception:
+        hub.remove_ws_user(user_id, conn)
+        M_HANDLER_ERRORS.labels("ws").inc()
+        log.exception("ws_chat handler failed for user %s", user_id)
         await asyncio.sleep(0)  # yield to event loop
 
 # -----------------------------------------------------------------------------
@@ -223,27 +1729,83 @@ async def ws_chat(websocket: WebSocket, user_id: str):
 
 @app.websocket("/signal/{room_id}")
 async def ws_signal(websocket: WebSocket, room_id: str):
-    await websocket.accept()
-    await hub.add_ws_room(room_id, websocket)
-    await websocket.send_text(json.dumps({"type": "signal_hello", "room": room_id, "ts": utc_iso()}))
+    codec = accept_codec(websocket)
+    await websocket.accept(subprotocol=codec.name if codec else None)
+    conn = hub.add_ws_room(room_id, websocket, codec or JSON)
+    # The hello carries our peer id and who is already in the room
+    conn.send({
+        "type": "signal_hello", "room": room_id, "peer_id": conn.peer,
+        "peers": hub.room_peer_ids(room_id, exclude=conn.peer), "ts": utc_iso(),
+    })
 
     try:
         while True:
-            raw = await websocket.receive_text()
-            try:
-                payload = json.loads(raw)
-            except json.JSONDecodeError:
-                payload = {"type": "raw", "data": raw}
+            payload = await conn.receive()
+            if isinstance(payload, str):
+                payload = {"type": "raw", "data": payload}
+            elif payload.get("type") == "pong":
+                continue  # answer to the server's keepalive ping
+            # Paced per peer, never shed or rejected: dropping an offer or a
+            # candidate would break the call being set up. A peer over its
+            # rate waits, and its socket is not read meanwhile.
+            await pace(PEER_LIMITER, f"{room_id}/{conn.peer}")
+            if payload.get("type") in ("subscribe", "unsubscribe"):
+                channel_command(conn, payload["type"], payload.get("data"))
+                continue
 
             payload.setdefault("ts", utc_iso())
-            await hub.broadcast_room(room_id, payload, sender=websocket)
+            payload["from"] = conn.peer
+            # Offers, answers and candidates name their target in "to";
+            # anything without one is still relayed to the whole room
+            to = payload.get("to")
+            if to is None:
+                await hub.broadcast_room(room_id, payload, sender=conn)
+            elif not hub.send_to_peer(room_id, str(to), payload):
+                conn.send({"type": "error", "data": {"reason": "unknown peer", "to": to}, "ts": utc_iso()})
 
     except WebSocketDisconnect:
-        await hub.remove_ws_room(room_id, websocket)
+        hub.remove_ws_room(room_id, conn)
     except Exception:
-        await hub.remove_ws_room(room_id, websocket)
+        hub.remove_ws_room(room_id, conn)
+        M_HANDLER_ERRORS.labels("signal").inc()
+        log.exception("ws_signal handler failed for room %s", room_id)
         await asyncio.sleep(0)
 
+# -----------------------------------------------------------------------------
+# Connection introspection
+# -----------------------------------------------------------------------------
+
+@app.get("/__dev__/connections")
+async def dev_connections():
+    # Per-connection outbound queue depth and drop counters
+    return {"connections": hub.connection_stats()}
+
+# -----------------------------------------------------------------------------
+# Profiling
+# -----------------------------------------------------------------------------
+
+@app.get("/__dev__/profile")
+async def dev_profile(seconds: float = 5, interval_ms: float = 5, idle: bool = True):
+    # Sample the event loop's stack for `seconds` and return the counts in
+    # collapsed-stack format (flamegraph.pl / speedscope). idle=false leaves
+    # out samples of the loop waiting for I/O.
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {PROFILE_MAX_SECONDS:g}]")
+    if not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="interval_ms must be between 1 and 1000")
+    if PROFILE_SLOT.locked():
+        raise HTTPException(status_code=409, detail="a profile is already running")
+    async with PROFILE_SLOT:
+        loop_thread = threading.get_ident()
+        counts = await asyncio.to_thread(sample_stacks, loop_thread, seconds, interval_ms / 1000, idle)
+    return PlainTextResponse(render_collapsed(counts))
+
+@app.get("/__dev__/profile/slow")
+async def dev_profile_slow():
+    # Loop lag and the most recent callbacks that blocked the loop, with
+    # the stack each was blocked in
+    return {"lag_ms": round(SHEDDER.lag * 1000, 2), **LOOP_MONITOR.stats()}
+
 # -----------------------------------------------------------------------------
 # Сlear everything
 # -----------------------------------------------------------------------------
@@ -252,4 +1814,9 @@ async def ws_signal(websocket: WebSocket, room_id: str):
 async def dev_reset():
     # Clear messages
     MESSAGES.clear()
+    HISTORY_CACHE.clear()
+    hub.channels.clear_replay()
+    hub.backplane.publish("x", "", "")
+    if MESSAGE_LOG is not None:
+        await MESSAGE_LOG.reset()
     return {"ok": True, "reset_at": utc_iso()}
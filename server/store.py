@@ -0,0 +1,224 @@
+"""
+store.py — Bounded, indexed per-user message store.
+
+Each user gets a fixed-size ring buffer. Every appended message receives a
+per-user sequence number (monotonic, never reused), which is what the ring
+is addressed by, so any page of history is a direct slice:
+
+  - seq -> slot is `seq % capacity`
+  - message id -> seq is a dict lookup
+  - timestamp -> seq is a binary search (timestamps are assigned on append,
+    so they are already ordered within a user)
+
+Reads therefore cost O(page size) (+ O(log n) for timestamp cursors) no
+matter how long a conversation is, and memory per user never exceeds
+`capacity` messages.
+
+An optional SearchIndex is told about every append and eviction, so it
+covers exactly the retained messages.
+"""
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from search import SearchIndex
+
+
+def parse_ts(value: str) -> Optional[datetime]:
+    """Parse an ISO-8601 timestamp (naive values are treated as UTC)."""
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+class UserHistory:
+    """Ring buffer of one user's messages, addressed by sequence number."""
+
+    __slots__ = ("capacity", "_ring", "_first", "_next", "_by_id")
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._ring: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self._first = 0  # oldest retained seq
+        self._next = 0   # seq the next append will get
+        self._by_id: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return self._next - self._first
+
+    @property
+    def first_seq(self) -> int:
+        return self._first
+
+    @property
+    def next_seq(self) -> int:
+        return self._next
+
+    def append(self, msg: Dict[str, Any]) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """Store msg; returns (its seq, the evicted message or None)."""
+        seq = self._next
+        slot = seq % self.capacity
+        evicted = None
+        if seq - self._first >= self.capacity:
+            evicted = self._ring[slot]
+            if evicted is not None:
+                self._by_id.pop(evicted.get("id"), None)
+            self._first += 1
+        self._ring[slot] = msg
+        if msg.get("id") is not None:
+            self._by_id[msg["id"]] = seq
+        self._next = seq + 1
+        return seq, evicted
+
+    def get(self, seq: int) -> Optional[Dict[str, Any]]:
+        if self._first <= seq < self._next:
+            return self._ring[seq % self.capacity]
+        return None
+
+    def seq_of(self, msg_id: str) -> Optional[int]:
+        return self._by_id.get(msg_id)
+
+    def seq_at_ts(self, ts: datetime, strict: bool = False) -> int:
+        """First retained seq whose timestamp is >= ts (> ts if strict)."""
+        lo, hi = self._first, self._next
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mts = parse_ts(self._ring[mid % self.capacity].get("ts", ""))
+            if mts is not None and (mts <= ts if strict else mts < ts):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def range(self, start: int, stop: int) -> List[Dict[str, Any]]:
+        """Messages with start <= seq < stop, clamped to what is retained."""
+        start = max(start, self._first)
+        stop = min(stop, self._next)
+        ring, cap = self._ring, self.capacity
+        return [ring[s % cap] for s in range(start, stop)]
+
+    def iter_seq(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        for seq in range(self._first, self._next):
+            yield seq, self._ring[seq % self.capacity]
+
+
+class MessageStore:
+    """All users' histories, each capped at `retention` messages."""
+
+    def __init__(self, retention: int = 1000, index: Optional[SearchIndex] = None) -> None:
+        if retention <= 0:
+            raise ValueError("retention must be positive")
+        self.retention = retention
+        self.index = index  # kept in step with appends and evictions
+        self._users: Dict[str, UserHistory] = {}
+        self.epoch = 0  # bumped by clear() so versions never repeat
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._users
+
+    def get(self, user_id: str) -> Optional[UserHistory]:
+        return self._users.get(user_id)
+
+    def append(self, user_id: str, msg: Dict[str, Any]) -> int:
+        hist = self._users.get(user_id)
+        if hist is None:
+            hist = self._users[user_id] = UserHistory(self.retention)
+        seq, evicted = hist.append(msg)
+        if self.index is not None:
+            if evicted is not None:
+                self.index.evict(user_id, seq - self.retention)
+            self.index.add(user_id, seq, msg)
+        return seq
+
+    def extend(self, user_id: str, msgs: List[Dict[str, Any]]) -> int:
+        """Append msgs in order; returns the seq of the first one."""
+        hist = self._users.get(user_id)
+        if hist is None:
+            hist = self._users[user_id] = UserHistory(self.retention)
+        first = hist.next_seq
+        append = hist.append
+        if self.index is None:
+            for msg in msgs:
+                append(msg)
+            return first
+        index = self.index
+        for msg in msgs:
+            seq, evicted = append(msg)
+            if evicted is not None:
+                index.evict(user_id, seq - self.retention)
+            index.add(user_id, seq, msg)
+        return first
+
+    def retains(self, user_id: str, msg_id: Any) -> bool:
+        """Whether the message is still within user_id's retention."""
+        hist = self._users.get(user_id)
+        return hist is not None and hist.seq_of(msg_id) is not None
+
+    def next_seq(self, user_id: str) -> int:
+        """Number of messages ever appended for user_id (0 if none)."""
+        hist = self._users.get(user_id)
+        return hist.next_seq if hist is not None else 0
+
+    def version(self, user_id: str) -> Tuple[int, int]:
+        """Changes whenever user_id's history does (append, eviction, clear)."""
+        return self.epoch, self.next_seq(user_id)
+
+    def resolve_cursor(self, user_id: str, cursor: str, after: bool = False) -> Optional[int]:
+        """
+        Turn a `before`/`after` cursor into a seq usable as an exclusive
+        bound. A cursor is either a message id or an ISO timestamp; returns
+        None if it matches neither.
+        """
+        hist = self._users.get(user_id)
+        if hist is None:
+            return None
+        seq = hist.seq_of(cursor)
+        if seq is not None:
+            return seq
+        ts = parse_ts(cursor)
+        if ts is None:
+            return None
+        if after:
+            return hist.seq_at_ts(ts, strict=True) - 1
+        return hist.seq_at_ts(ts)
+
+    def page(
+        self,
+        user_id: str,
+        limit: int,
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+    ) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        One page of history in chronological order, plus whether more
+        messages exist beyond it (older ones, or newer ones when paging
+        forward with only `after`). `before` is exclusive, `after` exclusive.
+        """
+        hist = self._users.get(user_id)
+        if hist is None or limit <= 0:
+            return [], False
+        lo = hist.first_seq if after is None else max(hist.first_seq, after + 1)
+        hi = hist.next_seq if before is None else min(hist.next_seq, before)
+        if lo >= hi:
+            return [], False
+        if after is not None and before is None:
+            stop = min(hi, lo + limit)
+            return hist.range(lo, stop), stop < hi
+        start = max(lo, hi - limit)
+        return hist.range(start, hi), start > lo
+
+    def snapshot(self) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """(user_id, retained messages oldest first) for every user."""
+        for user_id, hist in list(self._users.items()):
+            yield user_id, hist.range(hist.first_seq, hist.next_seq)
+
+    def clear(self) -> None:
+        self._users.clear()
+        self.epoch += 1
+        if self.index is not None:
+            self.index.clear()
@@ -0,0 +1,94 @@
+"""
+timers.py — Hashed timing wheel for connection keepalives and idle timeouts.
+
+One wheel serves every connection: the event loop holds a single timer
+handle (the next tick) no matter how many connections are scheduled, and
+scheduling or cancelling a timer is an O(1) set operation.
+
+Timers fire on tick boundaries, so a delay is rounded up to a whole number
+of ticks (`tick` seconds each). Timers further out than one rotation
+(`tick * slots`) simply stay in their slot for extra rotations.
+Callbacks run on the event loop and must not block; an exception in one
+is logged and does not affect the others.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+from typing import Any, Callable, List, Optional, Set
+
+log = logging.getLogger("realtime.timers")
+
+
+class Timer:
+    __slots__ = ("due", "callback", "args", "_slot")
+
+    def __init__(self, due: int, callback: Callable[..., Any], args: tuple, slot: Set["Timer"]) -> None:
+        self.due = due  # absolute tick number
+        self.callback = callback
+        self.args = args
+        self._slot: Optional[Set["Timer"]] = slot
+
+    def cancel(self) -> None:
+        if self._slot is not None:
+            self._slot.discard(self)
+            self._slot = None
+
+    @property
+    def active(self) -> bool:
+        return self._slot is not None
+
+
+class TimerWheel:
+    def __init__(self, tick: float = 0.5, slots: int = 512) -> None:
+        if tick <= 0 or slots <= 0:
+            raise ValueError("tick and slots must be positive")
+        self.tick = tick
+        self._slots: List[Set[Timer]] = [set() for _ in range(slots)]
+        self._now = 0          # ticks processed so far
+        self._start: Optional[float] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def __len__(self) -> int:
+        return sum(len(s) for s in self._slots)
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._start = self._loop.time() - self._now * self.tick
+        self._handle = self._loop.call_at(self._start + (self._now + 1) * self.tick, self._advance)
+
+    def close(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        for slot in self._slots:
+            for timer in slot:
+                timer._slot = None
+            slot.clear()
+
+    def schedule(self, delay: float, callback: Callable[..., Any], *args: Any) -> Timer:
+        """Call callback(*args) after at least `delay` seconds."""
+        due = self._now + max(1, math.ceil(delay / self.tick))
+        slot = self._slots[due % len(self._slots)]
+        timer = Timer(due, callback, args, slot)
+        slot.add(timer)
+        return timer
+
+    def _advance(self) -> None:
+        # Catch up on every tick that has elapsed (the loop may have lagged)
+        target = int((self._loop.time() - self._start) / self.tick)
+        while self._now < target:
+            self._now += 1
+            slot = self._slots[self._now % len(self._slots)]
+            due = [t for t in slot if t.due <= self._now]
+            for timer in due:
+                slot.discard(timer)
+                timer._slot = None
+            for timer in due:
+                try:
+                    timer.callback(*timer.args)
+                except Exception:
+                    log.exception("timer callback %r failed", timer.callback)
+        self._handle = self._loop.call_at(self._start + (self._now + 1) * self.tick, self._advance)